@@ -0,0 +1,78 @@
+# bench_lookups.py - Микро-бенчмарк поиска записей по id и пути в MovieManager
+# Сравнивает линейный проход по списку (как было раньше) с хеш-индексами менеджера,
+# а подсчет статистики четырьмя проходами - с накопительными итогами (get_movies_stats).
+#
+# Запуск: python benchmarks/bench_lookups.py --count 50000
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as kinoman  # noqa: E402
+from synthetic_library import make_records  # noqa: E402
+
+
+def bench(label, func, number):
+    per_call = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {label:<45} {per_call * 1e6:12.2f} мкс")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска записей по id и пути")
+    parser.add_argument('--count', type=int, default=50000, help="Количество записей в библиотеке")
+    parser.add_argument('--number', type=int, default=200, help="Количество вызовов в одном замере")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='kinoman-bench-')
+    records = make_records(args.count, os.path.join(tmp_dir, 'movies'))
+    manager = kinoman.MovieManager(os.path.join(tmp_dir, 'movies_db.json'), backend='json')
+    manager.movies = records
+    movies = manager.movies
+
+    rnd = random.Random(42)
+    ids = [m['id'] for m in rnd.sample(records, min(100, len(records)))]
+    paths = [m['path'] for m in rnd.sample(records, min(100, len(records)))]
+
+    def linear_by_id():
+        movie_id = rnd.choice(ids)
+        return next((m for m in movies if m['id'] == movie_id), None)
+
+    def linear_by_path():
+        path = os.path.normpath(rnd.choice(paths))
+        return any(os.path.normpath(m['path']) == path for m in movies)
+
+    def indexed_by_id():
+        return manager.get_movie_details(rnd.choice(ids))
+
+    def indexed_by_path():
+        return manager.get_movie_by_path(rnd.choice(paths)) is not None
+
+    def stats_by_passes():
+        movies = manager.movies
+        valid_ratings = [m.get('rating', 0) for m in movies if isinstance(m.get('rating'), (int, float))]
+        return (len(movies), sum(m.get('size', 0) for m in movies), sum(m.get('duration', 0) for m in movies),
+                round(sum(valid_ratings) / len(valid_ratings), 1) if valid_ratings else 0.0)
+
+    print(f"Библиотека: {args.count} записей")
+    print("Поиск по id (get_movie_details, update_movie_info, delete_movie):")
+    slow = bench("линейный проход", linear_by_id, args.number)
+    fast = bench("индекс id -> запись", indexed_by_id, args.number)
+    print(f"  ускорение: x{slow / fast:.0f}")
+    print("Проверка дубликата по пути (add_movie_from_path):")
+    slow = bench("нормализация всех путей", linear_by_path, max(1, args.number // 10))
+    fast = bench("индекс нормализованный путь -> запись", indexed_by_path, args.number)
+    print(f"  ускорение: x{slow / fast:.0f}")
+    print("Статистика библиотеки (updateStats после каждого действия):")
+    slow = bench("четыре прохода по списку", stats_by_passes, max(1, args.number // 10))
+    fast = bench("накопительные итоги с группами", manager.get_movies_stats, args.number)
+    print(f"  ускорение: x{slow / fast:.0f}")
+
+
+if __name__ == '__main__':
+    main()
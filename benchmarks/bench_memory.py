@@ -0,0 +1,98 @@
+# bench_memory.py - Память процесса после открытия библиотеки: json.load (как раньше) и MovieManager
+# Каждый вариант открывается в отдельном процессе, замер - прирост RSS (/proc/self/statm, Linux)
+# после загрузки: так учитываются и объекты Python, и буферы array/bytearray, и фрагментация кучи.
+#
+# Запуск: python benchmarks/bench_memory.py --count 100000
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as kinoman  # noqa: E402
+import synthetic_library  # noqa: E402
+
+VARIANTS = (
+    ('json', "словари после json.load (как раньше)"),
+    ('sqlite', "MovieManager, SQLite-база без снимка"),
+    ('snapshot', "MovieManager из снимка библиотеки"),
+)
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+
+def child(variant, tmp_dir):
+    """Открывает библиотеку одним способом и печатает JSON {'rss': прирост МБ, 'seconds': время}."""
+    db_file = os.path.join(tmp_dir, 'movies_db.json')
+    gc.collect()
+    before = rss_mb()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if variant == 'json':
+            with open(os.path.join(tmp_dir, 'records.json'), encoding='utf-8') as f:
+                result = json.load(f)
+        else:
+            result = kinoman.MovieManager(db_file, snapshot=variant == 'snapshot')
+            assert result.loaded_from_snapshot == (variant == 'snapshot')
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    print(json.dumps({'rss': rss_mb() - before, 'seconds': elapsed}))
+    del result
+
+
+def measure(variant, tmp_dir):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', variant, '--dir', tmp_dir],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк памяти под записи библиотеки")
+    parser.add_argument('--count', type=int, default=100000, help="Количество записей в библиотеке")
+    parser.add_argument('--described', type=float, default=0.1, help="Доля записей с собственным описанием")
+    parser.add_argument('--child', choices=[name for name, _ in VARIANTS], help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.dir)
+        return
+
+    tmp_dir = tempfile.mkdtemp(prefix='kinoman-bench-')
+    records = synthetic_library.make_records(args.count, os.path.join(tmp_dir, 'movies'), args.described)
+    # Базовый вариант - файл в формате JSON-базы (indent=4), как его читала прежняя версия
+    with open(os.path.join(tmp_dir, 'records.json'), 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=4)
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager = kinoman.MovieManager(os.path.join(tmp_dir, 'movies_db.json'), snapshot=True)
+        manager.movies = records
+        manager._save_movies()
+        manager.save_snapshot()
+    manager.storage.close()
+    del records, manager
+
+    print(f"Библиотека: {args.count} записей, с описанием: {args.described:.0%}")
+    print("Прирост памяти процесса после открытия:")
+    baseline = None
+    for variant, label in VARIANTS:
+        result = measure(variant, tmp_dir)
+        line = f"  {label:<40} {result['rss']:8.1f} МБ  ({result['seconds']:.2f} с)"
+        if baseline is None:
+            baseline = result['rss']
+        else:
+            line += f"  сокращение: x{baseline / max(result['rss'], 0.1):.1f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
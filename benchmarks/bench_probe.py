@@ -0,0 +1,174 @@
+# bench_probe.py - Бенчмарк обработки нового файла при сканировании
+# Сравнивает прежний двухшаговый путь (ffprobe + отдельное открытие через OpenCV для превью,
+# функции прежней версии main.py сохранены здесь для сравнения) с единым проходом probe_media для каждого доступного движка, затем кодирование превью:
+# прежний один JPEG 300x300 против всех размеров encode_thumbnail (обычный и быстрый путь).
+#
+# Запуск: python benchmarks/bench_probe.py --count 8
+#         python benchmarks/bench_probe.py --dir /path/to/movies
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as kinoman  # noqa: E402
+
+
+def make_videos(count, seconds, width, height, target_dir):
+    """Записывает синтетические ролики через cv2.VideoWriter (mp4v) и возвращает их пути."""
+    paths = []
+    fps = 25
+    for i in range(count):
+        path = os.path.join(target_dir, f"Synthetic.Movie.{i}.mp4")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        for n in range(seconds * fps):
+            frame = np.full((height, width, 3), (n * 3 + i * 40) % 256, np.uint8)
+            cv2.putText(frame, f"{i}:{n}", (20, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+            writer.write(frame)
+        writer.release()
+        paths.append(path)
+    return paths
+
+
+def list_videos(movies_dir):
+    return sorted(os.path.join(root, name)
+                  for root, _, files in os.walk(movies_dir)
+                  for name in files if name.lower().endswith(kinoman.SUPPORTED_FORMATS))
+
+
+def get_video_metadata_with_ffprobe(file_path):
+    """Прежний первый шаг: отдельный запуск ffprobe за длительностью и разрешением первого видеопотока."""
+    try:
+        cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'stream=duration,width,height', '-of', 'json', file_path]
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True,
+                                creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == "Windows" else 0)
+        streams = json.loads(result.stdout).get('streams') or [{}]
+        try:
+            duration = float(streams[0].get('duration', 0))
+        except ValueError:
+            duration = 0
+        return {'duration': int(duration), 'width': streams[0].get('width', 0), 'height': streams[0].get('height', 0)}
+    except (OSError, subprocess.CalledProcessError, json.JSONDecodeError):
+        return {'duration': 0, 'width': 0, 'height': 0}
+
+
+def generate_thumbnail_with_opencv(file_path, thumbnail_path):
+    """Прежний второй шаг: повторное открытие файла через OpenCV, кадр на 10% длительности, JPEG 300x300."""
+    cap = cv2.VideoCapture(file_path)
+    if not cap.isOpened():
+        return False
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_duration_ms = (frame_count / fps) * 1000 if fps > 0 else 0
+    if total_duration_ms > 0:
+        cap.set(cv2.CAP_PROP_POS_MSEC, total_duration_ms * 0.1)
+    else:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    ret, frame = cap.read()
+    cap.release()
+    if not ret:
+        return False
+    img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    img.thumbnail((300, 300), Image.Resampling.LANCZOS)
+    img.save(thumbnail_path, quality=85)
+    return True
+
+
+def legacy_ingest(path, thumbnail_path):
+    get_video_metadata_with_ffprobe(path)
+    generate_thumbnail_with_opencv(path, thumbnail_path)
+
+
+def bench(label, func, paths, thumbs_dir, repeat):
+    """Среднее время обработки одного файла (лучший из repeat проходов по всем файлам)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # Логи обработки каждого файла не нужны в выводе бенчмарка
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, path in enumerate(paths):
+                func(path, os.path.join(thumbs_dir, f"{i}.jpg"))
+        elapsed = (time.perf_counter() - start) / len(paths)
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<45} {best * 1e3:10.1f} мс/файл")
+    return best
+
+
+def legacy_encode(frame):
+    img = frame.convert('RGB')
+    img.thumbnail((300, 300), kinoman.Image.Resampling.LANCZOS)
+    img.save(io.BytesIO(), 'JPEG', quality=85)
+
+
+def encode_bench(label, func, frames, repeat):
+    """Среднее время кодирования превью одного кадра (лучший из repeat проходов)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            func(frame)
+        elapsed = (time.perf_counter() - start) / len(frames)
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<45} {best * 1e3:10.1f} мс/кадр")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк анализа новых видеофайлов")
+    parser.add_argument('--dir', help="Папка с настоящими фильмами (по умолчанию - синтетические ролики)")
+    parser.add_argument('--count', type=int, default=8, help="Количество синтетических роликов")
+    parser.add_argument('--seconds', type=int, default=20, help="Длительность синтетического ролика")
+    parser.add_argument('--size', default='1280x720', help="Разрешение синтетического ролика")
+    parser.add_argument('--repeat', type=int, default=3, help="Количество проходов по всем файлам")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='kinoman-bench-')
+    kinoman.THUMBNAILS_DIR = tmp_dir
+    if args.dir:
+        paths = list_videos(args.dir)
+    else:
+        width, height = (int(v) for v in args.size.split('x'))
+        paths = make_videos(args.count, args.seconds, width, height, tmp_dir)
+    if not paths:
+        print("Видеофайлы не найдены.")
+        return
+
+    engines = ['opencv']
+    if kinoman.find_media_tool('ffprobe') and kinoman.find_media_tool('ffmpeg'):
+        engines.insert(0, 'ffmpeg')
+    else:
+        print("ffmpeg/ffprobe не найдены в PATH: прежний путь теряет время на неудачный запуск ffprobe.")
+
+    print(f"Файлов: {len(paths)}")
+    slow = bench("ffprobe + OpenCV (прежний путь)", legacy_ingest, paths, tmp_dir, args.repeat)
+    for engine in engines:
+        fast = bench(f"probe_media, движок {engine}",
+                     lambda path, thumb, engine=engine: kinoman.probe_media(path, thumbnail=True, engine=engine),
+                     paths, tmp_dir, args.repeat)
+        print(f"  ускорение: x{slow / fast:.2f}")
+
+    frames = [frame for frame in (kinoman.probe_media(path)['frame'] for path in paths) if frame is not None]
+    if frames:
+        print(f"Кодирование превью ({kinoman.thumbnail_format()}, кадр {frames[0].size[0]}x{frames[0].size[1]}):")
+        encode_bench("один JPEG 300x300, LANCZOS (прежний путь)", legacy_encode, frames, args.repeat)
+        encode_bench(f"{len(kinoman.THUMBNAIL_VARIANTS)} размера + JPEG, обычный путь",
+                     kinoman.encode_thumbnail, frames, args.repeat)
+        encode_bench(f"{len(kinoman.THUMBNAIL_VARIANTS)} размера + JPEG, быстрый путь (fast)",
+                     lambda frame: kinoman.encode_thumbnail(frame, fast=True), frames, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
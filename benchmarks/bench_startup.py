@@ -0,0 +1,90 @@
+# bench_startup.py - Время запуска: импорт main и время до первой страницы списка (первой отрисовки)
+# Каждый замер - в отдельном процессе, как настоящий запуск: импорт модуля, открытие базы
+# (из базы или из снимка библиотеки) и первый get_movies_page интерфейса. Базовый вариант -
+# json.load всей JSON-базы, как при запуске прежней версии (она отдавала интерфейсу весь список).
+#
+# Запуск: python benchmarks/bench_startup.py --count 100000
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as kinoman  # noqa: E402
+import synthetic_library  # noqa: E402
+
+# Процесс-замер: печатает JSON с моментами (секунды от старта процесса) окончания импорта и первой страницы
+CHILD = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+if sys.argv[2] == 'json':
+    with open(sys.argv[1], encoding='utf-8') as f:
+        movies = json.load(f)
+    from_snapshot = None
+else:
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager = main.MovieManager(sys.argv[1], snapshot=sys.argv[2] == 'snapshot')
+        movies = manager.get_movies_page(0, 50, main.DEFAULT_SORT_KEY)['movies']
+    from_snapshot = manager.loaded_from_snapshot
+print(json.dumps({'import': imported - start, 'first_page': time.perf_counter() - start,
+                  'from_snapshot': from_snapshot, 'cv2_imported': 'cv2' in sys.modules, 'movies': len(movies)}))
+"""
+
+VARIANTS = (
+    ('json', "json.load всей базы (как раньше)"),
+    ('database', "MovieManager из базы"),
+    ('snapshot', "MovieManager из снимка библиотеки"),
+)
+
+
+def run_child(path, variant):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', CHILD, path, variant], cwd=root,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк времени запуска")
+    parser.add_argument('--count', type=int, default=100000, help="Количество записей в библиотеке")
+    parser.add_argument('--backend', choices=['sqlite', 'json'], default='sqlite', help="Формат базы")
+    parser.add_argument('--repeat', type=int, default=3, help="Запусков каждого варианта (берется лучший)")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='kinoman-bench-')
+    db_file = os.path.join(tmp_dir, 'movies_db.json')
+    records = synthetic_library.make_records(args.count, os.path.join(tmp_dir, 'movies'))
+    json_file = os.path.join(tmp_dir, 'records.json')
+    kinoman.JsonMovieStorage(json_file).save_all(records)  # Тот же формат, что у прежней JSON-базы
+    storage = kinoman.open_movie_storage(db_file, args.backend)
+    storage.save_all(records)
+    storage.close()
+    del records
+    manager = kinoman.MovieManager(db_file, backend=args.backend)
+    manager.get_movies_page(0, 50, kinoman.DEFAULT_SORT_KEY)  # Индекс первой страницы попадает в снимок
+    manager.save_snapshot()
+    manager.storage.close()
+
+    print(f"Библиотека: {args.count} записей ({args.backend}), лучший из {args.repeat} запусков")
+    baseline = None
+    for variant, label in VARIANTS:
+        runs = [run_child(json_file if variant == 'json' else db_file, variant) for _ in range(args.repeat)]
+        run = min(runs, key=lambda item: item['first_page'])
+        assert run['from_snapshot'] in (None, variant == 'snapshot')
+        line = (f"  {label:<36} импорт {run['import']:.3f} с, первая страница {run['first_page']:.2f} с"
+                f"  (OpenCV загружен: {'да' if run['cv2_imported'] else 'нет'})")
+        if baseline is None:
+            baseline = run['first_page']
+        else:
+            line += f"  к базовому: x{run['first_page'] / baseline:.2f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
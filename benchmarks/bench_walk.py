@@ -0,0 +1,84 @@
+# bench_walk.py - Обход папок библиотеки при сканировании
+# Сравнивает прежний обход (os.walk + normpath/normcase и os.stat для каждого видеофайла)
+# с LibraryWalker: полный обход через os.scandir и быстрый, пропускающий папки с прежним mtime.
+# Рядом с видео лежат субтитры, постеры и .nfo - как в настоящей библиотеке.
+#
+# Запуск: python benchmarks/bench_walk.py --dirs 2000 --files 5
+#         python benchmarks/bench_walk.py --dir /mnt/nas/movies
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as kinoman  # noqa: E402
+
+EXTRA_FILES = ('movie.nfo', 'poster.jpg', 'fanart.jpg', 'movie.ru.srt', 'movie.en.srt')
+
+
+def make_tree(root, dirs, files):
+    """Папка на фильм (по files видеофайлов в каждой) плюс сопутствующие файлы; видео пустые - важен только обход."""
+    for i in range(dirs):
+        directory = os.path.join(root, f"Collection {i % 50}", f"Movie {i}")
+        os.makedirs(directory)
+        for name in EXTRA_FILES + tuple(f"Movie.{i}.part{n}.mkv" for n in range(files)):
+            open(os.path.join(directory, name), 'wb').close()
+
+
+def legacy_walk(root):
+    """Прежний путь scan_movies: os.walk, нормализация пути и os.stat для каждого видеофайла."""
+    result = []
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(kinoman.SUPPORTED_FORMATS):
+                path = os.path.join(directory, filename)
+                result.append((kinoman.normalize_movie_path(path), os.stat(path)))
+    return result
+
+
+def walker_walk(walker, root, use_cache):
+    files, _ = walker.walk([root], use_cache=use_cache)
+    return [(os.path.normcase(path), st) for path, st in files]
+
+
+def bench(label, func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(func())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<45} {best * 1e3:10.1f} мс  ({count} файлов)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обхода папок библиотеки")
+    parser.add_argument('--dir', help="Настоящая папка с фильмами (по умолчанию - синтетическое дерево)")
+    parser.add_argument('--dirs', type=int, default=2000, help="Папок с фильмами в синтетическом дереве")
+    parser.add_argument('--files', type=int, default=1, help="Видеофайлов в каждой папке")
+    parser.add_argument('--repeat', type=int, default=5, help="Количество проходов (берется лучший)")
+    args = parser.parse_args()
+
+    root = args.dir
+    if root is None:
+        root = tempfile.mkdtemp(prefix='kinoman-bench-')
+        make_tree(root, args.dirs, args.files)
+    # Синтетическое дерево только что создано: без settle=0 ни одна папка не попала бы в кэш
+    walker = kinoman.LibraryWalker(settle=0)
+
+    print(f"Папка: {root}")
+    slow = bench("os.walk + normpath + os.stat (прежний путь)", lambda: legacy_walk(root), args.repeat)
+    full = bench("LibraryWalker, полный обход", lambda: walker_walk(walker, root, False), args.repeat)
+    print(f"  ускорение: x{slow / full:.2f}")
+    quick = bench("LibraryWalker, папки не изменились", lambda: walker_walk(walker, root, True), args.repeat)
+    print(f"  ускорение: x{slow / quick:.2f}")
+    assert [p for p, _ in walker_walk(walker, root, False)] == [p for p, _ in legacy_walk(root)]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# run_suite.py - Набор бенчмарков MovieManager с результатом в JSON
+# records: сохранение/загрузка базы (SQLite и JSON), открытие базы с построением индексов и из снимка,
+#          поиск по id и пути, search_movies (первый и повторные запросы) на синтетических записях;
+# videos:  холодное и повторное сканирование (полное и быстрое) и создание превью на маленьких роликах.
+# Для каждого замера - лучшее и среднее время в секундах, для поштучных операций - мкс на элемент.
+#
+# Запуск: python benchmarks/run_suite.py --records 100000 --videos 50 --output before.json
+#         python benchmarks/run_suite.py --records 100000 --videos 50 --compare before.json
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as kinoman  # noqa: E402
+from synthetic_library import WORDS, make_records, make_videos  # noqa: E402
+
+
+def log(message):
+    """Ход выполнения - в stderr, чтобы stdout оставался чистым JSON."""
+    print(message, file=sys.stderr, flush=True)
+
+
+def timed(func, repeat=1):
+    """Время (с) каждого из repeat вызовов func; вывод приложения во время замера скрыт."""
+    runs = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - start)
+    return runs
+
+
+def summarize(runs, items=None):
+    entry = {'best': min(runs), 'mean': statistics.mean(runs), 'runs': len(runs)}
+    if items:
+        entry['items'] = items
+        entry['per_item_us'] = min(runs) / items * 1e6
+    return entry
+
+
+def run_records(args, tmp_dir, results):
+    log(f"Синтетические записи: {args.records}")
+    records = make_records(args.records, os.path.join(tmp_dir, 'records', 'movies'), seed=args.seed)
+    for backend in ('sqlite', 'json'):
+        db_file = os.path.join(tmp_dir, f'records-{backend}', 'movies_db.json')
+        os.makedirs(os.path.dirname(db_file))
+        manager = kinoman.MovieManager(db_file, backend=backend)
+        manager.movies = records
+        log(f"  {backend}: сохранение и загрузка")
+        results[f'save_movies_{backend}'] = summarize(timed(manager._save_movies, args.repeat), len(records))
+        results[f'load_movies_{backend}'] = summarize(timed(lambda: list(manager._load_movies()), args.repeat), len(records))
+        manager.storage.close()
+        opened = []
+        # Открытие базы целиком: загрузка, таблица записей и все индексы (как при запуске приложения без снимка)
+        results[f'open_manager_{backend}'] = summarize(
+            timed(lambda: opened.append(kinoman.MovieManager(db_file, backend=backend))), len(records))
+        results[f'save_snapshot_{backend}'] = summarize(timed(opened[-1].save_snapshot), len(records))
+        opened[-1].storage.close()
+        # То же из снимка библиотеки (обычный запуск, если база не менялась с прошлого выхода)
+        results[f'open_manager_{backend}_snapshot'] = summarize(
+            timed(lambda: opened.append(kinoman.MovieManager(db_file, backend=backend))), len(records))
+        assert opened[-1].loaded_from_snapshot
+        if backend == 'json':
+            opened[-1].storage.close()
+            continue
+        manager = opened[-1]
+
+        log("  поиск по id и пути")
+        rnd = random.Random(args.seed)
+        sample = rnd.sample(records, min(1000, len(records)))
+        ids = [m['id'] for m in sample]
+        paths = [m['path'] for m in sample]
+        results['get_movie_details'] = summarize(
+            timed(lambda: [manager.get_movie_details(movie_id) for movie_id in ids], args.repeat), len(ids))
+        results['get_movie_by_path'] = summarize(
+            timed(lambda: [manager.get_movie_by_path(path) for path in paths], args.repeat), len(paths))
+
+        log("  search_movies")
+        queries = ([word.lower() for word in WORDS] + [word[:3] for word in WORDS] +
+                   ["night city", "1999", "драма", "shadw", "nothing-matches-this"])
+        results['search_movies_cold'] = summarize(
+            timed(lambda: [manager.search_movies(query) for query in queries]), len(queries))
+        results['search_movies_warm'] = summarize(
+            timed(lambda: [manager.search_movies(query) for query in queries], args.repeat), len(queries))
+        manager.storage.close()
+
+
+def run_videos(args, tmp_dir, results):
+    kinoman.MOVIES_DIR = os.path.join(tmp_dir, 'videos', 'movies')
+    kinoman.THUMBNAILS_DIR = os.path.join(tmp_dir, 'videos', 'thumbnails')
+    kinoman.LIBRARY_ROOTS = [kinoman.MOVIES_DIR]
+    kinoman.ensure_directories()
+    log(f"Маленькие ролики: {args.videos}")
+    make_videos(args.videos, kinoman.MOVIES_DIR, seed=args.seed)
+    manager = kinoman.MovieManager(os.path.join(tmp_dir, 'videos', 'movies_db.json'))
+    manager._walker.settle = 0  # Папки только что созданы: иначе быстрое сканирование не попало бы в кэш
+
+    log("  сканирование")
+    results['scan_movies_cold'] = summarize(timed(manager.scan_movies), args.videos)
+    results['scan_movies_warm'] = summarize(timed(manager.scan_movies, args.repeat), args.videos)
+    results['scan_movies_quick'] = summarize(timed(lambda: manager.scan_movies(full=False), args.repeat), args.videos)
+
+    log("  превью")
+    for label, fast in (('generate_thumbnails', False), ('generate_thumbnails_fast', True)):
+        # Превью без ссылок удаляются вместе со ссылками, поэтому каждый замер создает их заново
+        manager._apply_changes(upserted=[dict(movie, thumbnail=None) for movie in manager.movies])
+        results[label] = summarize(timed(lambda: manager.generate_missing_thumbnails(fast=fast)), args.videos)
+    manager.storage.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, current_args):
+    """Таблица в stderr: лучшее время в прошлом и текущем запуске и их отношение (>1 - стало быстрее)."""
+    log(f"\nСравнение с {baseline['meta'].get('commit') or 'прошлым запуском'}:")
+    if baseline['meta'].get('args') != current_args:
+        log(f"  Внимание: параметры запусков различаются ({baseline['meta'].get('args')} и {current_args})")
+    for name, entry in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            log(f"  {name:<28} {'-':>10} {entry['best']:10.4f} с")
+            continue
+        log(f"  {name:<28} {old['best']:10.4f} {entry['best']:10.4f} с  x{old['best'] / entry['best']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Набор бенчмарков MovieManager")
+    parser.add_argument('--records', type=int, default=10000, help="Синтетических записей (10 тыс. - 1 млн), 0 - пропустить")
+    parser.add_argument('--videos', type=int, default=20, help="Маленьких роликов для сканирования, 0 - пропустить")
+    parser.add_argument('--repeat', type=int, default=3, help="Повторов каждого замера (кроме холодных)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Файл для JSON-результата (по умолчанию - stdout)")
+    parser.add_argument('--compare', help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='kinoman-bench-')
+    results = {}
+    with contextlib.redirect_stdout(sys.stderr):  # Сообщения приложения вне замеров не смешиваются с JSON
+        if args.records:
+            run_records(args, tmp_dir, results)
+        if args.videos:
+            run_videos(args, tmp_dir, results)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'media_engine': 'ffmpeg' if kinoman.find_media_tool('ffprobe') else 'opencv',
+            'args': {'records': args.records, 'videos': args.videos, 'repeat': args.repeat, 'seed': args.seed},
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        log(f"Результат записан в {args.output}")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), results, report['meta']['args'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# synthetic_library.py - Синтетическая библиотека для бенчмарков
+# make_records - записи в формате базы (10 тыс. - 1 млн), без файлов на диске;
+# make_videos - маленькие настоящие ролики (cv2.VideoWriter) для сканирования и превью.
+# Все значения детерминированы seed: запуски на разных версиях кода сравнимы.
+#
+# Запуск: python benchmarks/synthetic_library.py --out /tmp/library --videos 100 --records 100000
+# (создает папку movies с роликами и базу movies_db.sqlite3 с записями)
+
+import argparse
+import os
+import random
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as kinoman  # noqa: E402
+
+GENRES = ["Неизвестен", "Драма", "Комедия", "Боевик", "Фантастика", "Ужасы", "Документальный"]
+RESOLUTIONS = ["1920x1080", "1280x720", "3840x2160", "720x480", "Unknown"]
+CODECS = ["h264", "hevc", "mpeg4", "vp9"]
+AUDIO = [[{'codec': 'aac', 'channels': 2}], [{'codec': 'ac3', 'channels': 6}, {'codec': 'aac', 'channels': 2}], None]
+WORDS = ["Star", "Night", "River", "Last", "City", "Dream", "Winter", "Road", "Secret", "Shadow",
+         "Ночь", "Город", "Путь", "Зима", "Тайна"]
+
+
+def make_title(rnd, i):
+    """Название из нескольких слов (поиск по словам) с уникальным номером."""
+    return " ".join(rnd.sample(WORDS, rnd.randint(1, 3)) + [str(i)])
+
+
+def make_records(count, movies_dir, described=0.1, seed=42):
+    """Синтетические записи в формате базы; доля described получает собственное описание."""
+    rnd = random.Random(seed)
+    records = []
+    for i in range(count):
+        movie_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+        size = rnd.randint(300 * 1024 ** 2, 20 * 1024 ** 3)
+        title = make_title(rnd, i)
+        year = str(rnd.randint(1950, 2025)) if rnd.random() < 0.7 else "Неизвестен"
+        records.append({
+            'id': movie_id,
+            'title': title,
+            'path': os.path.join(movies_dir, f"Collection {i % 100}", f"{title.replace(' ', '.')}.{year}.mkv"),
+            'genre': rnd.choice(GENRES),
+            'year': year,
+            'rating': rnd.choice([0.0, 6.5, 7.0, 8.2]),
+            'duration': rnd.randint(1200, 10800),
+            'resolution': rnd.choice(RESOLUTIONS),
+            'video_codec': rnd.choice(CODECS),
+            'audio_tracks': rnd.choice(AUDIO),
+            'size': size,
+            'mtime': 1.7e9 + rnd.random() * 1e7,
+            'inode': rnd.getrandbits(40),
+            'fingerprint': f"{size}:{rnd.getrandbits(128):032x}",
+            'phash': f"{rnd.getrandbits(64):016x}",
+            'thumbnail': f"{rnd.getrandbits(128):032x}.jpg",
+            'description': (f"Собственное описание фильма номер {i}, добавленное пользователем."
+                            if rnd.random() < described else "Нет описания."),
+            'date_added': int(1.7e9) + i,
+        })
+    return records
+
+
+def make_videos(count, movies_dir, seconds=2, width=160, height=120, fps=25, seed=42):
+    """
+    Записывает count маленьких роликов (mp4v) в подпапки movies_dir и возвращает их пути.
+    Кадры у всех роликов разные, поэтому отпечатки и перцептивные хеши не совпадают.
+    """
+    import cv2  # Нужен только для роликов: записи генерируются и без OpenCV
+    import numpy as np
+
+    rnd = random.Random(seed)
+    paths = []
+    for i in range(count):
+        directory = os.path.join(movies_dir, f"Collection {i % 10}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{make_title(rnd, i).replace(' ', '.')}.{rnd.randint(1950, 2025)}.mp4")
+        color = np.array([rnd.randrange(256) for _ in range(3)], np.uint8)
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        for n in range(seconds * fps):
+            frame = np.empty((height, width, 3), np.uint8)
+            frame[:] = color
+            frame[:, (n * 4) % width:] //= 2  # Движущаяся граница: кадры внутри ролика тоже различаются
+            cv2.putText(frame, str(i), (10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            writer.write(frame)
+        writer.release()
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетической библиотеки фильмов")
+    parser.add_argument('--out', required=True, help="Папка, в которой создаются movies/ и база")
+    parser.add_argument('--videos', type=int, default=0, help="Количество маленьких роликов")
+    parser.add_argument('--records', type=int, default=0, help="Количество синтетических записей в базе")
+    parser.add_argument('--backend', choices=['sqlite', 'json'], default='sqlite', help="Формат базы")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    movies_dir = os.path.join(args.out, 'movies')
+    os.makedirs(movies_dir, exist_ok=True)
+    if args.videos:
+        print(f"Роликов записано: {len(make_videos(args.videos, movies_dir, seed=args.seed))}")
+    if args.records:
+        storage = kinoman.open_movie_storage(os.path.join(args.out, 'movies_db.json'), args.backend)
+        storage.save_all(make_records(args.records, movies_dir, seed=args.seed))
+        storage.close()
+        print(f"Записей в базе: {args.records} ({args.backend})")
+
+
+if __name__ == '__main__':
+    main()
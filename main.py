@@ -2,534 +2,5087 @@
 # Использует Eel для GUI, OpenCV для превью, ffprobe для метаданных видео
 
 import eel
+import bottle  # HTTP-сервер Eel: отдельный маршрут /stream для раздачи видео
 import os
 import sys
 import json
 import subprocess  # Для запуска ffprobe и внешних плееров
 import platform  # Для определения ОС (Windows, macOS, Linux)
 import shutil  # Для копирования/удаления файлов
-from PIL import Image  # Pillow для работы с изображениями, используется при обработке превью
-import cv2  # OpenCV для захвата кадров видео
+import importlib  # Отложенный импорт OpenCV и Pillow (см. _LazyModule)
+try:
+    from watchdog.observers import Observer  # Уведомления ФС (inotify и аналоги) для наблюдателя за папкой
+except ImportError:
+    Observer = None  # Если watchdog не установлен, наблюдатель переходит на периодический опрос
+try:
+    import fcntl  # ioctl FICLONE: мгновенная копия (reflink) на Btrfs/XFS и других ФС с copy-on-write
+except ImportError:
+    fcntl = None  # Windows: reflink недоступен, используется обычное копирование
+import atexit  # Снимок библиотеки при выходе (см. MovieManager.save_snapshot)
+import gc  # Загрузка снимка библиотеки без проходов сборщика мусора по миллионам новых объектов
+import marshal  # Формат снимка библиотеки: записи и индексы читаются одним вызовом, без разбора JSON
+import uuid  # Для генерации уникальных ID фильмов
+import re  # Для парсинга года из названия фильма
+import struct  # Длины разделов в файле снимка библиотеки
+import time  # Для отметки времени добавления фильма
+import urllib.parse  # Для кодирования URL-путей
+import webbrowser  # Для fallback-открытия в системном браузере
+import threading  # Блокировка базы и фоновый наблюдатель за папкой
+import sqlite3  # Хранилище базы фильмов с построчными изменениями
+import array  # Колонки чисел таблицы фильмов и индексы по строкам записей
+import zlib  # Стабильный хеш для индексов таблицы фильмов по id и пути
+import bisect  # Отсортированный словарь поискового индекса (поиск по префиксу)
+import heapq  # Отбор лучших результатов поиска при ограничении количества
+import collections  # Ограниченный журнал изменений для дельта-синхронизации интерфейса
+import abc  # Абстрактный кэш производных файлов (LruFileCache.entry_name)
+import collections.abc  # Запись таблицы фильмов с интерфейсом словаря (Mapping) для индексов
+import functools  # Кэш поиска ffmpeg/ffprobe в PATH
+import io  # Чтение кадра превью из вывода ffmpeg без временных файлов
+import contextlib  # Пустой замер времени, когда метрики выключены
+import errno  # Коды ошибок, при которых быстрое копирование уступает место следующему способу
+import hashlib  # Отпечаток содержимого файла для поиска дубликатов
+import mimetypes  # Content-Type для раздачи видео
+import email.utils  # Даты в HTTP-заголовках (Last-Modified)
+from concurrent.futures import ThreadPoolExecutor  # Пул воркеров для параллельной обработки новых файлов
+
+
+class _LazyModule:
+    """
+    Модуль, который импортируется при первом обращении к его атрибуту. OpenCV (с numpy) и Pillow
+    нужны только для метаданных и превью новых файлов, поэтому не задерживают запуск и показ библиотеки.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+cv2 = _LazyModule('cv2')  # OpenCV для захвата кадров видео
+Image = _LazyModule('PIL.Image')  # Pillow для работы с изображениями, используется при обработке превью
+
+
+@functools.lru_cache(maxsize=None)
+def _load_tqdm():
+    """tqdm (прогресс в консоли при сканировании) импортируется при первой обработке новых файлов; None - не установлен."""
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        return None  # Если tqdm не установлен, используем простой цикл
+    return tqdm
+
+# --- Конфигурация папок ---
+# Получаем директорию, где запущен скрипт
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Пути к папкам для фильмов, превью и базы данных
+# ВНИМАНИЕ: папка THUMBNAILS_DIR должна находиться ВНУТРИ папки 'web', чтобы Eel мог ее обслуживать.
+# Видео отдаются отдельным маршрутом /stream (см. LIBRARY_ROOTS), поэтому MOVIES_DIR может лежать где угодно,
+# в том числе на другом диске.
+web_dir = os.path.join(SCRIPT_DIR, 'web')
+MOVIES_DIR = os.path.join(web_dir, 'movies')  # ИЗМЕНЕНО: теперь movies находится внутри web
+THUMBNAILS_DIR = os.path.join(web_dir, 'thumbnails')  # ИЗМЕНЕНО: теперь thumbnails находится внутри web
+DB_FILE = os.path.join(SCRIPT_DIR, 'movies_db.json')  # DB_FILE может оставаться рядом с main.py
+
+# Папки библиотеки: сканируются вместе с MOVIES_DIR (каждая в своем потоке, поэтому медленный сетевой диск
+# не задерживает остальные), и только файлы из них разрешено отдавать через /stream/<id>. Фильм вне этих папок
+# воспроизвести нельзя, даже если он есть в базе. Записи из недоступной папки (отключенный NAS) не удаляются.
+LIBRARY_ROOTS = [MOVIES_DIR]
+# Быстрое сканирование (опрос наблюдателя, открытие интерфейса) не перечитывает папки, mtime которых не изменился
+# с прошлого обхода. Папки, измененные менее WALK_DIR_SETTLE секунд назад, не кэшируются: на FAT/SMB разрешение
+# mtime - секунды, и изменение в ту же секунду иначе осталось бы незамеченным.
+WALK_DIR_SETTLE = 2.0
+STREAM_MAX_CONCURRENT = 8  # Одновременных ответов с видео; сверх этого - 503 (браузер повторит запрос)
+STREAM_CHUNK_SIZE = 256 * 1024  # Байт за одну отправку: меньше - отзывчивее остальные запросы в гринлетах Eel
+
+# Хранилище базы фильмов: 'sqlite' - построчные изменения в movies_db.sqlite3 (WAL),
+# 'json' - весь список в DB_FILE, как раньше. Существующий DB_FILE переносится в SQLite автоматически.
+STORAGE_BACKEND = 'sqlite'
+# Снимок библиотеки (movies_db.snapshot рядом с DB_FILE): записи и построенные индексы в формате marshal. При запуске
+# он читается в несколько раз быстрее, чем база; устаревший снимок (номер изменения базы другой, сменился формат
+# снимка или версия Python) не используется. Пишется в фоне после изменений базы и при выходе.
+SNAPSHOT_ENABLED = True
+# Секунды от изменения базы до записи снимка: изменения за это время (сканирование) попадают в один снимок
+SNAPSHOT_WRITE_DELAY = 30.0
+# Секунды после запуска до сверки базы с диском и фоновых задач (превью, отпечатки, снимок):
+# сначала интерфейс получает и отрисовывает список.
+STARTUP_BACKGROUND_DELAY = 3.0
+
+
+def ensure_directories():
+    """Создает необходимые папки, если их нет. Вызывается при запуске, а не при импорте: модуль можно
+    импортировать (бенчмарки, скрипты) без побочных эффектов и с подмененными путями."""
+    os.makedirs(MOVIES_DIR, exist_ok=True)
+    os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+
+
+# Поддерживаемые расширения видеофайлов
+SUPPORTED_FORMATS = ('.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm', '.m4v', '.3gp')
+
+# Количество воркеров для параллельной обработки новых файлов (ffprobe + превью).
+# ffprobe работает в отдельном процессе, а OpenCV отпускает GIL при декодировании,
+# поэтому потоков достаточно. 1 - последовательная обработка, как раньше.
+SCAN_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+# Отслеживание изменений в папке с фильмами, чтобы открытие интерфейса не требовало полного обхода:
+# 'auto' - watchdog (inotify/FSEvents/ReadDirectoryChangesW), если он установлен, иначе периодический опрос;
+# 'watchdog' - только watchdog; 'poll' - только опрос; 'off' - сканирование при каждом вызове get_movies.
+WATCH_MODE = 'auto'
+WATCH_POLL_INTERVAL = 10  # Секунды между инкрементальными пересканированиями в режиме опроса
+WATCH_DEBOUNCE = 2.0  # Секунды тишины после последнего события, прежде чем применять изменения
+
+# Поиск: вес совпадения по полю (название важнее описания) и множители для типа совпадения
+SEARCH_FIELD_WEIGHTS = {'title': 3.0, 'year': 2.0, 'genre': 2.0, 'description': 1.0}
+SEARCH_PREFIX_FACTOR = 0.7  # Слово в записи начинается с введенного
+SEARCH_FUZZY_FACTOR = 0.5  # Слово похоже на введенное (опечатка), делится на число правок
+SEARCH_FUZZY_MAX_EDITS = 2  # Максимум правок для длинных слов (для слов до 5 букв - одна правка)
+
+# Постраничная выдача списка фильмов для интерфейса (get_movies_page)
+DEFAULT_SORT_KEY = '-date_added'  # Поле сортировки; минус в начале - по убыванию
+MAX_PAGE_SIZE = 500  # Верхняя граница размера страницы, чтобы один запрос не тянул всю библиотеку
+
+# Дельта-синхронизация: сколько последних изменений помнить для get_changes_since.
+# Если клиент отстал сильнее, он получает полный снимок библиотеки.
+CHANGELOG_SIZE = 10000
+
+# Статистика библиотеки по группам (get_movies_stats): границы классов разрешения по высоте кадра
+# и корзин размера файла (верхняя граница, не включая ее)
+STATS_RESOLUTION_CLASSES = ((2160, '2160p'), (1440, '1440p'), (1080, '1080p'), (720, '720p'))
+STATS_SIZE_BUCKETS = ((1024 ** 3, '< 1 ГБ'), (4 * 1024 ** 3, '1-4 ГБ'), (10 * 1024 ** 3, '4-10 ГБ'),
+                      (float('inf'), '> 10 ГБ'))
+UI_PUSH_INTERVAL = 0.3  # Секунды между отправками накопленных фоновых событий в интерфейс
+
+# Движок анализа новых файлов (probe_media): метаданные и кадр превью получаются за один проход.
+# 'ffmpeg' - ffprobe по всем потокам + один ключевой кадр через ffmpeg (точная длительность для VFR/MKV,
+# кодек и звуковые дорожки); 'opencv' - одно открытие файла через cv2; 'auto' - ffmpeg, если он есть в PATH.
+PROBE_ENGINE = 'auto'
+THUMBNAIL_POSITION = 0.1  # Доля длительности, с которой берется кадр для превью
+# Превью хранятся по содержимому: имя = blake2b кадра и настроек, одинаковые кадры - один набор файлов,
+# а файл под именем никогда не меняется (браузер кэширует его навсегда). Размеры (вписываются с сохранением
+# пропорций): 'grid' - карточка списка, 'retina' - карточка на экране с двойной плотностью, 'detail' - окно
+# фильма. Формат: 'webp' или 'avif' (если Pillow их не поддерживает - 'jpeg'); для 'grid' всегда есть JPEG.
+THUMBNAIL_VARIANTS = {'grid': (300, 300), 'retina': (600, 600), 'detail': (960, 960)}
+THUMBNAIL_FORMAT = 'webp'
+THUMBNAIL_QUALITY = {'jpeg': 85, 'webp': 80, 'avif': 60}
+THUMBNAIL_GC_GRACE = 3600  # Секунды: файлы превью моложе этого не удаляются сборщиком (могут быть еще не в базе)
+
+# Добавление фильмов в библиотеку (кнопки "Добавить" и "Папка"):
+# 'copy' - копия: reflink, если ФС умеет copy-on-write, иначе копирование в ядре (copy_file_range/sendfile),
+#          иначе поблочно; прогресс виден в интерфейсе.
+# 'hardlink' - жесткая ссылка без копирования данных (только на том же томе, иначе - копия);
+# 'symlink' - символьная ссылка на исходный файл (исходный файл должен оставаться на месте).
+IMPORT_MODE = 'copy'
+IMPORT_CHUNK_SIZE = 8 * 1024 * 1024  # Байт за один шаг копирования (между шагами - прогресс и проверка отмены)
+FICLONE = 0x40049409  # Номер ioctl для reflink в Linux
+
+# Поиск дубликатов: отпечаток = размер + blake2b трех фрагментов файла (начало, середина, конец),
+# второй уровень - перцептивный хеш (dHash) кадра превью, он находит перекодированные копии
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024  # Байт в каждом из трех фрагментов
+PHASH_MAX_DISTANCE = 4  # Максимум различающихся бит из 64, чтобы кадры считались одинаковыми
+DUPLICATE_DURATION_TOLERANCE = 0.02  # Допустимая разница длительности похожих копий (доля, но не меньше 2 с)
+
+# Раскадровка для просмотра фильма при наведении: N равномерно расположенных кадров в одной полосе.
+# Создается лениво (только для фильмов, на которые навели курсор) и хранится в LRU-кэше на диске.
+SPRITES_DIR = os.path.join(THUMBNAILS_DIR, 'sprites')
+SPRITE_FRAMES = 10  # Кадров в раскадровке
+SPRITE_FRAME_WIDTH = 160  # Ширина одного кадра, высота - по пропорциям видео
+SPRITE_CACHE_BYTES = 200 * 1024 ** 2  # Бюджет кэша раскадровок; давно не просмотренные удаляются первыми
+SPRITE_MAX_GRAB_GAP = 250  # OpenCV: до скольких кадров идти вперед декодированием, а не переходом (seek)
+
+# Подготовка к воспроизведению форматов, которые браузер не играет сам (.mkv, .avi, .wmv, .flv, ...):
+# ffmpeg перепаковывает потоки без перекодирования во фрагментированный MP4, если кодеки это позволяют,
+# иначе перекодирует в H.264/AAC. Результат хранится в LRU-кэше на диске. Без ffmpeg файл отдается как есть.
+PLAYBACK_CACHE_DIR = os.path.join(SCRIPT_DIR, 'playback_cache')
+PLAYBACK_CACHE_BYTES = 20 * 1024 ** 3  # Бюджет кэша; давно не воспроизводившиеся фильмы удаляются первыми
+PLAYBACK_WORKERS = 1  # Одновременных процессов ffmpeg (перекодирование занимает все ядра)
+PLAYBACK_PREWARM_COUNT = 5  # Сколько последних добавленных фильмов готовить заранее (0 - не готовить)
+PLAYBACK_X264_PRESET = 'veryfast'  # Скорость/качество перекодирования видео
+BROWSER_CONTAINERS = ('.mp4', '.m4v', '.webm')  # Контейнеры, которые <video> открывает напрямую
+BROWSER_VIDEO_CODECS = ('h264', 'avc1', 'vp8', 'vp9', 'av1')
+BROWSER_AUDIO_CODECS = ('aac', 'mp3', 'opus', 'flac', 'vorbis')
+
+# Фоновые задачи (сканирование, импорт, превью): exposed-функции сразу возвращают job_id,
+# а ход выполнения приходит в интерфейс событиями on_job_event.
+JOB_WORKERS = 3  # Задачи с приоритетом 'backfill' занимают не больше JOB_WORKERS - 1 потоков
+JOB_PRIORITIES = {'user': 0, 'normal': 1, 'backfill': 2}  # Меньше - раньше
+JOB_HISTORY_SIZE = 100  # Сколько завершенных задач помнить для get_jobs
+
+# Замеры времени по этапам (ffprobe, кадр через ffmpeg/OpenCV, уменьшение превью, обход папок, сохранение базы,
+# поиск, вызовы из интерфейса): гистограммы и счетчики доступны через get_metrics(). Выключены по умолчанию.
+METRICS_ENABLED = False
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Границы корзин, секунды
+METRICS_SLOW_THRESHOLD = 1.0  # Операции дольше стольких секунд печатаются и попадают в журнал медленных операций
+METRICS_SLOW_THRESHOLDS = {'eel_call': 0.2}  # Свои пороги для отдельных метрик: интерфейс ждет ответа на вызов
+METRICS_SLOW_LOG_SIZE = 100  # Сколько последних медленных операций помнить
+METRICS_DUMP_FILE = None  # Файл в текстовом формате Prometheus (например, для textfile-коллектора), None - не писать
+METRICS_DUMP_INTERVAL = 15  # Секунды между обновлениями METRICS_DUMP_FILE
+
+
+# --- Метрики ---
+# Пока метрики выключены, обертки только проверяют флаг и вызывают функцию напрямую.
+
+class _Histogram:
+    """Распределение длительностей по корзинам METRICS_BUCKETS (последняя корзина - +Inf)."""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Оценка квантиля: верхняя граница корзины, в которую он попадает (но не больше максимума)."""
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _MetricsTimer:
+    """Замер одного блока: время - в гистограмму, исключение - еще и в счетчик <имя>_errors."""
+
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None:
+            self.metrics.increment(f"{self.name}_errors", **self.labels)
+        return False
+
+
+class Metrics:
+    """
+    Гистограммы времени и счетчики с метками (например, function='get_movies' у вызовов из интерфейса).
+    snapshot() - для get_metrics, to_prometheus()/dump() - текстовый формат Prometheus.
+    Операции дольше порога печатаются и запоминаются в журнале медленных операций (slow).
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED, buckets=METRICS_BUCKETS, slow_threshold=METRICS_SLOW_THRESHOLD,
+                 slow_thresholds=None, slow_log_size=METRICS_SLOW_LOG_SIZE):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.slow_threshold = slow_threshold
+        self.slow_thresholds = dict(METRICS_SLOW_THRESHOLDS if slow_thresholds is None else slow_thresholds)
+        self.slow = collections.deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._histograms = {}  # (имя, метки) -> _Histogram
+        self._counters = {}  # (имя, метки) -> значение
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, seconds, **labels):
+        """Добавляет длительность (секунды) в гистограмму name."""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(seconds)
+        threshold = self.slow_thresholds.get(name, self.slow_threshold)
+        if threshold is not None and seconds >= threshold:
+            description = name + ''.join(f" {label}={value}" for label, value in key[1])
+            print(f"Медленная операция: {description} - {seconds:.2f} с")
+            self.slow.append({'name': name, 'labels': labels, 'seconds': round(seconds, 4), 'time': time.time()})
+
+    def increment(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def timer(self, name, **labels):
+        """Контекстный менеджер: время блока попадает в гистограмму name."""
+        return _MetricsTimer(self, name, labels) if self.enabled else contextlib.nullcontext()
+
+    def timed(self, name=None, **labels):
+        """Декоратор: время каждого вызова попадает в гистограмму name (по умолчанию - имя функции)."""
+        def decorator(func):
+            metric = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _MetricsTimer(self, metric, labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.slow.clear()
+
+    def snapshot(self):
+        """Текущие значения для интерфейса: длительности в секундах, квантили - оценка по корзинам."""
+        with self._lock:
+            histograms = [{
+                'name': name, 'labels': dict(labels), 'count': h.count, 'sum': round(h.sum, 6),
+                'avg': round(h.sum / h.count, 6) if h.count else 0.0, 'max': round(h.max, 6),
+                'p50': round(h.quantile(0.5), 6), 'p95': round(h.quantile(0.95), 6),
+            } for (name, labels), h in sorted(self._histograms.items())]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+        return {'enabled': self.enabled, 'histograms': histograms, 'counters': counters, 'slow': list(self.slow)}
+
+    @staticmethod
+    def _format_labels(labels, **extra):
+        items = list(labels) + list(extra.items())
+        if not items:
+            return ''
+        return '{' + ','.join(f'{label}="{Metrics._escape(value)}"' for label, value in items) + '}'
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def to_prometheus(self, prefix='kinoman'):
+        """Текстовый формат Prometheus: гистограммы <prefix>_<имя>_seconds и счетчики <prefix>_<имя>_total."""
+        with self._lock:
+            histograms = sorted((key, list(h.counts), h.sum, h.count) for key, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        previous = None
+        for (name, labels), counts, total, count in histograms:
+            metric = f"{prefix}_{name}_seconds"
+            if name != previous:
+                lines.append(f"# TYPE {metric} histogram")
+                previous = name
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{self._format_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{metric}_sum{self._format_labels(labels)} {total}")
+            lines.append(f"{metric}_count{self._format_labels(labels)} {count}")
+        previous = None
+        for (name, labels), value in counters:
+            metric = f"{prefix}_{name}_total"
+            if name != previous:
+                lines.append(f"# TYPE {metric} counter")
+                previous = name
+            lines.append(f"{metric}{self._format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Атомарно записывает to_prometheus() в файл (читатель не увидит файл наполовину)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+def expose(func):
+    """
+    eel.expose с замером времени каждого вызова из интерфейса (гистограмма eel_call, метка function).
+    Вызов, пришедший, пока библиотека еще открывается в фоне (open_library), ждет ее загрузки.
+    Если библиотеку открыть не удалось, вызов возвращает ошибку открытия, чтобы интерфейс показал причину.
+    Занятую фоновым потоком блокировку базы вызов ждет, не останавливая сервер (_wait_for_manager_lock).
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _wait_for_library()
+        if movie_manager is None and _library_error is not None:
+            return {'success': False, 'error': f"Не удалось открыть библиотеку: {_library_error}"}
+        _wait_for_manager_lock()
+        return func(*args, **kwargs)
+    return eel.expose(metrics.timed('eel_call', function=func.__name__)(wrapper))
+
+
+def _dump_metrics_periodically(path, interval=METRICS_DUMP_INTERVAL):
+    while True:
+        time.sleep(interval)
+        try:
+            metrics.dump(path)
+        except OSError as e:
+            print(f"Не удалось записать метрики в {path}: {e}")
+
+
+@functools.lru_cache(maxsize=None)
+def find_media_tool(name):
+    """Путь к ffmpeg/ffprobe в PATH или None. Результат кэшируется, чтобы не обходить PATH на каждый файл."""
+    return shutil.which(name)
+
+
+def resolve_probe_engine(engine=None):
+    """Возвращает фактический движок анализа ('ffmpeg' или 'opencv') для значения PROBE_ENGINE."""
+    engine = engine or PROBE_ENGINE
+    if engine == 'auto':
+        return 'ffmpeg' if find_media_tool('ffprobe') and find_media_tool('ffmpeg') else 'opencv'
+    if engine not in ('ffmpeg', 'opencv'):
+        raise ValueError(f"Неизвестный движок анализа видео: {engine}")
+    return engine
+
+
+def _run_media_tool(cmd, text=True):
+    """Запускает ffmpeg/ffprobe без окна консоли (Windows) и возвращает результат."""
+    return subprocess.run(cmd, capture_output=True, text=text, check=True,
+                          creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == "Windows" else 0)
+
+
+_THUMBNAIL_EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp', 'avif': 'avif'}
+_THUMBNAIL_KEY_RE = re.compile(r'[0-9a-f]{32}')
+_THUMBNAIL_FILE_RE = re.compile(r'([0-9a-f]{32})-[a-z]+\.[a-z]+')
+
+
+@functools.lru_cache(maxsize=None)
+def thumbnail_format():
+    """Фактический формат вариантов превью: THUMBNAIL_FORMAT, если Pillow умеет его записывать, иначе 'jpeg'."""
+    if THUMBNAIL_FORMAT == 'jpeg':
+        return 'jpeg'
+    from PIL import features
+    if THUMBNAIL_FORMAT not in _THUMBNAIL_EXTENSIONS or not features.check(THUMBNAIL_FORMAT):
+        print(f"Формат превью {THUMBNAIL_FORMAT} не поддерживается Pillow, используется JPEG")
+        return 'jpeg'
+    return THUMBNAIL_FORMAT
+
+
+def thumbnail_file(name, size='grid', fmt='jpeg'):
+    """
+    Имя файла превью в THUMBNAILS_DIR. name - значение поля thumbnail записи: ключ содержимого
+    (32 hex-символа, файлы '<ключ>-<размер>.<расширение>') или имя одного файла из прежних версий.
+    """
+    if _THUMBNAIL_KEY_RE.fullmatch(name):
+        return f"{name}-{size}.{_THUMBNAIL_EXTENSIONS[fmt]}"
+    return name
+
+
+def thumbnail_files(name):
+    """
+    Все возможные файлы превью с этим значением поля thumbnail - во всех форматах, а не только в текущем
+    thumbnail_format(): ключи не переписываются при смене формата, и их файлы остаются в прежнем.
+    """
+    if not _THUMBNAIL_KEY_RE.fullmatch(name):
+        return [name]
+    return [thumbnail_file(name, size, fmt) for fmt in _THUMBNAIL_EXTENSIONS for size in THUMBNAIL_VARIANTS]
+
+
+def _thumbnail_owner(filename):
+    """Значение поля thumbnail, которому принадлежит файл в THUMBNAILS_DIR."""
+    match = _THUMBNAIL_FILE_RE.fullmatch(filename)
+    return match.group(1) if match else filename
+
+
+def _encode_image(img, fmt, fast):
+    # Для кадров превью WebP method 2 дает тот же размер файла, что и method 4 (по умолчанию), в 2-3 раза
+    # быстрее, а AVIF speed 8 - в 6 раз быстрее speed 6; fast жертвует 10-15% размера ради скорости
+    buffer = io.BytesIO()
+    quality = THUMBNAIL_QUALITY[fmt]
+    if fmt == 'webp':
+        img.save(buffer, 'WEBP', quality=quality, method=0 if fast else 2)
+    elif fmt == 'avif':
+        img.save(buffer, 'AVIF', quality=quality, speed=10 if fast else 8)
+    else:
+        img.save(buffer, 'JPEG', quality=quality, optimize=not fast)
+    return buffer.getvalue()
+
+
+@metrics.timed('thumbnail_resize')
+def encode_thumbnail(img, fast=False):
+    """
+    Уменьшает кадр до всех размеров THUMBNAIL_VARIANTS и кодирует их в thumbnail_format(),
+    плюс JPEG размера 'grid' для браузеров без WebP/AVIF. Возвращает (ключ, {имя файла: данные}).
+    Каждый размер получается из предыдущего, большего (а не из исходного кадра); fast - пакетное
+    создание превью: BILINEAR вместо LANCZOS и быстрые настройки кодировщиков.
+    """
+    img = img.convert('RGB')  # Всегда копия: исходный кадр вызывающего не меняется
+    fmt = thumbnail_format()
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((sorted(THUMBNAIL_VARIANTS.items()), fmt, THUMBNAIL_QUALITY, img.size)).encode())
+    digest.update(img.tobytes())
+    key = digest.hexdigest()
+
+    resample = Image.Resampling.BILINEAR if fast else Image.Resampling.LANCZOS
+    files = {}
+    for size, box in sorted(THUMBNAIL_VARIANTS.items(), key=lambda item: item[1], reverse=True):
+        img.thumbnail(box, resample, reducing_gap=2.0)
+        files[thumbnail_file(key, size, fmt)] = _encode_image(img, fmt, fast)
+        if size == 'grid' and fmt != 'jpeg':
+            files[thumbnail_file(key)] = _encode_image(img, 'jpeg', fast)
+    return key, files
+
+
+def store_thumbnail_files(files):
+    """
+    Атомарно записывает файлы превью в THUMBNAILS_DIR. Уже существующий файл (тот же ключ - то же
+    содержимое) не перезаписывается, у него только обновляется mtime, чтобы сборщик мусора его не тронул.
+    """
+    for filename, data in files.items():
+        path = os.path.join(THUMBNAILS_DIR, filename)
+        try:
+            os.utime(path)
+            continue
+        except OSError:
+            pass
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def save_thumbnail(img, fast=False):
+    """Создает и сохраняет все размеры превью кадра, возвращает значение для поля thumbnail записи."""
+    key, files = encode_thumbnail(img, fast)
+    store_thumbnail_files(files)
+    return key
+
+
+def remove_thumbnail_files(name):
+    """Удаляет все файлы превью с этим значением поля thumbnail."""
+    for filename in thumbnail_files(name):
+        path = os.path.join(THUMBNAILS_DIR, filename)
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+                print(f"Удалено превью: {path}")
+        except OSError as e:
+            print(f"Ошибка при удалении превью {path}: {e}")
+
+
+def _probe_with_ffmpeg(file_path):
+    """
+    Один вызов ffprobe по контейнеру и всем потокам, затем один ключевой кадр через ffmpeg:
+    -ss перед -i переходит к ближайшему ключевому кадру без декодирования всего, что до него,
+    а -skip_frame nokey не декодирует промежуточные кадры.
+    """
+    cmd = [
+        find_media_tool('ffprobe') or 'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration:stream=index,codec_type,codec_name,width,height,duration,channels'
+                         ':stream_tags=language:stream_disposition=attached_pic',
+        '-of', 'json',
+        file_path
+    ]
+    with metrics.timer('ffprobe'):
+        data = json.loads(_run_media_tool(cmd).stdout or '{}')
+    streams = data.get('streams', [])
+    # Обложки (attached_pic) в MKV/MP4 выглядят как видеопоток, их пропускаем
+    video = next((st for st in streams if st.get('codec_type') == 'video'
+                  and not st.get('disposition', {}).get('attached_pic')), None)
+    audio_tracks = [{'codec': st.get('codec_name'),
+                     'channels': st.get('channels'),
+                     'language': st.get('tags', {}).get('language')}
+                    for st in streams if st.get('codec_type') == 'audio']
+
+    # Длительность контейнера точнее длительности потока (VFR, MKV без duration у потока)
+    duration = 0.0
+    for value in (data.get('format', {}).get('duration'), (video or {}).get('duration')):
+        try:
+            duration = float(value)
+            break
+        except (TypeError, ValueError):
+            continue
+
+    frame = None
+    if video is not None:
+        box = "{}:{}".format(*max(THUMBNAIL_VARIANTS.values()))
+        grab_cmd = [find_media_tool('ffmpeg') or 'ffmpeg', '-v', 'error', '-skip_frame', 'nokey']
+        seek = ['-ss', f"{duration * THUMBNAIL_POSITION:.3f}"] if duration > 0 else []
+        tail = ['-i', file_path, '-map', f"0:{video['index']}", '-an', '-sn', '-dn', '-frames:v', '1',
+                '-vf', f"scale={box}:force_original_aspect_ratio=decrease",
+                '-f', 'image2pipe', '-c:v', 'bmp', '-']
+        # Если после точки перехода нет ключевых кадров (короткий ролик), берем первый кадр файла
+        with metrics.timer('ffmpeg_frame'):
+            for attempt in ([seek, []] if seek else [[]]):
+                try:
+                    output = _run_media_tool(grab_cmd + attempt + tail, text=False).stdout
+                except subprocess.CalledProcessError:
+                    output = b''
+                if output:
+                    frame = Image.open(io.BytesIO(output))
+                    frame.load()
+                    break
+
+    return {
+        'duration': int(duration),
+        'width': (video or {}).get('width', 0),
+        'height': (video or {}).get('height', 0),
+        'video_codec': (video or {}).get('codec_name'),
+        'audio_tracks': audio_tracks,
+        'frame': frame,
+    }
+
+
+def _probe_with_opencv(file_path):
+    """
+    Одно открытие файла через OpenCV: размеры, FPS и кодек из свойств потока, затем переход к кадру превью.
+    Длительность оценивается по FRAME_COUNT/FPS, звуковые дорожки OpenCV не видит (audio_tracks = None).
+    """
+    with metrics.timer('opencv_open'):
+        cap = cv2.VideoCapture(file_path)
+    if not cap.isOpened():
+        return None
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        duration = frame_count / fps if fps > 0 and frame_count > 0 else 0
+
+        with metrics.timer('opencv_seek'):
+            if duration > 0:
+                cap.set(cv2.CAP_PROP_POS_MSEC, duration * THUMBNAIL_POSITION * 1000)
+            ret, frame = cap.read()
+            if not ret and duration > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = cap.read()
+    finally:
+        cap.release()
+
+    if ret:
+        height, width = height or frame.shape[0], width or frame.shape[1]
+        # Как scale в ffmpeg: кадр сразу уменьшается до самого большого размера превью (INTER_AREA быстр
+        # и без муара), чтобы Pillow не переводил в RGB и не уменьшал полный кадр 4K
+        box_width, box_height = max(THUMBNAIL_VARIANTS.values())
+        scale = min(box_width / frame.shape[1], box_height / frame.shape[0])
+        if scale < 1:
+            frame = cv2.resize(frame, (max(1, round(frame.shape[1] * scale)), max(1, round(frame.shape[0] * scale))),
+                               interpolation=cv2.INTER_AREA)
+    codec = ''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip('\x00 ') if fourcc > 0 else ''
+    return {
+        'duration': int(duration),
+        'width': width,
+        'height': height,
+        'video_codec': codec.lower() or None,
+        'audio_tracks': None,
+        'frame': Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) if ret else None,
+    }
+
+
+@metrics.timed()
+def probe_media(file_path, thumbnail=False, engine=None):
+    """
+    Анализирует видеофайл за один проход: длительность, разрешение, кодек, звуковые дорожки
+    и кадр для превью (PIL.Image в 'frame'). Если thumbnail, превью сохраняется (save_thumbnail),
+    а в 'thumbnail' записывается значение для записи (None - не удалось). Движок 'ffmpeg' при ошибке
+    уступает место OpenCV.
+    """
+    engine = resolve_probe_engine(engine)
+    result = None
+    if engine == 'ffmpeg':
+        try:
+            result = _probe_with_ffmpeg(file_path)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            print(f"Ошибка анализа {file_path} через ffmpeg, используется OpenCV: {e}")
+    if result is None:
+        result = _probe_with_opencv(file_path)
+    if result is None:
+        print(f"Не удалось открыть видеофайл: {file_path}")
+        result = {'duration': 0, 'width': 0, 'height': 0, 'video_codec': None, 'audio_tracks': None, 'frame': None}
+
+    result['thumbnail'] = None
+    if thumbnail and result['frame'] is not None:
+        try:
+            result['thumbnail'] = save_thumbnail(result['frame'])
+        except Exception as e:
+            print(f"Ошибка сохранения превью для {file_path}: {e}")
+    elif thumbnail:
+        print(f"Не удалось захватить кадр для миниатюры из: {file_path}")
+    return result
+
+
+def _sprite_with_ffmpeg(file_path, sprite_path, duration, frames, frame_width):
+    """
+    Один последовательный проход ffmpeg: декодируются только ключевые кадры (-skip_frame nokey),
+    select берет первый ключевой кадр каждого интервала, tile склеивает их в полосу.
+    """
+    interval = duration / frames
+    select = (f"select='gte(t,{interval / 2:.3f})*(isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f}))'"
+              if duration > 0 else "select='1'")
+    cmd = [find_media_tool('ffmpeg') or 'ffmpeg', '-v', 'error', '-y', '-skip_frame', 'nokey', '-i', file_path,
+           '-map', '0:v:0', '-an', '-sn', '-dn',
+           '-vf', f"{select},scale={frame_width}:-2,tile={frames}x1",
+           '-frames:v', '1', '-q:v', '4', '-f', 'image2', sprite_path]
+    _run_media_tool(cmd)
+    return os.path.exists(sprite_path) and os.path.getsize(sprite_path) > 0
+
+
+def _sprite_with_opencv(file_path, sprite_path, frames, frame_width):
+    """
+    Проход OpenCV только вперед: между соседними кадрами раскадровки cap.grab() без конвертации
+    кадров, переход (seek) - только если до следующего кадра больше SPRITE_MAX_GRAB_GAP кадров.
+    Недостающие в конце кадры повторяют последний, чтобы в полосе всегда было frames кадров.
+    """
+    cap = cv2.VideoCapture(file_path)
+    if not cap.isOpened():
+        return False
+    images = []
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        targets = [int(frame_count * (i + 0.5) / frames) for i in range(frames)] if frame_count > 0 else [0]
+        position = 0
+        for target in targets:
+            if target - position > SPRITE_MAX_GRAB_GAP:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                position = target
+            while position < target and cap.grab():
+                position += 1
+            ret, frame = cap.read()
+            if not ret:
+                break
+            position += 1
+            height = max(2, round(frame.shape[0] * frame_width / frame.shape[1]))
+            images.append(cv2.resize(frame, (frame_width, height), interpolation=cv2.INTER_AREA))
+    finally:
+        cap.release()
+    if not images:
+        return False
+    images += [images[-1]] * (frames - len(images))
+    strip = Image.fromarray(cv2.cvtColor(cv2.hconcat(images), cv2.COLOR_BGR2RGB))
+    strip.save(sprite_path, format='JPEG', quality=75)
+    return True
+
+
+def generate_sprite_sheet(file_path, sprite_path, duration=0, frames=SPRITE_FRAMES,
+                          frame_width=SPRITE_FRAME_WIDTH, engine=None):
+    """Создает раскадровку: frames кадров шириной frame_width в одну строку (JPEG). Возвращает успех."""
+    if resolve_probe_engine(engine) == 'ffmpeg':
+        try:
+            if _sprite_with_ffmpeg(file_path, sprite_path, duration, frames, frame_width):
+                return True
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Ошибка создания раскадровки {file_path} через ffmpeg, используется OpenCV: {e}")
+    return _sprite_with_opencv(file_path, sprite_path, frames, frame_width)
+
+
+def playback_plan(movie):
+    """
+    Как воспроизводить фильм в браузере: {'mode': 'direct'} - файл как есть,
+    {'mode': 'remux' | 'transcode', 'copy_video': bool, 'copy_audio': bool} - через ffmpeg.
+    Неизвестный кодек (анализ через OpenCV) в поддерживаемом контейнере считается воспроизводимым,
+    в остальных контейнерах сначала пробуется копирование потока.
+    """
+    ext = os.path.splitext(movie['path'])[1].lower()
+    video_codec = (movie.get('video_codec') or '').lower()
+    audio_tracks = movie.get('audio_tracks')
+    audio_codec = (audio_tracks[0].get('codec') or '').lower() if audio_tracks else ''
+    video_ok = not video_codec or video_codec in BROWSER_VIDEO_CODECS
+    audio_ok = not audio_tracks or audio_codec in BROWSER_AUDIO_CODECS
+    if (ext in BROWSER_CONTAINERS and video_ok and audio_ok) or not find_media_tool('ffmpeg'):
+        return {'mode': 'direct'}
+    # В MP4 нельзя положить VP8 и Vorbis без перекодирования
+    copy_video = video_ok and video_codec != 'vp8'
+    copy_audio = audio_ok and audio_codec != 'vorbis'
+    return {'mode': 'remux' if copy_video else 'transcode', 'copy_video': copy_video, 'copy_audio': copy_audio}
+
+
+def convert_for_browser(file_path, output_path, copy_video=True, copy_audio=True, duration=0, progress=None):
+    """
+    Перепаковывает (copy) или перекодирует (H.264/AAC) первый видео- и первый звуковой поток
+    во фрагментированный MP4. progress(доля) вызывается по ходу работы ffmpeg (-progress);
+    исключение из progress (например, JobCancelled) останавливает процесс. Возвращает успех.
+    """
+    cmd = [find_media_tool('ffmpeg') or 'ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', file_path,
+           '-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn']
+    cmd += ['-c:v', 'copy'] if copy_video else ['-c:v', 'libx264', '-preset', PLAYBACK_X264_PRESET,
+                                                '-crf', '21', '-pix_fmt', 'yuv420p']
+    cmd += ['-c:a', 'copy'] if copy_audio else ['-c:a', 'aac', '-b:a', '192k', '-ac', '2']
+    cmd += ['-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+            '-progress', 'pipe:1', '-nostats', '-f', 'mp4', output_path]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                            creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == "Windows" else 0)
+    try:
+        for line in proc.stdout:
+            key, _, value = line.strip().partition('=')
+            # out_time_ms у ffmpeg на самом деле в микросекундах, как и out_time_us
+            if key in ('out_time_us', 'out_time_ms') and value.isdigit() and progress and duration > 0:
+                progress(min(1.0, int(value) / 1e6 / duration))
+        errors = proc.stderr.read()
+        returncode = proc.wait()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    if returncode != 0:
+        print(f"Ошибка подготовки {file_path} к воспроизведению: {errors.strip()[-500:]}")
+        return False
+    return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+
+# Ошибки, означающие "этот способ копирования здесь не поддерживается" (а не сбой диска)
+_COPY_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+                            errno.ENOTTY, errno.EBADF, errno.EPERM, getattr(errno, 'ENOTSOCK', -1)}
+
+
+def _copy_reflink(fsrc, fdst):
+    """reflink через ioctl FICLONE: новый файл ссылается на те же блоки, данные не копируются."""
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError as e:
+        if e.errno in _COPY_UNSUPPORTED_ERRNOS:
+            return False
+        raise
+
+
+def _copy_in_kernel(fsrc, fdst, total, report, chunk_size):
+    """
+    Копирование без буфера в пользовательском пространстве: os.copy_file_range (на части ФС - тоже
+    reflink), иначе os.sendfile. Возвращает название способа или None, если ни один не поддерживается.
+    """
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', lambda offset, count: os.copy_file_range(
+            fsrc.fileno(), fdst.fileno(), count, offset, offset)))
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        methods.append(('sendfile', lambda offset, count: os.sendfile(fdst.fileno(), fsrc.fileno(), offset, count)))
+    for name, copy_chunk in methods:
+        copied = 0
+        try:
+            while copied < total:
+                sent = copy_chunk(copied, min(chunk_size, total - copied))
+                if sent == 0:
+                    break  # Файл укоротился во время копирования
+                copied += sent
+                report(copied)
+            return name
+        except OSError as e:
+            if copied or e.errno not in _COPY_UNSUPPORTED_ERRNOS:
+                raise
+    return None
+
+
+def _copy_chunked(fsrc, fdst, report, chunk_size):
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    copied = 0
+    while True:
+        read = fsrc.readinto(buffer)
+        if not read:
+            return 'chunked'
+        fdst.write(view[:read])
+        copied += read
+        report(copied)
+
+
+def copy_file_fast(src, dst, progress=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Копирует файл самым быстрым доступным способом: reflink, copy_file_range/sendfile,
+    поблочно. progress(copied, total) вызывается после каждого шага и может прервать
+    копирование исключением (например, JobCancelled) - недописанный файл удаляется.
+    Время изменения и права копируются, как в shutil.copy2. Возвращает название способа.
+    """
+    total = os.path.getsize(src)
+
+    def report(copied):
+        if progress:
+            progress(copied, total)
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            if _copy_reflink(fsrc, fdst):
+                method = 'reflink'
+                report(total)
+            else:
+                method = _copy_in_kernel(fsrc, fdst, total, report, chunk_size) or \
+                    _copy_chunked(fsrc, fdst, report, chunk_size)
+        shutil.copystat(src, dst)
+    except BaseException:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+    return method
+
+
+def import_file(src, dst, mode=IMPORT_MODE, progress=None):
+    """
+    Помещает src в библиотеку по пути dst в режиме mode ('copy', 'hardlink', 'symlink').
+    Если ссылку создать нельзя (другой том, нет прав), файл копируется. Возвращает способ.
+    """
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError as e:
+            print(f"Жесткая ссылка невозможна ({e}), файл будет скопирован: {src}")
+    elif mode == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return 'symlink'
+        except OSError as e:
+            print(f"Символьная ссылка невозможна ({e}), файл будет скопирован: {src}")
+    elif mode != 'copy':
+        raise ValueError(f"Неизвестный режим добавления: {mode}")
+    return copy_file_fast(src, dst, progress)
+
+
+def compute_fingerprint(file_path, size=None, sample_size=FINGERPRINT_SAMPLE_SIZE):
+    """
+    Дешевый отпечаток содержимого: размер файла и blake2b от трех фрагментов по sample_size байт
+    (начало, середина, конец) - три чтения вместо хеширования всего файла. Формат: "<размер>:<hex>".
+    """
+    if size is None:
+        size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        if size <= 3 * sample_size:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - sample_size) // 2, size - sample_size):
+                f.seek(offset)
+                digest.update(f.read(sample_size))
+    return f"{size}:{digest.hexdigest()}"
+
+
+def perceptual_hash(img, hash_size=8):
+    """
+    dHash кадра: 64 бита "левый пиксель ярче правого" по уменьшенной серой копии 9x8.
+    Переживает перекодирование, смену разрешения и небольшие изменения яркости. Возвращает hex-строку.
+    """
+    width = hash_size + 1
+    pixels = img.convert('L').resize((width, hash_size), Image.Resampling.BILINEAR).tobytes()  # Байт на пиксель
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[row * width + col] > pixels[row * width + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def thumbnail_perceptual_hash(thumbnail_name):
+    """dHash по уже сохраненному превью (для записей, созданных до появления phash). None - превью нет."""
+    if not thumbnail_name:
+        return None
+    try:
+        with Image.open(os.path.join(THUMBNAILS_DIR, thumbnail_file(thumbnail_name))) as img:
+            return perceptual_hash(img)
+    except (OSError, ValueError):
+        return None
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def build_movie_record(file_path, st=None):
+    """
+    Создает запись о новом фильме: метаданные и превью за один проход probe_media.
+    st - уже полученный os.stat файла (чтобы не делать его повторно).
+    Не трогает общее состояние, поэтому может выполняться в пуле потоков.
+    """
+    print(f"Обработка нового фильма: {os.path.basename(file_path)}")
+    metadata = probe_media(file_path, thumbnail=True)
+    duration_seconds = metadata.get('duration', 0)
+    width = metadata.get('width', 0)
+    height = metadata.get('height', 0)
+
+    title = os.path.splitext(os.path.basename(file_path))[0].replace('.', ' ').strip().title()
+    year = "Неизвестен"
+    match = re.search(r'(\d{4})', title)
+    if match:
+        year = match.group(1)
+
+    genre = "Неизвестен"
+    rating = 0.0
+    description = DEFAULT_DESCRIPTION
+
+    if st is None:
+        st = os.stat(file_path)
+
+    try:
+        fingerprint = compute_fingerprint(file_path, st.st_size)
+    except OSError as e:
+        print(f"Не удалось вычислить отпечаток {file_path}: {e}")
+        fingerprint = None
+
+    new_movie = {
+        'id': str(uuid.uuid4()),
+        'title': title,
+        'path': os.path.normpath(file_path),  # Сохраняем оригинальный путь
+        'genre': genre,
+        'year': year,
+        'rating': rating,
+        'duration': duration_seconds,
+        'resolution': f"{width}x{height}" if width and height else 'Unknown',
+        'video_codec': metadata['video_codec'],
+        'audio_tracks': metadata['audio_tracks'],  # None - движок не умеет определять дорожки
+        'size': st.st_size,
+        'mtime': st.st_mtime,  # size/mtime/inode позволяют пересканировать только изменившиеся файлы
+        'inode': st.st_ino,
+        'fingerprint': fingerprint,  # Размер + хеш фрагментов: точные копии
+        'phash': perceptual_hash(metadata['frame']) if metadata['frame'] is not None else None,  # Похожие копии
+        'thumbnail': metadata['thumbnail'],
+        'description': description,
+        'date_added': int(time.time())
+    }
+    return new_movie
+
+
+def stat_matches(movie, st):
+    """Проверяет, совпадает ли сохраненный в записи stat (size, mtime, inode) с текущим."""
+    return (movie.get('size') == st.st_size and movie.get('mtime') == st.st_mtime
+            and movie.get('inode') == st.st_ino)
+
+
+def normalize_movie_path(path):
+    """Ключ пути для сравнения: нормализованный и без учета регистра там, где ФС к нему не чувствительна."""
+    return os.path.normcase(os.path.normpath(path))
+
+
+def library_roots():
+    """MOVIES_DIR и LIBRARY_ROOTS без повторов и без папок, вложенных в другие корни."""
+    roots = []
+    for root in [MOVIES_DIR] + list(LIBRARY_ROOTS):
+        root = os.path.normpath(root)
+        if not any(is_in_library_roots(root, [other]) for other in roots):
+            # Корень, охватывающий уже добавленные, заменяет их
+            roots = [other for other in roots if not is_in_library_roots(other, [root])] + [root]
+    return roots
+
+
+_SUPPORTED_EXTENSIONS = frozenset(SUPPORTED_FORMATS)
+
+
+class LibraryWalker:
+    """
+    Обход папок библиотеки через os.scandir. Расширение проверяется по имени до любых других операций,
+    stat берется из DirEntry (в Windows - без отдельного системного вызова). Для каждой папки запоминается
+    ее mtime и список видеофайлов и подпапок: при быстром обходе папка с тем же mtime не перечитывается.
+    mtime папки меняется при добавлении, удалении и переименовании ее записей, но не при изменении
+    содержимого файлов - поэтому файлы из кэша отдаются без stat (None), и полный обход (кнопка
+    "Сканировать") по-прежнему проверяет каждый файл.
+    """
+
+    def __init__(self, settle=WALK_DIR_SETTLE):
+        self.settle = settle
+        self._dirs = {}  # папка -> (mtime_ns, имена видеофайлов, имена подпапок)
+        self._lock = threading.Lock()
+
+    @metrics.timed('library_walk')
+    def walk(self, roots, use_cache=True, check_cancelled=None):
+        """
+        Обходит корни параллельно (по потоку на корень). Возвращает (файлы, недоступные папки), где файлы -
+        список (путь, stat или None для файла из неизменившейся папки) в детерминированном порядке.
+        """
+        roots = [os.path.normpath(root) for root in roots]
+        with self._lock:
+            cache = dict(self._dirs) if use_cache else {}
+        if len(roots) > 1:
+            with ThreadPoolExecutor(max_workers=len(roots), thread_name_prefix='library-walk') as pool:
+                results = list(pool.map(lambda root: self._walk_root(root, cache, check_cancelled), roots))
+        else:
+            results = [self._walk_root(root, cache, check_cancelled) for root in roots]
+
+        files, unreadable, dirs = [], [], {}
+        for root_files, root_unreadable, root_dirs in results:
+            files.extend(root_files)
+            unreadable.extend(root_unreadable)
+            dirs.update(root_dirs)
+        with self._lock:
+            # Исчезнувшие папки выпадают из кэша; кэш недоступных папок сохраняется до следующего удачного обхода
+            self._dirs = {d: entry for d, entry in self._dirs.items()
+                          if any(is_in_library_roots(d, [u]) for u in unreadable)}
+            self._dirs.update(dirs)
+        return files, unreadable
+
+    def _walk_root(self, root, cache, check_cancelled):
+        files, unreadable, dirs = [], [], {}
+        stack = [root]
+        while stack:
+            if check_cancelled is not None:
+                check_cancelled()
+            directory = stack.pop()
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError as e:
+                print(f"Папка недоступна, записи из нее сохранены: {directory} ({e})")
+                unreadable.append(directory)
+                continue
+            cached = cache.get(directory)
+            if cached is not None and cached[0] == mtime_ns:
+                _, names, subdirs = cached
+                files.extend((os.path.join(directory, name), None) for name in names)
+                dirs[directory] = cached
+            else:
+                try:
+                    names, subdirs = self._scan_directory(directory, files)
+                except OSError as e:
+                    print(f"Папка недоступна, записи из нее сохранены: {directory} ({e})")
+                    unreadable.append(directory)
+                    continue
+                if time.time() - mtime_ns / 1e9 >= self.settle:
+                    dirs[directory] = (mtime_ns, names, subdirs)
+            stack.extend(os.path.join(directory, name) for name in reversed(subdirs))
+        return files, unreadable, dirs
+
+    @staticmethod
+    def _scan_directory(directory, files):
+        """Читает одну папку: видеофайлы (путь, stat) добавляются в files, возвращает (имена файлов, имена подпапок)."""
+        videos, subdirs = [], []
+        with os.scandir(directory) as it:
+            for entry in it:
+                name = entry.name
+                try:
+                    if name[name.rfind('.'):].lower() in _SUPPORTED_EXTENSIONS and entry.is_file():
+                        videos.append(entry)
+                    elif entry.is_dir(follow_symlinks=False):  # Как os.walk: по ссылкам на папки не ходим
+                        subdirs.append(name)
+                except OSError as e:
+                    print(f"Не удалось получить информацию о файле {entry.path}: {e}")
+        # Сортируются только видео и подпапки: порядок не зависит от файловой системы
+        videos.sort(key=lambda entry: entry.name)
+        subdirs.sort()
+        names = []
+        for entry in videos:
+            try:
+                files.append((entry.path, entry.stat()))
+            except OSError as e:
+                print(f"Не удалось получить информацию о файле {entry.path}: {e}")
+                continue
+            names.append(entry.name)
+        return tuple(names), tuple(subdirs)
+
+
+_MISSING = object()  # Поле отсутствует в записи (старые базы без новых полей)
+DEFAULT_DESCRIPTION = "Нет описания."
+_shared_values = {}  # Повторяющиеся неизменяемые значения (годы, звуковые дорожки), общие для всех записей
+
+
+def _share(value):
+    """Одно общее значение вместо тысяч одинаковых копий: строки интернируются, числа и списки дорожек переиспользуются."""
+    if type(value) is str:
+        return sys.intern(value)
+    if type(value) in (int, float):
+        return _shared_values.setdefault((type(value), value), value)
+    if type(value) is list:
+        try:
+            return _shared_values.setdefault(tuple(tuple(item.items()) for item in value), value)
+        except (AttributeError, TypeError):  # Не список словарей с простыми значениями
+            return value
+    return value
+
+
+class _ObjectColumn:
+    """
+    Колонка MovieTable со значениями как есть. shared=True - повторяющиеся значения (жанр, разрешение,
+    описание по умолчанию) хранятся одним общим объектом на всю колонку (см. _share).
+    """
+
+    def __init__(self, shared=False):
+        self.shared = shared
+        self.values = []  # строка -> значение (_MISSING - поля в записи нет)
+
+    def get(self, row):
+        return self.values[row]
+
+    def set(self, row, value):
+        if self.shared and value is not _MISSING:
+            value = _share(value)
+        if row == len(self.values):
+            self.values.append(value)
+        else:
+            self.values[row] = value
+
+    def extend(self, values):
+        """Добавляет значения новых строк в конец колонки (массовая загрузка, см. MovieTable.extend)."""
+        self.values.extend(map(_share, values) if self.shared else values)
+
+    def find(self, value):
+        """Строки со значением value."""
+        return [row for row, item in enumerate(self.values) if item is not _MISSING and item == value]
+
+    def export_state(self):
+        """Состояние из встроенных типов для снимка: (значения с None вместо _MISSING, строки без поля)."""
+        missing = [row for row, value in enumerate(self.values) if value is _MISSING]
+        values = list(self.values)
+        for row in missing:
+            values[row] = None
+        return values, missing
+
+    def restore_state(self, state):
+        self.values, missing = state
+        for row in missing:
+            self.values[row] = _MISSING
+
+
+class _TextColumn:
+    """
+    Колонка строк: UTF-8 всех значений подряд в одном bytearray, у строки - смещение и длина в array.
+    str с хотя бы одной кириллической буквой тратит по 2 байта на символ и еще около 80 байт на объект,
+    а здесь путь к файлу или название - около 1,3 байта на символ и 12 байт на строку.
+    Замененные значения остаются в буфере, пока их не станет больше половины (_compact). Не строки - в loose.
+    """
+
+    COMPACT_MIN_GARBAGE = 1 << 20
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array.array('Q')
+        self.lengths = array.array('I')
+        self.loose = {}  # строка -> значение не str (None, отсутствие поля)
+        self.garbage = 0  # Байты замененных значений в data
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, row):
+        if self.loose and row in self.loose:
+            return self.loose[row]
+        start = self.offsets[row]
+        return self.data[start:start + self.lengths[row]].decode('utf-8', 'surrogatepass')
+
+    def set(self, row, value):
+        if row == len(self.offsets):
+            self.offsets.append(0)
+            self.lengths.append(0)
+        else:
+            self.garbage += self.lengths[row]
+        if type(value) is str:
+            raw = value.encode('utf-8', 'surrogatepass')
+            self.offsets[row] = len(self.data)
+            self.lengths[row] = len(raw)
+            self.data += raw
+            if self.loose:
+                self.loose.pop(row, None)
+        else:
+            self.lengths[row] = 0
+            self.loose[row] = value
+        if self.garbage > self.COMPACT_MIN_GARBAGE and self.garbage * 2 > len(self.data):
+            self._compact()
+
+    def extend(self, values):
+        row = len(self.offsets)
+        offset = len(self.data)
+        raws = []
+        for value in values:
+            if type(value) is str:
+                raw = value.encode('utf-8', 'surrogatepass')
+                raws.append(raw)
+                self.offsets.append(offset)
+                self.lengths.append(len(raw))
+                offset += len(raw)
+            else:
+                self.offsets.append(offset)
+                self.lengths.append(0)
+                self.loose[row] = value
+            row += 1
+        self.data += b''.join(raws)
+
+    def _compact(self):
+        """Переписывает буфер без замененных значений."""
+        data, offsets, lengths = bytearray(), self.offsets, self.lengths
+        old = memoryview(self.data)
+        for row, length in enumerate(lengths):
+            start = offsets[row]
+            offsets[row] = len(data)
+            data += old[start:start + length]
+        old.release()
+        self.data = data
+        self.garbage = 0
+
+    def find(self, value):
+        """Строки со значением value."""
+        if type(value) is not str:
+            return [row for row, item in self.loose.items() if item is not _MISSING and item == value]
+        raw = value.encode('utf-8', 'surrogatepass')
+        size, data, offsets = len(raw), self.data, self.offsets
+        # Сравниваются только значения той же длины
+        return [row for row, length in enumerate(self.lengths)
+                if length == size and data[offsets[row]:offsets[row] + size] == raw and row not in self.loose]
+
+    def export_state(self):
+        self._compact()  # В снимок - без мусора
+        loose = {row: value for row, value in self.loose.items() if value is not _MISSING}
+        return (bytes(self.data), self.offsets.tobytes(), self.lengths.tobytes(),
+                loose, [row for row, value in self.loose.items() if value is _MISSING])
+
+    def restore_state(self, state):
+        data, offsets, lengths, self.loose, missing = state
+        self.data = bytearray(data)
+        self.offsets = array.array('Q')
+        self.offsets.frombytes(offsets)
+        self.lengths = array.array('I')
+        self.lengths.frombytes(lengths)
+        self.loose.update(dict.fromkeys(missing, _MISSING))
+        self.garbage = 0
+
+
+class _ArrayColumn:
+    """
+    Колонка чисел в array: 8 байт на запись вместо объекта int/float. Значения другого типа или вне диапазона
+    массива (None, целый рейтинг из старой базы, отсутствие поля) хранятся в loose и читаются оттуда.
+    """
+
+    def __init__(self, typecode, value_type):
+        self.values = array.array(typecode)
+        self.value_type = value_type
+        self.loose = {}  # строка -> значение не для массива
+
+    def get(self, row):
+        if self.loose and row in self.loose:
+            return self.loose[row]
+        return self.values[row]
+
+    def set(self, row, value):
+        if row == len(self.values):
+            self.values.append(0)
+        if type(value) is self.value_type:
+            try:
+                self.values[row] = value
+            except OverflowError:
+                pass
+            else:
+                if self.loose:
+                    self.loose.pop(row, None)
+                return
+        self.values[row] = 0
+        self.loose[row] = value
+
+    def extend(self, values):
+        start = len(self.values)
+        value_type = self.value_type
+        if all(type(value) is value_type for value in values):
+            try:
+                self.values.extend(values)
+                return
+            except OverflowError:
+                del self.values[start:]  # array успел добавить значения до ошибки
+        for value in values:
+            self.set(len(self.values), value)
+
+    def find(self, value):
+        """Строки со значением value (поиск в байтах массива, без перебора значений в Python)."""
+        rows = [row for row, item in self.loose.items() if item is not _MISSING and item == value]
+        if type(value) is not self.value_type:
+            return rows
+        try:
+            needle = array.array(self.values.typecode, [value]).tobytes()
+        except OverflowError:
+            return rows
+        data = self.values.tobytes()
+        position = data.find(needle)
+        while position >= 0:
+            row, offset = divmod(position, self.values.itemsize)
+            if not offset and row not in self.loose:
+                rows.append(row)
+            position = data.find(needle, position + 1)
+        return rows
+
+    def export_state(self):
+        loose = {row: value for row, value in self.loose.items() if value is not _MISSING}
+        return self.values.tobytes(), loose, [row for row, value in self.loose.items() if value is _MISSING]
+
+    def restore_state(self, state):
+        data, self.loose, missing = state
+        self.values = array.array(self.values.typecode)
+        self.values.frombytes(data)
+        self.loose.update(dict.fromkeys(missing, _MISSING))
+
+
+class _DigestColumn:
+    """
+    Колонка хешей фиксированной длины (отпечаток, phash, ключ превью) в одном bytearray - width байт на запись
+    вместо шестнадцатеричной строки на каждую. encode(строка) -> bytes длины width или None, если строка
+    не в ожидаемом формате (тогда значение хранится в loose); decode(байты) -> исходная строка.
+    Поиск записей по значению - поиск подстроки в bytearray, без отдельного словаря.
+    """
+
+    def __init__(self, width, encode, decode):
+        self.width = width
+        self.encode = encode
+        self.decode = decode
+        self.values = bytearray()
+        self.loose = {}  # строка -> значение, которое не кодируется (None, отсутствие поля, другой формат)
+
+    def get(self, row):
+        if self.loose and row in self.loose:
+            return self.loose[row]
+        start = row * self.width
+        return self.decode(self.values[start:start + self.width])
+
+    def set(self, row, value):
+        raw = self.encode(value) if type(value) is str else None
+        if raw is None:
+            raw = bytes(self.width)
+            self.loose[row] = value
+        elif self.loose:
+            self.loose.pop(row, None)
+        start = row * self.width
+        self.values[start:start + self.width] = raw
+
+    def extend(self, values):
+        row = len(self.values) // self.width
+        empty = bytes(self.width)
+        raws = []
+        for value in values:
+            raw = self.encode(value) if type(value) is str else None
+            if raw is None:
+                raw = empty
+                self.loose[row] = value
+            raws.append(raw)
+            row += 1
+        self.values += b''.join(raws)
+
+    def _raw_rows(self, raw):
+        position = self.values.find(raw)
+        while position >= 0:
+            row, offset = divmod(position, self.width)
+            if not offset and row not in self.loose:
+                yield row
+            position = self.values.find(raw, position + 1)
+
+    def find(self, value):
+        """Строки со значением value."""
+        raw = self.encode(value) if type(value) is str else None
+        if raw is None:
+            return [row for row, item in self.loose.items() if item is not _MISSING and item == value]
+        return list(self._raw_rows(raw))
+
+    def distinct(self):
+        """Все значения колонки (множество)."""
+        width = self.width
+        raws = {bytes(self.values[row * width:(row + 1) * width])
+                for row in range(len(self.values) // width) if row not in self.loose}
+        values = {self.decode(raw) for raw in raws}
+        values.update(value for value in self.loose.values() if type(value) is str)
+        return values
+
+    def duplicates(self):
+        """Группы строк (списки) с одинаковым значением."""
+        groups = {}
+        width = self.width
+        for row in range(len(self.values) // width):
+            if row not in self.loose:
+                groups.setdefault(bytes(self.values[row * width:(row + 1) * width]), []).append(row)
+        for row, value in self.loose.items():
+            if type(value) is str and value:
+                groups.setdefault(value, []).append(row)
+        return [rows for rows in groups.values() if len(rows) > 1]
+
+    def export_state(self):
+        loose = {row: value for row, value in self.loose.items() if value is not _MISSING}
+        return bytes(self.values), loose, [row for row, value in self.loose.items() if value is _MISSING]
+
+    def restore_state(self, state):
+        data, self.loose, missing = state
+        self.values = bytearray(data)
+        self.loose.update(dict.fromkeys(missing, _MISSING))
+
+
+_HEX16_RE = re.compile(r'[0-9a-f]{16}')
+_FINGERPRINT_RE = re.compile(r'([1-9]\d{0,18}|0):([0-9a-f]{32})')
+_THUMBNAIL_VALUE_RE = re.compile(r'([0-9a-f]{32})(\.jpg)?')
+
+
+def _encode_phash(value):
+    return bytes.fromhex(value) if _HEX16_RE.fullmatch(value) else None
+
+
+def _encode_fingerprint(value):
+    # 'размер:md5' - 8 байт размера и 16 байт хеша (размер с ведущими нулями хранится строкой в loose)
+    match = _FINGERPRINT_RE.fullmatch(value)
+    if match is None or int(match.group(1)) >= 2 ** 64:
+        return None
+    return int(match.group(1)).to_bytes(8, 'little') + bytes.fromhex(match.group(2))
+
+
+def _decode_fingerprint(raw):
+    return f"{int.from_bytes(raw[:8], 'little')}:{raw[8:].hex()}"
+
+
+def _encode_thumbnail(value):
+    # Ключ содержимого превью или файл '<uuid>.jpg' из прежних версий: признак .jpg и 16 байт
+    match = _THUMBNAIL_VALUE_RE.fullmatch(value)
+    return bytes((bool(match.group(2)),)) + bytes.fromhex(match.group(1)) if match else None
+
+
+def _decode_thumbnail(raw):
+    return raw[1:].hex() + ('.jpg' if raw[0] else '')
+
+
+def _movie_columns():
+    """Колонки MovieTable: поле записи -> колонка (id хранится отдельно, см. MovieTable)."""
+    return {
+        'title': _TextColumn(),
+        'path': _TextColumn(),
+        'genre': _ObjectColumn(shared=True),
+        'year': _ObjectColumn(shared=True),
+        'rating': _ArrayColumn('d', float),
+        'duration': _ArrayColumn('q', int),
+        'resolution': _ObjectColumn(shared=True),
+        'video_codec': _ObjectColumn(shared=True),
+        'audio_tracks': _ObjectColumn(shared=True),
+        'size': _ArrayColumn('q', int),
+        'mtime': _ArrayColumn('d', float),
+        'inode': _ArrayColumn('Q', int),
+        'fingerprint': _DigestColumn(24, _encode_fingerprint, _decode_fingerprint),
+        'phash': _DigestColumn(8, _encode_phash, bytearray.hex),
+        'thumbnail': _DigestColumn(17, _encode_thumbnail, _decode_thumbnail),
+        'description': _TextColumn(),
+        'date_added': _ArrayColumn('q', int),
+    }
+
+
+class _RowHashIndex:
+    """
+    Индекс значение -> строка MovieTable без объектов на запись: открытая адресация в двух array
+    (строка и хеш значения для каждой ячейки), а сами значения читаются из таблицы функцией key_of(row).
+    Словарь с ключом и номером строки стоил бы около 100 байт на запись, здесь - 8 байт на ячейку.
+    Хеш - zlib.crc32, одинаковый в любом процессе, поэтому индекс попадает в снимок библиотеки как есть.
+    """
+
+    _EMPTY = -1
+    _DELETED = -2
+
+    def __init__(self, key_of):
+        self.key_of = key_of
+        self._rows = array.array('i', [self._EMPTY]) * 8
+        self._hashes = array.array('I', [0]) * 8
+        self._filled = 0  # Занятые и удаленные ячейки
+
+    @staticmethod
+    def hash_of(value):
+        return zlib.crc32(value if type(value) is bytes else str(value).encode('utf-8', 'surrogatepass'))
+
+    def get(self, value):
+        """Строка со значением value или None."""
+        value_hash = self.hash_of(value)
+        rows, hashes = self._rows, self._hashes
+        mask = len(rows) - 1
+        slot, perturb = value_hash & mask, value_hash
+        while True:
+            row = rows[slot]
+            if row == self._EMPTY:
+                return None
+            if row >= 0 and hashes[slot] == value_hash and self.key_of(row) == value:
+                return row
+            # Следующая ячейка зависит от всех бит хеша, как в dict
+            perturb >>= 5
+            slot = (slot * 5 + perturb + 1) & mask
+
+    def add(self, value, row):
+        """Сопоставляет value строку row (вместо прежней строки с тем же значением)."""
+        value_hash = self.hash_of(value)
+        rows, hashes = self._rows, self._hashes
+        mask = len(rows) - 1
+        slot, perturb = value_hash & mask, value_hash
+        free = None
+        while True:
+            current = rows[slot]
+            if current == self._EMPTY:
+                break
+            if current == self._DELETED:
+                if free is None:
+                    free = slot
+            elif hashes[slot] == value_hash and self.key_of(current) == value:
+                rows[slot] = row
+                return
+            perturb >>= 5
+            slot = (slot * 5 + perturb + 1) & mask
+        if free is None:
+            free = slot
+            self._filled += 1
+        rows[free] = row
+        hashes[free] = value_hash
+        if self._filled * 3 > len(rows) * 2:
+            self._resize()
+
+    def remove(self, value, row):
+        """Убирает строку row, если значению value сопоставлена именно она."""
+        value_hash = self.hash_of(value)
+        rows, hashes = self._rows, self._hashes
+        mask = len(rows) - 1
+        slot, perturb = value_hash & mask, value_hash
+        while True:
+            current = rows[slot]
+            if current == self._EMPTY:
+                return
+            if current == row and hashes[slot] == value_hash:
+                rows[slot] = self._DELETED
+                return
+            perturb >>= 5
+            slot = (slot * 5 + perturb + 1) & mask
+
+    def _resize(self):
+        """Новый массив ячеек, заполненный не больше чем наполовину: удаленные ячейки отбрасываются."""
+        live = [(row, value_hash) for row, value_hash in zip(self._rows, self._hashes) if row >= 0]
+        size = 8
+        while size < len(live) * 2:
+            size *= 2
+        rows = self._rows = array.array('i', [self._EMPTY]) * size
+        hashes = self._hashes = array.array('I', [0]) * size
+        mask = size - 1
+        for row, value_hash in live:
+            slot, perturb = value_hash & mask, value_hash
+            while rows[slot] != self._EMPTY:
+                perturb >>= 5
+                slot = (slot * 5 + perturb + 1) & mask
+            rows[slot] = row
+            hashes[slot] = value_hash
+        self._filled = len(live)
+
+    def export_state(self):
+        return self._rows.tobytes(), self._hashes.tobytes(), self._filled
+
+    def restore_state(self, state):
+        rows, hashes, self._filled = state
+        self._rows = array.array('i')
+        self._rows.frombytes(rows)
+        self._hashes = array.array('I')
+        self._hashes.frombytes(hashes)
+
+
+class MovieTable:
+    """
+    Записи библиотеки по колонкам: у каждой записи номер строки, а значения полей лежат в колонках
+    (см. _movie_columns) - числа в array, хеши в bytearray, строки в UTF-8, повторяющиеся значения общие.
+    Вместо словаря на запись (около 2 КБ) - несколько сотен байт и ни одного объекта на число.
+    Индексы по id и пути тоже не создают объектов на запись (_RowHashIndex).
+    Наружу записи выдаются новыми dict (record), индексы читают поля без копирования через view.
+    Строки удаленных записей занимают новые. Не потокобезопасна: доступ - под блокировкой владельца.
+    """
+
+    FIELDS = ('id', 'title', 'path', 'genre', 'year', 'rating', 'duration', 'resolution', 'video_codec',
+              'audio_tracks', 'size', 'mtime', 'inode', 'fingerprint', 'phash', 'thumbnail', 'description',
+              'date_added')
+    _FIELD_SET = frozenset(FIELDS)
+
+    def __init__(self):
+        self._columns = _movie_columns()
+        self._ids = _TextColumn()  # строка -> id записи (None - свободная строка)
+        self._count = 0
+        self._id_index = _RowHashIndex(self.id_of)
+        self._path_index = _RowHashIndex(self.path_key_of)  # ключ пути (см. path_key) -> строка
+        self._extra = {}  # строка -> поля записи, которых нет в FIELDS
+        self._free = []  # Строки удаленных записей
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, movie_id):
+        return self._id_index.get(movie_id) is not None
+
+    @staticmethod
+    def path_key(path):
+        """Ключ индекса по пути: normalize_movie_path в UTF-8."""
+        return normalize_movie_path(path).encode('utf-8', 'surrogatepass')
+
+    def path_key_of(self, row):
+        """Ключ индекса по пути для записи строки row."""
+        return self.path_key(self.get(row, 'path', ''))
+
+    def row(self, movie_id):
+        return self._id_index.get(movie_id)
+
+    def row_by_path(self, path):
+        return self._path_index.get(self.path_key(path))
+
+    def rows(self):
+        """Строки всех записей по порядку (список)."""
+        if not self._free:
+            return list(range(len(self._ids)))
+        free = set(self._free)
+        return [row for row in range(len(self._ids)) if row not in free]
+
+    def id_of(self, row):
+        return self._ids.get(row)
+
+    def get(self, row, field, default=None):
+        """Значение поля записи строки row (default, если поля нет)."""
+        if field == 'id':
+            return self._ids.get(row)
+        column = self._columns.get(field)
+        if column is None:
+            return self._extra.get(row, {}).get(field, default)
+        value = column.get(row)
+        return default if value is _MISSING else value
+
+    def view(self, row):
+        return _MovieRow(self, row)
+
+    def record(self, row):
+        """Запись строки row новым словарем (поля в порядке FIELDS)."""
+        result = {'id': self._ids.get(row)}
+        for field, column in self._columns.items():
+            value = column.get(row)
+            if value is not _MISSING:
+                result[field] = value
+        extra = self._extra.get(row)
+        if extra:
+            result.update(extra)
+        return result
+
+    def records(self):
+        """Все записи (новые словари) по одной, по порядку строк."""
+        for row in self.rows():
+            yield self.record(row)
+
+    def find(self, field, value):
+        """Строки записей, у которых поле field равно value."""
+        if field == 'id':
+            row = self.row(value)
+            return [] if row is None else [row]
+        return self._columns[field].find(value)
+
+    def rows_matching(self, field, predicate, default=None):
+        """Множество строк, значение поля которых подходит под predicate (default - для записей без поля)."""
+        column = self._columns[field]
+        # Повторяющиеся значения - общие объекты (_share): predicate вызывается один раз на объект
+        results = {}
+        matched = set()
+        for row in self.rows():
+            value = column.get(row)
+            key = id(value)
+            if key not in results:
+                results[key] = predicate(default if value is _MISSING else value)
+            if results[key]:
+                matched.add(row)
+        return matched
+
+    def distinct(self, field):
+        """Все значения поля хеша (_DigestColumn) у записей таблицы."""
+        return self._columns[field].distinct()
+
+    def duplicates(self, field):
+        """Группы строк с одинаковым значением поля хеша (_DigestColumn)."""
+        return self._columns[field].duplicates()
+
+    def put(self, movie):
+        """Добавляет запись или заменяет запись с тем же id. Возвращает строку записи."""
+        movie_id = movie['id']
+        row = self._id_index.get(movie_id)
+        if row is None:
+            row = self._free.pop() if self._free else len(self._ids)
+            self._ids.set(row, movie_id)
+            self._id_index.add(movie_id, row)
+            self._count += 1
+        else:
+            self._path_index.remove(self.path_key_of(row), row)
+        get = movie.get
+        for field, column in self._columns.items():
+            column.set(row, get(field, _MISSING))
+        if self._FIELD_SET.issuperset(movie):
+            self._extra.pop(row, None)
+        else:
+            self._extra[row] = {key: value for key, value in movie.items() if key not in self._FIELD_SET}
+        self._path_index.add(self.path_key(movie['path']), row)
+        return row
+
+    def extend(self, movies, batch_size=1000):
+        """
+        Массовое добавление (загрузка базы): записи пачки пишутся в колонки разом, колонка за колонкой,
+        а не поле за полем через put. Записи с уже известным id заменяют прежние, как в put.
+        """
+        batch = []
+        batch_ids = set()
+        for movie in movies:
+            movie_id = movie['id']
+            if self._free or movie_id in batch_ids or movie_id in self:
+                self._extend_rows(batch)
+                batch, batch_ids = [], set()
+                self.put(movie)
+                continue
+            batch.append(movie)
+            batch_ids.add(movie_id)
+            if len(batch) >= batch_size:
+                self._extend_rows(batch)
+                batch, batch_ids = [], set()
+        self._extend_rows(batch)
+
+    def _extend_rows(self, movies):
+        """Добавляет записи с новыми id в новые строки в конце таблицы (свободных строк нет)."""
+        start = len(self._ids)
+        self._ids.extend([movie['id'] for movie in movies])
+        for field, column in self._columns.items():
+            column.extend([movie.get(field, _MISSING) for movie in movies])
+        for row, movie in enumerate(movies, start):
+            if not self._FIELD_SET.issuperset(movie):
+                self._extra[row] = {key: value for key, value in movie.items() if key not in self._FIELD_SET}
+            self._id_index.add(movie['id'], row)
+            self._path_index.add(self.path_key(movie['path']), row)
+        self._count += len(movies)
+
+    def delete(self, movie_id):
+        """Удаляет запись. Возвращает ее бывшую строку или None."""
+        row = self._id_index.get(movie_id)
+        if row is None:
+            return None
+        # Запись с тем же путем могла заменить эту в индексе по пути - тогда remove ее не тронет
+        self._path_index.remove(self.path_key_of(row), row)
+        self._id_index.remove(movie_id, row)
+        for column in self._columns.values():
+            column.set(row, _MISSING)
+        self._extra.pop(row, None)
+        self._ids.set(row, None)
+        self._free.append(row)
+        self._count -= 1
+        return row
+
+    def export_state(self):
+        """Состояние из встроенных типов для снимка (копии: сериализовать можно уже без блокировки)."""
+        return {
+            'ids': self._ids.export_state(),
+            'id_index': self._id_index.export_state(),
+            'path_index': self._path_index.export_state(),
+            'extra': {row: dict(fields) for row, fields in self._extra.items()},
+            'free': list(self._free),
+            'columns': {field: column.export_state() for field, column in self._columns.items()},
+        }
+
+    def restore_state(self, state):
+        self._ids.restore_state(state['ids'])
+        self._count = len(self._ids) - len(state['free'])
+        self._id_index.restore_state(state['id_index'])
+        self._path_index.restore_state(state['path_index'])
+        self._extra = state['extra']
+        self._free = state['free']
+        for field, column in self._columns.items():
+            column.restore_state(state['columns'][field])
+
+
+class _MovieRow(collections.abc.Mapping):
+    """Запись строки MovieTable только для чтения, без копирования полей (для индексов, под блокировкой таблицы)."""
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key):
+        value = self._table.get(self._row, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        return self._table.get(self._row, key, default)
+
+    def __iter__(self):
+        return iter(self._table.record(self._row))
+
+    def __len__(self):
+        return len(self._table.record(self._row))
+
+
+class JsonMovieStorage:
+    """
+    Хранилище базы в одном JSON-файле. Любое изменение перезаписывает файл целиком,
+    но атомарно: запись во временный файл и замена, поэтому сбой не оставляет битую базу.
+    """
+
+    pending_migration = None  # Общий интерфейс с SqliteMovieStorage: JSON-базе переносить нечего
+    rewrites_all = True  # commit пишет весь список записей, а не только измененные
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        Записи по одной (генератор): каждая разбирается отдельно и не ждет остальных,
+        поэтому весь список словарей никогда не лежит в памяти целиком.
+        """
+        if not os.path.exists(self.path):
+            print("База данных не найдена. Создаю новую.")
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        decoder = json.JSONDecoder()
+        skip = json.decoder.WHITESPACE.match
+        try:
+            position = skip(text, 0).end()
+            if text[position:position + 1] != '[':
+                raise json.JSONDecodeError("Expecting '['", text, position)
+            position = skip(text, position + 1).end()
+            if text[position:position + 1] == ']':
+                position += 1
+            else:
+                while True:
+                    movie, position = decoder.raw_decode(text, position)
+                    yield movie
+                    position = skip(text, position).end()
+                    if text[position:position + 1] == ']':
+                        position += 1
+                        break
+                    if text[position:position + 1] != ',':
+                        raise json.JSONDecodeError("Expecting ',' delimiter", text, position)
+                    position = skip(text, position + 1).end()
+            if skip(text, position).end() != len(text):
+                raise json.JSONDecodeError("Extra data", text, position)
+        except json.JSONDecodeError as e:
+            # Не затираем поврежденный файл молча: откладываем его в сторону для ручного восстановления.
+            # Записи до места повреждения уже прочитаны и войдут в новую базу
+            backup_path = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, backup_path)
+            print(f"Предупреждение: База данных повреждена ({e}). Файл сохранен как {backup_path}, создаю новую.")
+
+    def save_all(self, movies):
+        """Пишет записи по одной в том же виде, что json.dump(..., indent=4): список не собирается целиком."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            empty = True
+            for movie in movies:
+                f.write('[\n    ' if empty else ',\n    ')
+                # Внутри строк JSON переводов строки нет (они экранированы), поэтому отступ добавляется заменой
+                f.write(json.dumps(dict(movie), indent=4, ensure_ascii=False).replace('\n', '\n    '))
+                empty = False
+            f.write('[]' if empty else '\n]')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def commit(self, movies, upserted=(), deleted_ids=()):
+        """JSON не умеет менять отдельные записи, поэтому сохраняется весь список."""
+        self.save_all(movies)
+
+    def stamp(self):
+        """Отметка состояния базы для проверки снимка (LibrarySnapshot): меняется при каждой записи файла."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return ('json', st.st_size, st.st_mtime_ns)
+
+    def close(self):
+        pass
+
+
+class SqliteMovieStorage:
+    """
+    Хранилище базы в SQLite (режим WAL). Изменения записываются построчно (upsert/delete),
+    полная запись в JSON лежит в колонке data, а поля для поиска и фильтрации продублированы
+    в отдельных проиндексированных колонках. При первом запуске переносит данные из JSON-базы
+    фоновой задачей (MovieManager.migrate_storage): пока перенос не закончен (pending_migration),
+    база читается и сохраняется в прежний JSON-файл, и запуск не ждет переноса.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS movies (
+            id TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            title TEXT,
+            genre TEXT,
+            year,
+            rating REAL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_movies_path ON movies(path);
+        CREATE INDEX IF NOT EXISTS idx_movies_year ON movies(year);
+        CREATE INDEX IF NOT EXISTS idx_movies_genre ON movies(genre);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('database_id', lower(hex(randomblob(16))));
+    """
+    # Номер изменения базы: растет в той же транзакции, что и каждая запись (см. stamp)
+    BUMP_GENERATION_SQL = "UPDATE meta SET value = value + 1 WHERE key = 'generation'"
+    UPSERT_SQL = """
+        INSERT INTO movies (id, path, title, genre, year, rating, data) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET path = excluded.path, title = excluded.title, genre = excluded.genre,
+            year = excluded.year, rating = excluded.rating, data = excluded.data
+    """
+
+    def __init__(self, path, legacy_json_path=None):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self._lock = threading.Lock()
+        is_new = not os.path.exists(self.path)
+        self._conn = self._connect()
+        # JSON-база, которую еще нужно перенести (None - переносить нечего)
+        self.pending_migration = None
+        self._migration_dirty = set()  # id записей, измененных во время переноса
+        if legacy_json_path and os.path.exists(legacy_json_path):
+            with self._lock, self._conn:
+                # Перенос, прерванный закрытием приложения, начинается заново при следующем запуске
+                if is_new:
+                    self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migration', 'pending')")
+                state = self._conn.execute("SELECT value FROM meta WHERE key = 'migration'").fetchone()
+            if state == ('pending',):
+                self.pending_migration = JsonMovieStorage(legacy_json_path)
+
+    def _connect(self):
+        try:
+            conn = self._open_connection()
+            conn.execute("SELECT count(*) FROM movies").fetchone()  # Проверка целостности файла
+            return conn
+        except sqlite3.DatabaseError as e:
+            backup_path = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, backup_path)
+            print(f"Предупреждение: База данных повреждена ({e}). Файл сохранен как {backup_path}, создаю новую.")
+            return self._open_connection()
+
+    def _open_connection(self):
+        # Доступ из разных потоков (наблюдатель, пул) сериализуется self._lock
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # В WAL этого достаточно для целостности при сбое
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    def migrate_batch(self, movies):
+        """Копирует пачку записей из JSON-базы в SQLite (перенос, см. MovieManager.migrate_storage)."""
+        with self._lock, self._conn:
+            self._conn.executemany(self.UPSERT_SQL, map(self._row, movies))
+
+    def finish_migration(self, movie_ids, record):
+        """
+        Завершает перенос: догоняет изменения, сделанные во время копирования, и откладывает JSON-файл.
+        movie_ids - id всех записей базы (поддерживает in), record(id) - текущая запись или None.
+        Вызывается под блокировкой владельца базы, чтобы изменения не шли параллельно.
+        """
+        with self._lock, self._conn:
+            stale = [(movie_id,) for (movie_id,) in self._conn.execute("SELECT id FROM movies").fetchall()
+                     if movie_id not in movie_ids]
+            self._conn.executemany("DELETE FROM movies WHERE id = ?", stale)
+            changed = filter(None, map(record, self._migration_dirty))
+            self._conn.executemany(self.UPSERT_SQL, map(self._row, changed))
+            self._conn.execute("UPDATE meta SET value = 'done' WHERE key = 'migration'")
+            self._conn.execute(self.BUMP_GENERATION_SQL)
+        json_path = self.pending_migration.path
+        migrated_path = f"{json_path}.migrated"
+        os.replace(json_path, migrated_path)
+        self.pending_migration = None
+        self._migration_dirty.clear()
+        print(f"База данных перенесена из {json_path} в SQLite. Старый файл сохранен как {migrated_path}.")
+
+    @staticmethod
+    def _row(movie):
+        return (movie['id'], movie['path'], movie.get('title'), movie.get('genre'), movie.get('year'),
+                movie.get('rating'), json.dumps(dict(movie), ensure_ascii=False))
+
+    @property
+    def rewrites_all(self):
+        """commit пишет весь список записей: только до конца переноса, пока основная база - JSON."""
+        return self.pending_migration is not None
+
+    def load(self, batch_size=1000):
+        """
+        Записи по одной (генератор), в порядке добавления. Строки читаются пачками по batch_size,
+        поэтому в памяти никогда не лежит вся база в виде JSON-строк и словарей.
+        """
+        if self.pending_migration is not None:
+            yield from self.pending_migration.load()
+            return
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT rowid, data FROM movies WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                          (last_rowid, batch_size)).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            for _, data in rows:
+                yield json.loads(data)
+
+    def save_all(self, movies):
+        if self.pending_migration is not None:
+            self.pending_migration.save_all(self._track_migration_changes(movies))
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM movies")
+            self._conn.executemany(self.UPSERT_SQL, map(self._row, movies))
+            self._conn.execute(self.BUMP_GENERATION_SQL)
+
+    def commit(self, movies, upserted=(), deleted_ids=()):
+        """Записывает только измененные и удаленные записи в одной транзакции."""
+        if not upserted and not deleted_ids:
+            return
+        if self.pending_migration is not None:
+            # До конца переноса основная база - JSON; удаленные записи уберет finish_migration
+            self.pending_migration.save_all(movies)
+            self._migration_dirty.update(movie['id'] for movie in upserted)
+            return
+        rows = [self._row(m) for m in upserted]
+        with self._lock, self._conn:
+            if deleted_ids:
+                self._conn.executemany("DELETE FROM movies WHERE id = ?", [(movie_id,) for movie_id in deleted_ids])
+            if rows:
+                self._conn.executemany(self.UPSERT_SQL, rows)
+            self._conn.execute(self.BUMP_GENERATION_SQL)
+
+    def stamp(self):
+        """
+        Отметка состояния базы для проверки снимка (LibrarySnapshot): id базы (новый файл - новый id)
+        и номер изменения.
+        """
+        if self.pending_migration is not None:
+            return self.pending_migration.stamp()
+        with self._lock:
+            meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        return ('sqlite', meta.get('database_id'), meta.get('generation'))
+
+    def _track_migration_changes(self, movies):
+        for movie in movies:
+            self._migration_dirty.add(movie['id'])
+            yield movie
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс для поиска по названию, году, жанру и описанию.
+    Поддерживает точное совпадение слова, совпадение по префиксу и нечеткое совпадение
+    (опечатки) по триграммам; результаты ранжируются с учетом веса поля.
+    Записи обозначаются номерами строк MovieTable. Основная часть индекса компактна и не меняется:
+    слова по алфавиту одной строкой, вхождения (строка записи и маска полей, где встретилось слово) в array.
+    Изменения записей копятся в небольшой добавке (_delta), вхождения измененных и удаленных записей
+    в основной части отмечаются устаревшими (_stale); выросшая добавка сливается с основной частью.
+    """
+
+    TOKEN_RE = re.compile(r'\w+')
+    FUZZY_MAX_TRIGRAM_TOKENS = 2000  # Триграммы, встречающиеся в большем числе слов, не помогают отбору
+    FUZZY_MAX_CANDIDATES = 100  # Сколько слов с наибольшим числом общих триграмм проверять на опечатку
+    MERGE_MIN_CHANGES = 1000  # Добавка сливается с основной частью, когда в ней больше изменений,
+    MERGE_FRACTION = 0.1  # чем это число и эта доля записей основной части
+
+    def __init__(self, field_weights=None):
+        self.field_weights = field_weights or SEARCH_FIELD_WEIGHTS
+        self._fields = tuple(self.field_weights)
+        self._mask_bits = len(self._fields)
+        # Вес слова в записи - сумма весов полей, в которых оно встретилось: маска полей -> вес
+        self._mask_weights = [sum(weight for bit, weight in enumerate(self.field_weights.values()) if mask >> bit & 1)
+                              for mask in range(1 << self._mask_bits)]
+        self._build_base(())
+        self._delta = {}  # слово -> {строка: маска полей}
+        self._delta_rows = {}  # строка -> слова записи в добавке (для удаления)
+        self._delta_sorted = []  # Слова добавки по алфавиту, для поиска по префиксу через bisect
+
+    @classmethod
+    def tokenize(cls, text):
+        return cls.TOKEN_RE.findall(str(text).lower().replace('ё', 'е'))
+
+    @staticmethod
+    def _token_trigrams(token):
+        padded = f" {token} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def _record_tokens(self, movie):
+        """{слово: маска полей записи, в которых оно встретилось}."""
+        masks = {}
+        for bit, field in enumerate(self._fields):
+            for token in self.tokenize(movie.get(field, '')):
+                masks[token] = masks.get(token, 0) | (1 << bit)
+        return masks
+
+    def build(self, items):
+        """Строит индекс заново. items - пары (строка записи, запись)."""
+        self._delta = {}
+        self._delta_rows = {}
+        self._delta_sorted = []
+
+        def entries():
+            for row, movie in items:
+                for token, mask in self._record_tokens(movie).items():
+                    yield token, row << self._mask_bits | mask
+
+        self._build_base(entries())
+
+    def _build_base(self, entries):
+        """
+        Основная часть из пар (слово, вхождение). Все промежуточные данные - в array, а не в списках
+        на каждое слово: после построения память возвращается целиком.
+        """
+        token_ids = {}
+        entry_tokens = array.array('I')
+        entry_postings = array.array('I')
+        for token, posting in entries:
+            token_id = token_ids.get(token)
+            if token_id is None:
+                token_id = token_ids[token] = len(token_ids)
+            entry_tokens.append(token_id)
+            entry_postings.append(posting)
+        vocabulary = sorted(token_ids)
+        rank = array.array('I', [0]) * len(vocabulary)  # номер слова при добавлении -> номер по алфавиту
+        for position, token in enumerate(vocabulary):
+            rank[token_ids[token]] = position
+        del token_ids
+        # Вхождения группируются по словам подсчетом: сколько у каждого слова, затем раскладка по местам
+        offsets = array.array('I', [0]) * (len(vocabulary) + 1)
+        for token_id in entry_tokens:
+            offsets[rank[token_id] + 1] += 1
+        for position in range(1, len(offsets)):
+            offsets[position] += offsets[position - 1]
+        postings = array.array('I', [0]) * len(entry_postings)
+        free = array.array('I', offsets)
+        rows = set()
+        for token_id, posting in zip(entry_tokens, entry_postings):
+            position = rank[token_id]
+            postings[free[position]] = posting
+            free[position] += 1
+            rows.add(posting >> self._mask_bits)
+        token_offsets = array.array('I', [0])
+        total = 0
+        for token in vocabulary:
+            total += len(token)
+            token_offsets.append(total)
+        self._vocabulary = ''.join(vocabulary)  # Все слова основной части по алфавиту подряд
+        self._token_offsets = token_offsets  # Начало каждого слова в _vocabulary (и конец последнего)
+        self._posting_offsets = offsets  # Начало вхождений каждого слова в _postings
+        self._postings = postings  # строка записи << _mask_bits | маска полей
+        self._base_rows = len(rows)  # Записей в основной части (для порога слияния)
+        self._base_row_limit = max(rows) + 1 if rows else 0  # Строки с вхождениями в основной части меньше этой
+        self._stale = set()  # Строки, вхождения которых в основной части устарели
+        self._trigrams = None  # триграмма -> номера слов основной части (при первом нечетком поиске)
+
+    def export_state(self):
+        """Состояние из встроенных типов для снимка библиотеки (копии: сериализовать можно без блокировки)."""
+        return {
+            'vocabulary': self._vocabulary,
+            'token_offsets': self._token_offsets.tobytes(),
+            'posting_offsets': self._posting_offsets.tobytes(),
+            'postings': self._postings.tobytes(),
+            'base_rows': self._base_rows,
+            'base_row_limit': self._base_row_limit,
+            'stale': list(self._stale),
+            'delta': {token: dict(rows) for token, rows in self._delta.items()},
+            'delta_rows': dict(self._delta_rows),
+        }
+
+    def restore_state(self, state):
+        self._vocabulary = state['vocabulary']
+        for name in ('token_offsets', 'posting_offsets', 'postings'):
+            values = array.array('I')
+            values.frombytes(state[name])
+            setattr(self, '_' + name, values)
+        self._base_rows = state['base_rows']
+        self._base_row_limit = state['base_row_limit']
+        self._stale = set(state['stale'])
+        self._trigrams = None
+        self._delta = state['delta']
+        self._delta_rows = state['delta_rows']
+        self._delta_sorted = sorted(self._delta)
+
+    def add(self, row, movie):
+        """Индексирует запись строки row (после remove, если строка уже была в индексе)."""
+        if row < self._base_row_limit:
+            self._stale.add(row)  # Прежние вхождения строки в основной части больше не действуют
+        masks = self._record_tokens(movie)
+        for token, mask in masks.items():
+            rows = self._delta.get(token)
+            if rows is None:
+                rows = self._delta[token] = {}
+                bisect.insort(self._delta_sorted, token)
+            rows[row] = mask
+        self._delta_rows[row] = tuple(masks)
+        if len(self._delta_rows) + len(self._stale) > max(self.MERGE_MIN_CHANGES, self.MERGE_FRACTION * self._base_rows):
+            self._merge()
+
+    def remove(self, row):
+        if row < self._base_row_limit:
+            self._stale.add(row)
+        for token in self._delta_rows.pop(row, ()):
+            rows = self._delta[token]
+            del rows[row]
+            if not rows:
+                del self._delta[token]
+                del self._delta_sorted[bisect.bisect_left(self._delta_sorted, token)]
+
+    def _merge(self):
+        """Сливает добавку с основной частью, отбрасывая устаревшие вхождения."""
+        stale, bits = self._stale, self._mask_bits
+
+        def entries():
+            for index in range(len(self._token_offsets) - 1):
+                token = self._token(index)
+                for posting in self._postings[self._posting_offsets[index]:self._posting_offsets[index + 1]]:
+                    if posting >> bits not in stale:
+                        yield token, posting
+            for token, rows in self._delta.items():
+                for row, mask in rows.items():
+                    yield token, row << bits | mask
+
+        self._build_base(entries())
+        self._delta = {}
+        self._delta_rows = {}
+        self._delta_sorted = []
+
+    def _token(self, index):
+        return self._vocabulary[self._token_offsets[index]:self._token_offsets[index + 1]]
+
+    def _bisect(self, token, low=0, right=False):
+        """Позиция token среди слов основной части (как bisect_left или bisect_right)."""
+        high = len(self._token_offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            current = self._token(middle)
+            if current < token or (right and current == token):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _base_postings(self, index):
+        """(строка, маска) действующих вхождений слова index основной части."""
+        stale, bits, fields = self._stale, self._mask_bits, (1 << self._mask_bits) - 1
+        for posting in self._postings[self._posting_offsets[index]:self._posting_offsets[index + 1]]:
+            row = posting >> bits
+            if row not in stale:
+                yield row, posting & fields
+
+    def _token_postings(self, token):
+        """(строка, маска) всех записей со словом token - из основной части и из добавки."""
+        index = self._bisect(token)
+        if index < len(self._token_offsets) - 1 and self._token(index) == token:
+            yield from self._base_postings(index)
+        rows = self._delta.get(token)
+        if rows:
+            yield from rows.items()
+
+    def _match_token(self, query_token):
+        """Возвращает {строка записи: оценка} для одного слова запроса."""
+        weights = self._mask_weights
+        scores = {row: weights[mask] for row, mask in self._token_postings(query_token)}
+
+        # Совпадение по префиксу: слова в диапазоне (query_token, query_token + max_char)
+        start = self._bisect(query_token, right=True)
+        end = self._bisect(query_token + '\U0010ffff', start)
+        delta_start = bisect.bisect_right(self._delta_sorted, query_token)
+        delta_end = bisect.bisect_left(self._delta_sorted, query_token + '\U0010ffff', delta_start)
+        if start == end and delta_start == delta_end:
+            if scores:
+                return scores
+            # Нечеткое совпадение ищем, только если нет ни точных, ни префиксных (и не для чисел)
+            return self._match_fuzzy(query_token) if len(query_token) >= 4 and not query_token.isdigit() else {}
+
+        prefixed = [self._base_postings(index) for index in range(start, end)]
+        prefixed += [self._delta[token].items() for token in self._delta_sorted[delta_start:delta_end]]
+        for postings in prefixed:
+            for row, mask in postings:
+                score = weights[mask] * SEARCH_PREFIX_FACTOR
+                if score > scores.get(row, 0.0):
+                    scores[row] = score
+        return scores
+
+    def _base_trigrams(self):
+        """триграмма -> номера слов основной части (строится при первом нечетком поиске)."""
+        if self._trigrams is None:
+            trigrams = {}
+            for index in range(len(self._token_offsets) - 1):
+                for trigram in self._token_trigrams(self._token(index)):
+                    indexes = trigrams.get(trigram)
+                    if indexes is None:
+                        indexes = trigrams[trigram] = array.array('I')
+                    indexes.append(index)
+            self._trigrams = trigrams
+        return self._trigrams
+
+    def _match_fuzzy(self, query_token):
+        """Кандидаты - слова словаря с общими триграммами; опечатка подтверждается расстоянием правки."""
+        max_edits = 1 if len(query_token) <= 5 else SEARCH_FUZZY_MAX_EDITS
+        query_trigrams = self._token_trigrams(query_token)
+        shared = {}
+        trigrams = self._base_trigrams()
+        for trigram in query_trigrams:
+            indexes = trigrams.get(trigram, ())
+            if len(indexes) > self.FUZZY_MAX_TRIGRAM_TOKENS:
+                continue
+            for index in indexes:
+                shared[index] = shared.get(index, 0) + 1
+        shared = {self._token(index): common for index, common in shared.items()}
+        # Слов в добавке немного: общие триграммы считаются напрямую
+        for token in self._delta:
+            common = len(query_trigrams & self._token_trigrams(token))
+            if common > shared.get(token, 0):
+                shared[token] = common
+        # Каждая правка портит не больше трех триграмм, поэтому у похожего слова их должно совпасть достаточно
+        min_common = max(1, len(query_trigrams) - 3 * max_edits)
+        candidates = heapq.nlargest(self.FUZZY_MAX_CANDIDATES,
+                                    (token for token, common in shared.items() if common >= min_common),
+                                    key=shared.__getitem__)
+        scores = {}
+        for token in candidates:
+            if abs(len(token) - len(query_token)) > max_edits:
+                continue
+            edits = self._edit_distance(query_token, token, max_edits)
+            if edits > max_edits:
+                continue
+            for row, mask in self._token_postings(token):
+                score = self._mask_weights[mask] * SEARCH_FUZZY_FACTOR / edits
+                if score > scores.get(row, 0.0):
+                    scores[row] = score
+        return scores
+
+    @staticmethod
+    def _edit_distance(a, b, max_edits):
+        """Расстояние Дамерау-Левенштейна (с перестановкой соседних букв); прерывается, превысив max_edits."""
+        previous_row, row = None, list(range(len(b) + 1))
+        for i in range(1, len(a) + 1):
+            before_previous, previous_row = previous_row, row
+            row = [i] + [0] * len(b)
+            for j in range(1, len(b) + 1):
+                cost = 0 if a[i - 1] == b[j - 1] else 1
+                row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+                if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                    row[j] = min(row[j], before_previous[j - 2] + 1)
+            if min(row) > max_edits:
+                return max_edits + 1
+        return row[-1]
+
+    def search(self, query, limit=None):
+        """
+        Возвращает строки записей, подходящих под все слова запроса, от наиболее к наименее релевантной.
+        limit - максимальное количество результатов (None - все).
+        """
+        query_tokens = list(dict.fromkeys(self.tokenize(query)))
+        if not query_tokens:
+            return []
+        total = None
+        # Начинаем с самого редкого слова, чтобы пересечение множеств было как можно меньше
+        for scores in sorted((self._match_token(token) for token in query_tokens), key=len):
+            if total is None:
+                total = scores
+            else:
+                total = {row: score + scores[row] for row, score in total.items() if row in scores}
+            if not total:
+                return []
+        if limit is not None and limit < len(total):
+            return heapq.nlargest(limit, total, key=total.__getitem__)
+        return sorted(total, key=total.__getitem__, reverse=True)
+
+
+def _as_number(value, default=0):
+    """Числовое значение поля для сортировки ("Неизвестен" и прочий текст считаются default)."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+# Ключи сортировки для get_movies_page: имя поля -> функция ключа записи
+SORT_KEY_FUNCS = {
+    'title': lambda movie: str(movie.get('title', '')).casefold(),
+    'year': lambda movie: _as_number(movie.get('year'), -1),
+    'rating': lambda movie: _as_number(movie.get('rating')),
+    'date_added': lambda movie: _as_number(movie.get('date_added')),
+    'size': lambda movie: _as_number(movie.get('size')),
+    'duration': lambda movie: _as_number(movie.get('duration')),
+}
+
+
+class SortedIndex:
+    """
+    Строки записей MovieTable в порядке ключа одного поля (при равных ключах - по id), в array.
+    Поддерживается в порядке при каждом изменении записи, поэтому страница списка берется срезом,
+    а диапазон значений (например, рейтинг от 7) - двоичным поиском, без сортировки всей библиотеки.
+    Ключи не хранятся: двоичный поиск вычисляет их по записям таблицы.
+    """
+
+    def __init__(self, table, key_func):
+        self.table = table
+        self.key_func = key_func
+        self._rows = array.array('I')
+
+    def __len__(self):
+        return len(self._rows)
+
+    def key_of(self, row):
+        return self.key_func(self.table.view(row))
+
+    def sort_key(self, row):
+        return self.key_of(row), self.table.id_of(row)
+
+    def build(self, rows):
+        rows = list(rows)
+        rows.sort(key=self.table.id_of)
+        rows.sort(key=self.key_of)  # Сортировка устойчива: при равных ключах остается порядок по id
+        self._rows = array.array('I', rows)
+
+    def _bisect(self, value, key, right=False):
+        """Позиция value в порядке индекса по функции key от строки (как bisect_left или bisect_right)."""
+        low, high = 0, len(self._rows)
+        while low < high:
+            middle = (low + high) // 2
+            current = key(self._rows[middle])
+            if current < value or (right and current == value):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def add(self, row):
+        self._rows.insert(self._bisect(self.sort_key(row), self.sort_key, right=True), row)
+
+    def remove(self, row):
+        """Убирает строку (до изменения ее записи в таблице: позиция ищется по прежнему ключу)."""
+        position = self._bisect(self.sort_key(row), self.sort_key)
+        if position < len(self._rows) and self._rows[position] == row:
+            del self._rows[position]
+        elif row in self._rows:
+            self._rows.remove(row)  # Ключ, несравнимый с соседними (NaN в оценке): позиция ищется перебором
+
+    def export_state(self):
+        return self._rows.tobytes()
+
+    def restore_state(self, data):
+        self._rows = array.array('I')
+        self._rows.frombytes(data)
+
+    def page(self, offset, limit, descending=False):
+        """Строки записей с позиции offset (в выбранном направлении сортировки)."""
+        if descending:
+            end = max(len(self._rows) - offset, 0)
+            return self._rows[max(end - limit, 0):end].tolist()[::-1]
+        return self._rows[offset:offset + limit].tolist()
+
+    def iter_rows(self, descending=False):
+        return reversed(self._rows) if descending else iter(self._rows)
+
+    def rows_in_range(self, low=None, high=None):
+        """Строки записей с low <= ключ <= high (None - без ограничения с этой стороны)."""
+        start = 0 if low is None else self._bisect(low, self.key_of)
+        end = len(self._rows) if high is None else self._bisect(high, self.key_of, right=True)
+        return set(self._rows[start:end])
+
+
+def _resolution_class(movie):
+    """Класс разрешения по высоте кадра: '2160p', '1080p', ..., 'SD' или 'Unknown'."""
+    try:
+        height = int(str(movie.get('resolution', '')).split('x')[1])
+    except (IndexError, ValueError):
+        return 'Unknown'
+    for min_height, label in STATS_RESOLUTION_CLASSES:
+        if height >= min_height:
+            return label
+    return 'SD'
+
+
+def _size_bucket(movie):
+    size = _as_number(movie.get('size'))
+    for limit, label in STATS_SIZE_BUCKETS:
+        if size < limit:
+            return label
+    return STATS_SIZE_BUCKETS[-1][1]
+
+
+# Группировки статистики библиотеки: имя -> функция, возвращающая группу записи
+STATS_GROUP_FUNCS = {
+    'genre': lambda movie: str(movie.get('genre') or 'Неизвестен'),
+    'year': lambda movie: str(movie.get('year') or 'Неизвестен'),
+    'resolution': _resolution_class,
+    'size': _size_bucket,
+}
+
+
+class LibraryStats:
+    """
+    Накопительные итоги библиотеки (количество, размер, длительность, сумма оценок) и те же итоги
+    по группам STATS_GROUP_FUNCS. Обновляются при каждом добавлении и удалении записи,
+    поэтому статистика не требует прохода по библиотеке.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_size = 0
+        self.total_duration = 0
+        self.rating_sum = 0.0
+        self.rating_count = 0
+        self._groups = {name: {} for name in STATS_GROUP_FUNCS}  # группировка -> группа -> [кол-во, размер, длительность]
+
+    def add(self, movie, sign=1):
+        size = movie.get('size') or 0
+        duration = movie.get('duration') or 0
+        self.count += sign
+        self.total_size += sign * size
+        self.total_duration += sign * duration
+        if isinstance(movie.get('rating'), (int, float)):
+            self.rating_sum += sign * movie['rating']
+            self.rating_count += sign
+        for name, func in STATS_GROUP_FUNCS.items():
+            groups = self._groups[name]
+            key = func(movie)
+            totals = groups.setdefault(key, [0, 0, 0])
+            totals[0] += sign
+            totals[1] += sign * size
+            totals[2] += sign * duration
+            if totals[0] <= 0:
+                del groups[key]
+
+    def remove(self, movie):
+        self.add(movie, sign=-1)
+
+    def export_state(self):
+        return (self.count, self.total_size, self.total_duration, self.rating_sum, self.rating_count, self._groups)
+
+    def restore_state(self, state):
+        self.count, self.total_size, self.total_duration, self.rating_sum, self.rating_count, self._groups = state
+
+    def groups(self, name):
+        """Группы одной группировки, от самых многочисленных: [{'key', 'count', 'size', 'duration'}]."""
+        return sorted(({'key': key, 'count': count, 'size': size, 'duration': duration}
+                       for key, (count, size, duration) in self._groups[name].items()),
+                      key=lambda group: (-group['count'], group['key']))
+
+    def to_dict(self):
+        return {
+            'total_movies': self.count,
+            'total_size': self.total_size,
+            'total_duration': self.total_duration,
+            'avg_rating': round(self.rating_sum / self.rating_count, 1) if self.rating_count else 0.0,
+            'groups': {name: self.groups(name) for name in self._groups},
+        }
+
+
+def open_movie_storage(db_file, backend=STORAGE_BACKEND):
+    """Создает хранилище базы. Для SQLite файл базы лежит рядом с db_file и получает расширение .sqlite3."""
+    if backend == 'json':
+        return JsonMovieStorage(db_file)
+    if backend == 'sqlite':
+        return SqliteMovieStorage(os.path.splitext(db_file)[0] + '.sqlite3', legacy_json_path=db_file)
+    raise ValueError(f"Неизвестное хранилище базы: {backend}")
+
+
+SNAPSHOT_FORMAT = 3  # Меняется при изменении структуры снимка
+
+
+class LibrarySnapshot:
+    """
+    Снимок библиотеки: таблица записей и построенные индексы MovieManager в формате marshal. Загружается
+    в несколько раз быстрее, чем разбор базы. Заголовок хранит отметку базы (storage.stamp(): id базы и номер
+    изменения) и формат снимка; при несовпадении снимок не используется - библиотека загружается из базы,
+    которая остается основной. Файл: заголовок и разделы (уже сериализованные marshal), каждый с длиной перед ним.
+    """
+
+    _LENGTH = struct.Struct('<Q')
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def code_stamp():
+        """marshal не переносим между версиями Python; структура разделов меняется вместе с SNAPSHOT_FORMAT."""
+        return (SNAPSHOT_FORMAT, marshal.version, tuple(sys.version_info[:2]))
+
+    def load(self, stamp):
+        """Разделы снимка (list) или None, если снимка нет или он не соответствует базе stamp и текущему коду."""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            sections = []
+            offset = 0
+            while offset < len(data):
+                (length,) = self._LENGTH.unpack_from(data, offset)
+                offset += self._LENGTH.size
+                if offset + length > len(data):
+                    raise EOFError("файл обрезан")
+                sections.append(data[offset:offset + length])
+                offset += length
+                if len(sections) == 1 and marshal.loads(sections[0]) != (self.code_stamp(), stamp):
+                    return None  # Устаревший снимок: остальное не разбираем
+            # Разбор создает миллионы объектов: без сборщика мусора, который иначе многократно обходил бы их
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                return [marshal.loads(section) for section in sections[1:]]
+            finally:
+                if gc_enabled:
+                    gc.enable()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError, struct.error) as e:
+            print(f"Снимок библиотеки поврежден ({e}), загружаю базу.")
+            return None
+
+    def write(self, stamp, *sections):
+        """Атомарно записывает снимок из разделов, уже сериализованных marshal.dumps."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            for section in (marshal.dumps((self.code_stamp(), stamp)),) + sections:
+                f.write(self._LENGTH.pack(len(section)))
+                f.write(section)
+        os.replace(tmp_path, self.path)
+
+
+class _ChangeLock:
+    """
+    Блокировка базы MovieManager: повторно входимая, как threading.RLock, и с отложенным действием.
+    Если внутри блока был вызван defer(), after_release() выполняется, когда поток выходит из внешнего
+    блока with - уже без блокировки (так запись в хранилище не задерживает чтение базы).
+    """
+
+    def __init__(self, after_release):
+        self._lock = threading.RLock()
+        self._local = threading.local()  # depth - вложенность блоков потока, deferred - нужен after_release
+        self._after_release = after_release
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        return True
+
+    def release(self):
+        self._local.depth -= 1
+        deferred = False
+        if self._local.depth == 0:
+            deferred, self._local.deferred = getattr(self._local, 'deferred', False), False
+        self._lock.release()
+        if deferred:
+            self._after_release()
+
+    def defer(self):
+        """Вызывается под блокировкой: после выхода из внешнего блока выполнить after_release."""
+        self._local.deferred = True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class MovieManager:
+    """Класс для управления коллекцией фильмов: загрузка, сохранение, сканирование, CRUD операции."""
+
+    def __init__(self, db_file, scan_workers=SCAN_WORKERS, backend=STORAGE_BACKEND, snapshot=SNAPSHOT_ENABLED):
+        self.db_file = db_file
+        self.storage = open_movie_storage(db_file, backend)
+        # Снимок записей и индексов для быстрого запуска (None - не использовать)
+        self.snapshot = LibrarySnapshot(os.path.splitext(db_file)[0] + '.snapshot') if snapshot else None
+        self._snapshot_stamp = None  # Отметка базы, которой соответствует снимок на диске
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_timer = None  # Отложенная запись снимка после изменения базы (см. _schedule_snapshot)
+        # Отдельная блокировка: изменения базы не должны ждать записи снимка под self._snapshot_lock
+        self._snapshot_timer_lock = threading.Lock()
+        self.scan_workers = scan_workers
+        # Изменения, еще не записанные в хранилище: (все записи или None, upserted, deleted_ids) по порядку
+        self._pending_writes = collections.deque()
+        # Защищает записи и индексы: их меняют и фоновые потоки. Хранилище пишется после выхода из блока
+        # (_flush_writes) под self._storage_lock; если нужны обе блокировки, self._lock берется первой
+        self._lock = _ChangeLock(self._flush_writes)
+        self._storage_lock = threading.Lock()
+        self._scan_lock = threading.Lock()  # Не дает двум сканированиям обрабатывать одни и те же файлы
+        self._walker = LibraryWalker()
+        # Записи по колонкам с индексами по id и пути; остальные индексы ссылаются на строки таблицы.
+        # Поиск по inode, отпечатку, жанру и превью - поиск по колонке таблицы, без отдельных словарей
+        self._table = MovieTable()
+        # Поисковый и сортированные индексы строятся при первом обращении (_search, _sorted_index):
+        # открытие базы не ждет индексов, которые понадобятся не сразу или не понадобятся вовсе
+        self._search_index = None
+        self._sorted = {}  # имя поля SORT_KEY_FUNCS -> SortedIndex
+        self._stats = LibraryStats()
+        # Превью хранятся по содержимому, и одно значение thumbnail может быть у нескольких записей (копии).
+        # Файлы удаляются, когда значение не осталось ни у одной записи (см. _apply_changes)
+        self._released_thumbnails = set()  # Превью замененных и удаленных записей в текущем _apply_changes
+        # Версия базы растет на 1 с каждым изменением записи; журнал хранит (версия, id) последних изменений.
+        # epoch отличает запуски приложения: версии разных запусков сравнивать нельзя.
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self._changelog = collections.deque(maxlen=CHANGELOG_SIZE)
+        self._change_listeners = []
+        self._thumbnails_in_progress = set()  # id записей, превью которых сейчас создается
+        self._thumbnail_failed = set()  # id записей, из которых не удалось взять кадр (не пробуем повторно)
+        self.loaded_from_snapshot = self._load_snapshot()
+        if not self.loaded_from_snapshot:
+            converted = []
+            # Записи идут из хранилища прямо в таблицу, по одной
+            self._replace_movies(self._ensure_ids_are_strings(self._load_movies(), converted))
+            if converted:  # Убеждаемся, что ID в БД хранятся как строки
+                self._save_movies()
+
+    @property
+    def movies(self):
+        """Список записей (новые словари) в порядке добавления."""
+        with self._lock:
+            return list(self._table.records())
+
+    @movies.setter
+    def movies(self, movies):
+        self._replace_movies(movies)
+
+    def _record(self, movie_id):
+        """Запись по id (новый словарь) или None. Вызывается под self._lock."""
+        row = self._table.row(movie_id)
+        return None if row is None else self._table.record(row)
+
+    def _replace_movies(self, movies):
+        """Заменяет все записи (movies - любой итерируемый источник словарей) и перестраивает индексы."""
+        table = MovieTable()
+        table.extend(movies)
+        stats = LibraryStats()
+        for row in table.rows():
+            stats.add(table.view(row))
+        with self._lock:
+            self._table = table
+            self._search_index = None  # Построятся целиком при первом обращении
+            self._sorted = {}
+            self._stats = stats
+            # Список заменен целиком - клиентам нужен полный снимок, журнал больше не поможет
+            self.version += 1
+            self._changelog.clear()
+        self._notify_change_listeners()
+
+    def _export_state(self):
+        """
+        Таблица и индексы из встроенных типов для снимка (см. save_snapshot). Вызывается под self._lock;
+        результат - копии, сериализовать можно уже без блокировки.
+        """
+        return {
+            'table': self._table.export_state(),
+            'search': None if self._search_index is None else self._search_index.export_state(),
+            'sorted': {name: index.export_state() for name, index in self._sorted.items()},
+            'stats': marshal.loads(marshal.dumps(self._stats.export_state())),  # Группы меняются на месте
+        }
+
+    def _restore_state(self, state):
+        """Заменяет записи и индексы состоянием из снимка, без пересчета индексов."""
+        table = MovieTable()
+        table.restore_state(state['table'])
+        search_index = None
+        if state['search'] is not None:  # Индексы, не построенные к моменту снимка, строятся при обращении
+            search_index = SearchIndex()
+            search_index.restore_state(state['search'])
+        sorted_indexes = {}
+        for name, index_state in state['sorted'].items():
+            if name in SORT_KEY_FUNCS:
+                sorted_indexes[name] = SortedIndex(table, SORT_KEY_FUNCS[name])
+                sorted_indexes[name].restore_state(index_state)
+        stats = LibraryStats()
+        stats.restore_state(state['stats'])
+        with self._lock:
+            self._table = table
+            self._search_index = search_index
+            self._sorted = sorted_indexes
+            self._stats = stats
+            self.version += 1
+            self._changelog.clear()
+        self._notify_change_listeners()
+
+    def _load_snapshot(self):
+        """Загружает записи и индексы из снимка, если он соответствует базе. Возвращает True при успехе."""
+        if self.snapshot is None:
+            return False
+        try:
+            stamp = self.storage.stamp()
+            sections = self.snapshot.load(stamp)
+            if sections is None:
+                return False
+            self._restore_state(*sections)
+        except Exception as e:
+            print(f"Ошибка загрузки снимка библиотеки: {e}")
+            return False
+        self._snapshot_stamp = stamp
+        print(f"Библиотека загружена из снимка ({len(self._table)} фильмов).")
+        return True
+
+    def _schedule_snapshot(self):
+        """
+        Запись снимка через SNAPSHOT_WRITE_DELAY секунд после изменения базы. Пока запись ожидает,
+        новые изменения ее не откладывают: при долгом сканировании снимок обновляется раз в SNAPSHOT_WRITE_DELAY.
+        """
+        if self.snapshot is None:
+            return
+        with self._snapshot_timer_lock:
+            if self._snapshot_timer is not None:
+                return
+            self._snapshot_timer = threading.Timer(SNAPSHOT_WRITE_DELAY, self._snapshot_timer_fired)
+            self._snapshot_timer.daemon = True
+            self._snapshot_timer.start()
+
+    def _snapshot_timer_fired(self):
+        with self._snapshot_timer_lock:
+            self._snapshot_timer = None
+        self.save_snapshot()
+
+    @metrics.timed('save_snapshot')
+    def save_snapshot(self):
+        """
+        Записывает снимок текущего состояния, если номер изменения базы отличается от того, что в снимке.
+        Вызывается в фоне после изменений базы (_schedule_snapshot) и при выходе. Возвращает True, если снимок записан.
+        """
+        if self.snapshot is None:
+            return False
+        with self._snapshot_lock:
+            try:
+                with self._lock:
+                    if self._pending_writes:
+                        # Хранилище еще не догнало записи в памяти: отметка не соответствовала бы состоянию
+                        self._schedule_snapshot()
+                        return False
+                    stamp = self.storage.stamp()
+                    if stamp is None or stamp == self._snapshot_stamp:
+                        return False
+                    state = self._export_state()
+                self.snapshot.write(stamp, marshal.dumps(state))
+            except Exception as e:
+                print(f"Ошибка сохранения снимка библиотеки: {e}")
+                return False
+            self._snapshot_stamp = stamp
+            return True
+
+    def _index_movie(self, row):
+        """Добавляет запись строки row во вторичные индексы (после записи в таблицу)."""
+        movie = self._table.view(row)
+        self._stats.add(movie)
+        if self._search_index is not None:
+            self._search_index.add(row, movie)
+        for index in self._sorted.values():
+            index.add(row)
+
+    def _unindex_movie(self, row):
+        """Убирает запись строки row из вторичных индексов (до изменения или удаления записи в таблице)."""
+        movie = self._table.view(row)
+        if movie.get('thumbnail'):
+            self._released_thumbnails.add(movie['thumbnail'])
+        self._stats.remove(movie)
+        if self._search_index is not None:
+            self._search_index.remove(row)
+        for index in self._sorted.values():
+            index.remove(row)
+
+    def _search(self):
+        """Поисковый индекс; строится при первом поиске. Вызывается под self._lock."""
+        if self._search_index is None:
+            index = SearchIndex()
+            index.build((row, self._table.view(row)) for row in self._table.rows())
+            self._search_index = index
+        return self._search_index
+
+    def _sorted_index(self, name):
+        """Сортированный индекс поля name; строится при первом обращении. Вызывается под self._lock."""
+        index = self._sorted.get(name)
+        if index is None:
+            index = SortedIndex(self._table, SORT_KEY_FUNCS[name])
+            index.build(self._table.rows())
+            self._sorted[name] = index
+        return index
+
+    def _apply_changes(self, upserted=(), deleted_ids=()):
+        """
+        Единая точка изменения базы: обновляет записи и все индексы, затем сохраняет изменения.
+        Записи наружу отдаются копиями, поэтому список, уже отданный другому потоку, остается согласованным.
+        """
+        with self._lock:
+            if len(upserted) + len(deleted_ids) > max(1000, len(self._table) // 10):
+                # Большая пачка (новая папка, удаленный диск): построить индексы заново при обращении
+                # дешевле, чем менять их по одной записи
+                self._search_index = None
+                self._sorted = {}
+            for movie_id in deleted_ids:
+                row = self._table.row(movie_id)
+                if row is not None:
+                    self._unindex_movie(row)
+                    self._table.delete(movie_id)
+            for movie in upserted:
+                row = self._table.row(movie['id'])
+                if row is not None:
+                    self._unindex_movie(row)
+                self._index_movie(self._table.put(movie))
+            for movie_id in list(deleted_ids) + [movie['id'] for movie in upserted]:
+                self.version += 1
+                self._changelog.append((self.version, movie_id))
+            if upserted or deleted_ids:
+                # Запись в хранилище (весь файл JSON, большая пачка в SQLite) - после выхода из self._lock,
+                # чтобы не задерживать чтение базы из интерфейса; JSON получает копию записей на этот момент
+                movies = list(self._table.records()) if self.storage.rewrites_all else None
+                self._pending_writes.append((movies, upserted, deleted_ids))
+                self._lock.defer()
+            # Превью, которые больше не встречаются ни у одной записи (в том числе старое превью измененной записи).
+            # Проверка после всех изменений: у новой записи могло оказаться то же превью (тот же кадр)
+            released, self._released_thumbnails = self._released_thumbnails, set()
+            if len(released) > 64:
+                released -= self._table.distinct('thumbnail')  # Один проход по колонке вместо поиска каждого
+            for thumbnail in released:
+                if not self._table.find('thumbnail', thumbnail):
+                    remove_thumbnail_files(thumbnail)
+        if upserted or deleted_ids:
+            self._notify_change_listeners()
+
+    def add_change_listener(self, listener):
+        """Подписка на изменения базы: listener(version) вызывается после каждого изменения (из любого потока)."""
+        self._change_listeners.append(listener)
+
+    def _notify_change_listeners(self):
+        self._schedule_snapshot()
+        for listener in self._change_listeners:
+            try:
+                listener(self.version)
+            except Exception as e:
+                print(f"Ошибка обработчика изменений базы: {e}")
+
+    def get_changes_since(self, version, epoch=None, snapshot=True):
+        """
+        Изменения базы после версии version: {'full': False, 'version', 'upserts': [...], 'deletes': [id, ...]}.
+        Если журнал уже не содержит нужных версий (или epoch от другого запуска), возвращает
+        {'full': True, 'version', 'movies': весь список} (movies только при snapshot=True).
+        """
+        with self._lock:
+            try:
+                version = int(version)
+            except (TypeError, ValueError):
+                version = -1
+            oldest = self._changelog[0][0] if self._changelog else self.version + 1
+            if (epoch is not None and epoch != self.epoch) or version < 0 or version > self.version \
+                    or oldest > version + 1:
+                result = {'full': True, 'version': self.version, 'epoch': self.epoch}
+                if snapshot:
+                    result['movies'] = self.movies
+                return result
+
+            changed_ids = []
+            # Журнал упорядочен по версии: идем с конца до нужной версии
+            for entry_version, movie_id in reversed(self._changelog):
+                if entry_version <= version:
+                    break
+                changed_ids.append(movie_id)
+            upserts, deletes = [], []
+            for movie_id in dict.fromkeys(reversed(changed_ids)):
+                movie = self._record(movie_id)
+                if movie is None:
+                    deletes.append(movie_id)
+                else:
+                    upserts.append(movie)
+            return {'full': False, 'version': self.version, 'epoch': self.epoch, 'upserts': upserts, 'deletes': deletes}
+
+    def _load_movies(self):
+        """Записи базы из хранилища по одной (генератор). Ошибка чтения прерывает загрузку."""
+        try:
+            yield from self.storage.load()
+        except Exception as e:
+            print(f"Ошибка загрузки БД: {e}")
+
+    @metrics.timed('save_movies')
+    def _save_movies(self):
+        """Полностью сохраняет текущее состояние базы данных фильмов."""
+        try:
+            with self._lock, self._storage_lock:
+                self._pending_writes.clear()  # Полная запись включает и еще не сохраненные изменения
+                self.storage.save_all(self._table.records())
+        except Exception as e:
+            print(f"Ошибка сохранения БД: {e}")
+
+    def _flush_writes(self):
+        """
+        Записывает изменения из очереди в хранилище по порядку (после выхода из self._lock, см. _apply_changes).
+        Если очередь уже пишет другой поток, он запишет и новые изменения: освободив self._storage_lock,
+        он проверяет очередь снова.
+        """
+        while self._pending_writes:
+            if not self._storage_lock.acquire(blocking=False):
+                return
+            try:
+                while self._pending_writes:
+                    self._persist(*self._pending_writes[0])
+                    self._pending_writes.popleft()  # Только после записи: save_snapshot ждет пустой очереди
+            finally:
+                self._storage_lock.release()
+
+    @metrics.timed('persist_changes')
+    def _persist(self, movies, upserted=(), deleted_ids=()):
+        """Сохраняет только изменившиеся записи (SQLite пишет их построчно, JSON - весь файл movies)."""
+        try:
+            self.storage.commit(movies or (), upserted=upserted, deleted_ids=deleted_ids)
+        except Exception as e:
+            print(f"Ошибка сохранения БД: {e}")
+
+    def migrate_storage(self, job=None, batch_size=1000):
+        """
+        Переносит базу из JSON в SQLite пачками по batch_size записей (фоновая задача первого запуска).
+        База все это время доступна: блокировка берется только на чтение пачки и на завершение переноса.
+        Возвращает количество перенесенных записей (0 - переносить нечего).
+        """
+        storage = self.storage
+        if storage.pending_migration is None:
+            return 0
+        with self._lock:
+            rows = self._table.rows()
+        for start in range(0, len(rows), batch_size):
+            if job is not None:
+                job.check_cancelled()
+                job.report(start, len(rows))
+            with self._lock:
+                # Строки, ставшие свободными, пропускаем; записи, измененные после копирования, догонит finish_migration
+                batch = [self._table.record(row) for row in rows[start:start + batch_size]
+                         if self._table.id_of(row) is not None]
+            storage.migrate_batch(batch)
+        with self._lock, self._storage_lock:  # Изменения из очереди не пишутся в JSON во время завершения
+            storage.finish_migration(self._table, self._record)
+        self._schedule_snapshot()  # Отметка базы теперь от SQLite: снимок из JSON больше не подходит
+        return len(rows)
+
+    @staticmethod
+    def _ensure_ids_are_strings(movies, converted):
+        """Преобразует числовые ID записей в строковые по мере чтения; id измененных записей добавляются в converted."""
+        for movie in movies:
+            if 'id' in movie and not isinstance(movie['id'], str):
+                movie['id'] = str(movie['id'])
+                converted.append(movie['id'])
+            yield movie
+
+    def scan_movies(self, quiet=False, job=None, full=True):
+        """
+        Сканирует папки библиотеки (library_roots), добавляет новые, обновляет изменившиеся
+        и удаляет отсутствующие файлы из базы данных.
+        Неизмененные файлы (совпадают size, mtime и inode) не обрабатываются повторно;
+        если в дереве ничего не изменилось, база не перезаписывается.
+        quiet - не печатать сообщения, если изменений нет (для периодического опроса).
+        job - фоновая задача (Job) для отчета о ходе обработки и отмены. При отмене уже
+        обработанные файлы сохраняются в базе, остальные подхватит следующее сканирование.
+        full=False - быстрое сканирование: папки с прежним mtime не перечитываются, а известные
+        файлы в них не проверяются (см. LibraryWalker).
+        """
+        with self._scan_lock:
+            new_files = []  # (путь, stat) для новых файлов в порядке обхода
+            changed_files = []  # (путь, stat, старая запись) для изменившихся
+            patches = {}  # id -> поля, которые нужно обновить в существующей записи
+
+            if not quiet:
+                print("\n--- Запуск сканирования фильмов ---")
+            files, unreadable = self._walker.walk(library_roots(), use_cache=not full,
+                                                  check_cancelled=job.check_cancelled if job is not None else None)
+            metrics.increment('scan_files', len(files))
+            with self._lock:
+                # Сверка с базой - под блокировкой: строки таблицы могут переходить к другим записям
+                table = self._table
+                seen = set()  # Строки записей, файлы которых найдены при обходе
+                for file_path, st in files:
+                    row = table.row_by_path(file_path)
+                    if row is not None:
+                        seen.add(row)
+                    if st is None:
+                        if row is not None:
+                            continue  # Папка не изменилась с прошлого обхода
+                        try:
+                            st = os.stat(file_path)
+                        except OSError as e:
+                            print(f"Не удалось получить информацию о файле {file_path}: {e}")
+                            continue
+                    if row is None:
+                        new_files.append((file_path, st))
+                        continue
+                    existing_movie = table.view(row)
+                    if stat_matches(existing_movie, st):
+                        continue
+                    elif 'mtime' not in existing_movie or 'inode' not in existing_movie:
+                        # Запись из старой версии БД: просто запоминаем stat, не пересчитывая метаданные
+                        patches[existing_movie['id']] = {'size': st.st_size, 'mtime': st.st_mtime, 'inode': st.st_ino}
+                    else:
+                        changed_files.append((file_path, st, table.record(row)))
+
+                # Недоступная папка (отключенный сетевой диск) - не повод удалять ее фильмы из базы
+                prefixes = tuple(table.path_key(directory).rstrip(os.sep.encode()) + os.sep.encode()
+                                 for directory in unreadable)
+                existing_movies_by_path = {}  # ключ пути -> запись для файлов, не найденных при обходе
+                for row in table.rows():
+                    if row not in seen:
+                        key = table.path_key_of(row)
+                        if not (prefixes and key.startswith(prefixes)):
+                            existing_movies_by_path[key] = table.record(row)
+                total = len(table)
+
+            new_files, moved_count = self._detect_moves(new_files, existing_movies_by_path, patches)
+
+            if not (new_files or changed_files or patches or existing_movies_by_path):
+                # Быстрый путь: дерево не изменилось, ничего не пересохраняем
+                if not quiet:
+                    print(f"Сканирование завершено. Изменений нет ({total} фильмов).")
+                return total
+
+            if quiet:
+                print("\n--- Обнаружены изменения в папке с фильмами ---")
+
+            # Обработка новых и изменившихся файлов в пуле воркеров (без блокировки базы)
+            records = self._ingest_new_files(new_files + [(path, st) for path, st, _ in changed_files], job)
+            new_records = [r for r in records[:len(new_files)] if r is not None]  # Пропускаем файлы с ошибками
+            for (file_path, _, old_movie), record in zip(changed_files, records[len(new_files):]):
+                if record is not None:
+                    print(f"Файл изменился, метаданные обновлены: {os.path.basename(file_path)}")
+                    patches[old_movie['id']] = self._refreshed_fields(old_movie, record)
+            if job is not None and job.cancelled:
+                # Отсутствующие файлы удаляем только после полного прохода: частичный результат не должен ничего терять
+                existing_movies_by_path = {}
+
+            # Удаление отсутствующих фильмов
+            for movie_data_to_remove in existing_movies_by_path.values():
+                print(f"Удаление отсутствующего фильма: {movie_data_to_remove['title']}")
+
+            with self._lock:
+                # Патчи накладываются на актуальные записи: правки пользователя во время обработки не теряются
+                upserted = [dict(self._record(movie_id), **patch)
+                            for movie_id, patch in patches.items() if movie_id in self._table]
+                self._apply_changes(upserted=upserted + new_records,
+                                    deleted_ids=[m['id'] for m in existing_movies_by_path.values()])
+                total = len(self._table)
+            print(f"Сканирование завершено. Обнаружено {total} фильмов. "
+                  f"Новых {len(new_records)}, изменено {len(changed_files)}, "
+                  f"перемещено {moved_count}, удалено {len(existing_movies_by_path)}.")
+            if job is not None:
+                job.check_cancelled()
+            return total
+
+    def refresh_paths(self, paths):
+        """
+        Применяет изменения только по указанным путям (файлам или папкам), без полного обхода.
+        Используется наблюдателем за папкой: существующие файлы добавляются/обновляются,
+        пропавшие удаляются из базы. Возвращает количество изменившихся записей.
+        """
+        with self._scan_lock:
+            to_ingest = []
+            missing = {}  # ключ пути -> запись для пропавших файлов
+
+            with self._lock:
+                for path in paths:
+                    if os.path.isdir(path):
+                        to_ingest.extend(self._walk_movie_files(path))
+                    elif os.path.exists(path):
+                        if path.lower().endswith(SUPPORTED_FORMATS):
+                            to_ingest.append(path)
+                    else:
+                        # Файл или целая папка исчезли: убираем все записи по этому пути
+                        key = self._table.path_key(path)
+                        row = self._table.row_by_path(path)
+                        if row is not None:
+                            missing[key] = self._table.record(row)
+                            continue
+                        prefix = key.rstrip(os.sep.encode()) + os.sep.encode()
+                        for row in self._table.rows():
+                            row_key = self._table.path_key_of(row)
+                            if row_key.startswith(prefix):
+                                missing[row_key] = self._table.record(row)
+
+                new_files = []
+                changed_files = []
+                for file_path in dict.fromkeys(to_ingest):  # Убираем повторы, сохраняя порядок
+                    try:
+                        st = os.stat(file_path)
+                    except OSError:
+                        continue
+                    row = self._table.row_by_path(file_path)
+                    if row is None:
+                        new_files.append((file_path, st))
+                        # Событие об исчезновении старого пути могло прийти в другой пачке
+                        for moved_row in self._table.find('inode', st.st_ino):
+                            moved_from = self._table.record(moved_row)
+                            if moved_from.get('size') == st.st_size and not os.path.exists(moved_from['path']):
+                                missing[self._table.path_key(moved_from['path'])] = moved_from
+                    elif not stat_matches(self._table.view(row), st):
+                        changed_files.append((file_path, st, self._table.record(row)))
+
+            # Переименование внутри библиотеки приходит как пара "удален + создан": узнаем его по inode и размеру
+            patches = {}
+            new_files, moved_count = self._detect_moves(new_files, missing, patches)
+            if not (new_files or changed_files or patches or missing):
+                return 0
+
+            records = self._ingest_new_files(new_files + [(path, st) for path, st, _ in changed_files])
+            new_records = [r for r in records[:len(new_files)] if r is not None]
+            for (_, _, old_movie), record in zip(changed_files, records[len(new_files):]):
+                if record is not None:
+                    patches[old_movie['id']] = self._refreshed_fields(old_movie, record)
+
+            for movie in missing.values():
+                print(f"Удаление отсутствующего фильма: {movie['title']}")
+
+            with self._lock:
+                upserted = [dict(self._record(movie_id), **patch)
+                            for movie_id, patch in patches.items() if movie_id in self._table]
+                self._apply_changes(upserted=upserted + new_records, deleted_ids=[m['id'] for m in missing.values()])
+            print(f"Применены изменения в папке с фильмами: новых {len(new_records)}, "
+                  f"изменено {len(upserted) - moved_count}, перемещено {moved_count}, удалено {len(missing)}.")
+            return len(upserted) + len(new_records) + len(missing)
+
+    @staticmethod
+    def _detect_moves(new_files, missing_by_path, patches):
+        """
+        Новый путь с тем же inode и размером, что у пропавшей записи - это переименование/перемещение:
+        запись (и правки пользователя) сохраняется вместо удаления и повторной обработки.
+        Найденные пары убираются из missing_by_path, обновление пути добавляется в patches.
+        Возвращает (оставшиеся новые файлы, количество перемещений).
+        """
+        missing_by_inode = {(m.get('inode'), m.get('size')): key
+                            for key, m in missing_by_path.items() if m.get('inode') is not None}
+        if not missing_by_inode:
+            return new_files, 0
+        still_new = []
+        for file_path, st in new_files:
+            old_key = missing_by_inode.pop((st.st_ino, st.st_size), None)
+            if old_key is None:
+                still_new.append((file_path, st))
+                continue
+            old_movie = missing_by_path.pop(old_key)
+            print(f"Фильм перемещен: {old_movie['path']} -> {file_path}")
+            patches[old_movie['id']] = {'path': os.path.normpath(file_path), 'mtime': st.st_mtime}
+        return still_new, len(new_files) - len(still_new)
+
+    @staticmethod
+    def _walk_movie_files(top):
+        """Обходит папку в детерминированном порядке и возвращает пути поддерживаемых видеофайлов (без кэша папок)."""
+        files, _ = LibraryWalker().walk([top], use_cache=False)
+        return [path for path, _ in files]
+
+    @staticmethod
+    def _refreshed_fields(old_movie, new_movie):
+        """
+        Поля, которые берутся из заново обработанного файла (длительность, разрешение, stat, превью);
+        правки пользователя остаются из старой записи. Старое превью удаляется в _apply_changes.
+        """
+        return {key: new_movie.get(key)
+                for key in ('path', 'duration', 'resolution', 'video_codec', 'audio_tracks',
+                            'size', 'mtime', 'inode', 'fingerprint', 'phash', 'thumbnail')}
+
+    def _ingest_new_files(self, files, job=None):
+        """
+        Обрабатывает новые файлы (метаданные + превью) в пуле из self.scan_workers потоков.
+        files - список пар (путь, stat). Возвращает список записей в том же порядке.
+        job - задача для отчета о ходе; после ее отмены еще не начатые файлы пропускаются (None).
+        """
+        if not files:
+            return []
+        workers = max(1, min(self.scan_workers, len(files)))
+        print(f"Обработка {len(files)} новых файлов ({workers} воркеров)...")
+        metrics.increment('files_processed', len(files))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest') as executor:
+            futures = [executor.submit(self._safe_build_movie_record, item) for item in files]
+            tqdm = _load_tqdm()
+            progress = tqdm(futures, total=len(files), desc="Обработка новых фильмов") if tqdm else futures
+            records = []
+            cancelled = False
+            for future in progress:
+                if not cancelled and job is not None and job.cancelled:
+                    # Отменяются сразу все еще не начатые файлы: к моменту, когда цикл дойдет до следующего,
+                    # воркер уже успел бы его взять. Запущенные дорабатываются, чтобы не оставить лишних превью
+                    cancelled = True
+                    for pending in futures[len(records):]:
+                        pending.cancel()
+                records.append(None if future.cancelled() else future.result())
+                if job is not None and not job.cancelled:
+                    job.report(len(records), len(files))
+            return records
+
+    @staticmethod
+    def _safe_build_movie_record(file_and_stat):
+        """Обертка для воркера: ошибка одного файла не должна прерывать весь пакет."""
+        file_path, st = file_and_stat
+        try:
+            return build_movie_record(file_path, st)
+        except Exception as e:
+            print(f"Ошибка обработки файла {file_path}: {e}")
+            metrics.increment('file_errors')
+            return None
+
+    def missing_thumbnail_ids(self, movie_ids=None):
+        """id записей без превью или с пропавшим файлом превью (из movie_ids или из всей библиотеки)."""
+        with self._lock:
+            table = self._table
+            rows = table.rows() if movie_ids is None else filter(None.__ne__, map(table.row, movie_ids))
+            movies = [(table.id_of(row), table.get(row, 'thumbnail')) for row in rows]
+            failed = set(self._thumbnail_failed)
+        return [movie_id for movie_id, thumbnail in movies
+                if movie_id not in failed and not (
+                    thumbnail and os.path.exists(os.path.join(THUMBNAILS_DIR, thumbnail_file(thumbnail))))]
+
+    def generate_missing_thumbnails(self, movie_ids=None, job=None, fast=False):
+        """
+        Создает недостающие превью для movie_ids (или для всей библиотеки). Записи, превью которых
+        уже создается другой задачей, пропускаются. fast - быстрое уменьшение и кодирование
+        (см. encode_thumbnail) для фонового создания превью всей библиотеки. Возвращает количество созданных превью.
+        """
+        pending = self.missing_thumbnail_ids(movie_ids)
+        created = 0
+        for done, movie_id in enumerate(pending, 1):
+            if job is not None:
+                job.check_cancelled()
+            with self._lock:
+                movie = self._record(movie_id)
+                if movie is None or movie_id in self._thumbnails_in_progress or not self.missing_thumbnail_ids([movie_id]):
+                    continue
+                self._thumbnails_in_progress.add(movie_id)
+            try:
+                frame = probe_media(movie['path'])['frame']
+                key = None
+                if frame is None:
+                    print(f"Не удалось захватить кадр для миниатюры из: {movie['path']}")
+                else:
+                    try:
+                        key, files = encode_thumbnail(frame, fast)
+                    except Exception as e:
+                        print(f"Ошибка создания превью для {movie['path']}: {e}")
+                if key is None:
+                    with self._lock:
+                        self._thumbnail_failed.add(movie_id)
+                    continue
+                with self._lock:
+                    current = self._record(movie_id)
+                    if current is None or current.get('thumbnail') != movie.get('thumbnail'):
+                        continue  # Пока кадр создавался, запись удалили или пользователь сменил превью
+                    # Файлы пишутся под блокировкой: то же превью у другой записи не может быть удалено между
+                    # записью файлов и появлением ссылки на них
+                    store_thumbnail_files(files)
+                    self._apply_changes(upserted=[dict(current, thumbnail=key, phash=perceptual_hash(frame))])
+                created += 1
+                metrics.increment('thumbnails_created')
+            finally:
+                with self._lock:
+                    self._thumbnails_in_progress.discard(movie_id)
+                if job is not None:
+                    job.report(done, len(pending))
+        if created:
+            print(f"Создано недостающих превью: {created}")
+        return created
+
+    def collect_thumbnail_garbage(self, grace=THUMBNAIL_GC_GRACE, job=None):
+        """
+        Удаляет из THUMBNAILS_DIR файлы превью, на которые не ссылается ни одна запись: остатки после сбоя
+        между созданием превью и сохранением записи, после сброса или замены базы. Файлы моложе grace секунд
+        не трогаются (их запись может быть еще в обработке). Пустая библиотека не чистится: это скорее
+        потерянная база, чем отсутствие превью. Возвращает {'success', 'removed', 'bytes'}.
+        """
+        with self._lock:
+            if not len(self._table):
+                return {'success': True, 'removed': 0, 'bytes': 0}
+        deadline = time.time() - grace
+        candidates = []
+        with os.scandir(THUMBNAILS_DIR) as entries:  # Только файлы верхнего уровня: sprites - отдельный кэш
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if st.st_mtime < deadline:
+                    candidates.append((entry.name, st.st_size))
+        with self._lock:
+            referenced = self._table.distinct('thumbnail')  # Все превью библиотеки - одним проходом по колонке
+        # Файлы ключа, которым пользуется запись, остаются в любом формате (их отдает /thumb), кроме имен,
+        # которых у ключа быть не может (например, размер, убранный из THUMBNAIL_VARIANTS)
+        candidates = [(name, size) for name, size in candidates if _thumbnail_owner(name) not in referenced
+                      or name not in thumbnail_files(_thumbnail_owner(name))]
+        removed = removed_bytes = 0
+        for done, (name, size) in enumerate(candidates, 1):
+            if job is not None:
+                job.check_cancelled()
+            # Под блокировкой: ссылка могла появиться после обхода папки, а новые файлы пишутся под ней же
+            with self._lock:
+                owner = _thumbnail_owner(name)
+                if name not in thumbnail_files(owner) or not self._table.find('thumbnail', owner):
+                    try:
+                        os.remove(os.path.join(THUMBNAILS_DIR, name))
+                        removed += 1
+                        removed_bytes += size
+                    except OSError as e:
+                        print(f"Ошибка при удалении превью {name}: {e}")
+            if job is not None:
+                job.report(done, len(candidates))
+        if removed:
+            print(f"Удалено неиспользуемых файлов превью: {removed} ({removed_bytes / 1024 ** 2:.1f} МБ)")
+        return {'success': True, 'removed': removed, 'bytes': removed_bytes}
+
+    def find_by_fingerprint(self, fingerprint):
+        """Записи с таким же отпечатком содержимого (файлы которых существуют)."""
+        with self._lock:
+            movies = [self._table.record(row) for row in self._table.find('fingerprint', fingerprint)]
+        return [movie for movie in movies if os.path.exists(movie['path'])]
+
+    def generate_missing_fingerprints(self, job=None, batch_size=200):
+        """
+        Досчитывает отпечаток и phash для записей, созданных до их появления (phash - по сохраненному превью).
+        Изменения сохраняются пачками по batch_size записей. Возвращает количество обновленных записей.
+        """
+        with self._lock:
+            table = self._table
+            pending = [table.record(row) for row in table.rows()
+                       if not table.get(row, 'fingerprint') or table.get(row, 'phash', _MISSING) is _MISSING]
+        patches = {}
+        updated = 0
+        for done, movie in enumerate(pending, 1):
+            if job is not None:
+                job.check_cancelled()
+            patch = {}
+            if not movie.get('fingerprint'):
+                try:
+                    patch['fingerprint'] = compute_fingerprint(movie['path'])
+                except OSError:
+                    pass  # Файл пропал - запись уберет сканирование
+            if 'phash' not in movie:
+                patch['phash'] = thumbnail_perceptual_hash(movie.get('thumbnail'))
+            if patch:
+                patches[movie['id']] = patch
+            if patches and (len(patches) >= batch_size or done == len(pending)):
+                with self._lock:
+                    upserted = [dict(self._record(movie_id), **patch)
+                                for movie_id, patch in patches.items() if movie_id in self._table]
+                    self._apply_changes(upserted=upserted)
+                updated += len(upserted)
+                patches = {}
+            if job is not None:
+                job.report(done, len(pending))
+        return updated
+
+    def find_duplicates(self, job=None):
+        """
+        Отчет о дубликатах: группы 'exact' (одинаковый отпечаток содержимого) и 'similar'
+        (близкий phash кадра превью и почти одинаковая длительность - например, перекодированная копия;
+        точные копии тогда входят в ту же группу).
+        Для поиска похожих phash делится на PHASH_MAX_DISTANCE + 1 частей: у хешей на расстоянии
+        не больше PHASH_MAX_DISTANCE хотя бы одна часть совпадает, поэтому сравниваются только
+        записи с общей частью, а не все пары.
+        """
+        self.generate_missing_fingerprints(job)
+        with self._lock:
+            table = self._table
+            # Для поиска похожих копий нужны только phash и длительность
+            movies = [{'id': table.id_of(row), 'phash': table.get(row, 'phash'), 'duration': table.get(row, 'duration')}
+                      for row in table.rows()]
+            exact_groups = [sorted(map(table.id_of, rows)) for rows in table.duplicates('fingerprint')]
+
+        # Непересекающиеся множества: точные и похожие копии объединяются в группы транзитивно
+        parent = {}
+
+        def find(movie_id):
+            while parent.setdefault(movie_id, movie_id) != movie_id:
+                parent[movie_id] = parent[parent[movie_id]]
+                movie_id = parent[movie_id]
+            return movie_id
+
+        for group in exact_groups:
+            for movie_id in group[1:]:
+                parent[find(movie_id)] = find(group[0])
+
+        bands = PHASH_MAX_DISTANCE + 1
+        buckets = {}
+        by_id = {}
+        for movie in movies:
+            phash = movie.get('phash')
+            if not phash or len(set(phash)) == 1:
+                continue  # Однотонный кадр (черный экран) совпадает со всеми
+            by_id[movie['id']] = movie
+            bits = int(phash, 16)
+            total_bits = len(phash) * 4
+            for band in range(bands):
+                start, end = total_bits * band // bands, total_bits * (band + 1) // bands
+                buckets.setdefault((band, (bits >> start) & ((1 << (end - start)) - 1)), []).append(movie['id'])
+
+        for bucket in buckets.values():
+            for i, id_a in enumerate(bucket):
+                movie_a = by_id[id_a]
+                for id_b in bucket[i + 1:]:
+                    movie_b = by_id[id_b]
+                    if find(id_a) == find(id_b):
+                        continue
+                    duration_a, duration_b = _as_number(movie_a.get('duration')), _as_number(movie_b.get('duration'))
+                    if abs(duration_a - duration_b) > max(2, DUPLICATE_DURATION_TOLERANCE * max(duration_a, duration_b)):
+                        continue
+                    if hamming_distance(movie_a['phash'], movie_b['phash']) <= PHASH_MAX_DISTANCE:
+                        parent[find(id_a)] = find(id_b)
+
+        components = {}
+        for movie_id in parent:
+            components.setdefault(find(movie_id), []).append(movie_id)
+
+        def summary(row):
+            return {key: table.get(row, key) for key in
+                    ('id', 'title', 'path', 'size', 'duration', 'resolution', 'thumbnail')}
+
+        groups = []
+        with self._lock:
+            table = self._table
+            for ids in components.values():
+                rows = [row for row in map(table.row, ids) if row is not None]  # Записи могли удалить
+                if len(rows) > 1:
+                    exact = len({table.get(row, 'fingerprint') for row in rows}) == 1
+                    groups.append({'kind': 'exact' if exact else 'similar', 'movies': [summary(row) for row in rows]})
+        # Место, которое освободится, если оставить по одной (самой большой) копии из каждой группы
+        wasted = sum(sum(_as_number(m['size']) for m in g['movies']) - max(_as_number(m['size']) for m in g['movies'])
+                     for g in groups)
+        return {'success': True, 'groups': groups, 'wasted_bytes': wasted}
+
+    def get_movies(self):
+        return self.movies
+
+    def get_movie_count(self):
+        return len(self._table)
+
+    def get_movie_details(self, movie_id):
+        with self._lock:
+            return self._record(movie_id)
+
+    def get_movie_by_path(self, path):
+        with self._lock:
+            row = self._table.row_by_path(path)
+            return None if row is None else self._table.record(row)
+
+    @metrics.timed()
+    def search_movies(self, query, limit=None):
+        """Поиск по инвертированному индексу; результаты отсортированы по релевантности."""
+        with self._lock:
+            return [self._table.record(row) for row in self._search().search(query, limit)]
+
+    def get_movies_page(self, offset=0, limit=50, sort_key=DEFAULT_SORT_KEY, filters=None):
+        """
+        Страница списка фильмов для интерфейса.
+        sort_key - поле из SORT_KEY_FUNCS (минус в начале - по убыванию) или 'relevance' при поиске.
+        filters - словарь с необязательными ключами: query (поисковый запрос), genre,
+        year_from, year_to, min_rating.
+        Возвращает {'total': количество подходящих записей, 'offset': offset, 'movies': [...]}.
+        """
+        offset = max(int(offset or 0), 0)
+        limit = min(max(int(limit or 0), 0), MAX_PAGE_SIZE)
+        sort_key = sort_key or DEFAULT_SORT_KEY
+        descending = sort_key.startswith('-')
+        sort_name = sort_key.lstrip('-')
+        filters = filters or {}
+        query = str(filters.get('query') or '').strip()
+        if sort_name not in SORT_KEY_FUNCS and not (sort_name == 'relevance' and query):
+            sort_name, descending = DEFAULT_SORT_KEY.lstrip('-'), DEFAULT_SORT_KEY.startswith('-')
+
+        with self._lock:
+            ranked = self._search().search(query) if query else None
+            candidates = self._filter_candidates(filters, ranked)
+            if sort_name == 'relevance':
+                ordered = [row for row in ranked if candidates is None or row in candidates]
+                total = len(ordered)
+                page_rows = ordered[offset:offset + limit]
+            elif candidates is None:
+                total = len(self._table)
+                page_rows = self._sorted_index(sort_name).page(offset, limit, descending)
+            else:
+                total = len(candidates)
+                page_rows = self._sorted_page(self._sorted_index(sort_name), candidates, offset, limit, descending)
+            return {'total': total, 'offset': offset, 'version': self.version, 'epoch': self.epoch,
+                    'movies': [self._table.record(row) for row in page_rows]}
+
+    def _filter_candidates(self, filters, ranked=None):
+        """Множество строк записей, подходящих под фильтры, или None, если фильтров нет (подходят все)."""
+        candidate_sets = []
+        if ranked is not None:
+            candidate_sets.append(set(ranked))
+        if filters.get('genre'):
+            genre = str(filters['genre']).casefold()
+            candidate_sets.append(self._table.rows_matching('genre', lambda value: str(value).casefold() == genre, ''))
+        year_from, year_to = filters.get('year_from'), filters.get('year_to')
+        if year_from not in (None, '') or year_to not in (None, ''):
+            candidate_sets.append(self._sorted_index('year').rows_in_range(
+                _as_number(year_from) if year_from not in (None, '') else None,
+                _as_number(year_to) if year_to not in (None, '') else None))
+        if filters.get('min_rating') not in (None, ''):
+            candidate_sets.append(self._sorted_index('rating').rows_in_range(_as_number(filters['min_rating'])))
+        if not candidate_sets:
+            return None
+        candidate_sets.sort(key=len)  # Пересекаем начиная с самого маленького множества
+        result = set(candidate_sets[0])
+        for rows in candidate_sets[1:]:
+            result &= rows
+        return result
+
+    @staticmethod
+    def _sorted_page(index, candidates, offset, limit, descending):
+        """Страница отфильтрованных записей (строк) в порядке сортированного индекса."""
+        if len(candidates) * 8 < len(index):
+            # Подходящих записей мало - дешевле отсортировать только их
+            ordered = sorted(candidates, key=index.sort_key, reverse=descending)
+            return ordered[offset:offset + limit]
+        page_rows = []
+        skipped = 0
+        for row in index.iter_rows(descending):
+            if row not in candidates:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            page_rows.append(row)
+            if len(page_rows) >= limit:
+                break
+        return page_rows
+
+    def update_movie_info(self, movie_id, title, genre, year, rating, description):
+        with self._lock:
+            movie = self._record(movie_id)
+            if movie is None:
+                return {'success': False, 'error': 'Фильм не найден.'}
+            self._apply_changes(upserted=[dict(movie, title=title, genre=genre, year=int(year), rating=float(rating),
+                                               description=description)])
+        return {'success': True}
+
+    def delete_movie(self, movie_id):
+        """Удаляет фильм из базы данных, файл с диска и превью."""
+        with self._lock:
+            movie_to_delete = self._record(movie_id)
+            if movie_to_delete is None:
+                return {'success': False, 'error': 'Фильм не найден.'}
+            self._apply_changes(deleted_ids=[movie_id])
+
+        # Удаление файла фильма
+        try:
+            if os.path.exists(movie_to_delete['path']):
+                os.remove(movie_to_delete['path'])
+                print(f"Удален файл: {movie_to_delete['path']}")
+        except Exception as e:
+            print(f"Ошибка удаления файла: {e}")
+        return {'success': True}
+
+    def get_movies_stats(self):
+        """
+        Итоги библиотеки из накопительных счетчиков (LibraryStats): total_movies, total_size,
+        total_duration, avg_rating и groups - те же итоги по жанру, году, разрешению и размеру.
+        """
+        with self._lock:
+            return self._stats.to_dict()
+
+    def add_movie_from_path(self, file_path):
+        """Добавляет один видеофайл в библиотеку (см. import_movies)."""
+        result = self.import_movies([file_path])
+        if not result['success']:
+            return result
+        if result['movies']:
+            return {'success': True, 'movie': result['movies'][0]}
+        return {'success': False, 'error': 'Не удалось добавить в БД.'}
+
+    def import_movies(self, sources, mode=IMPORT_MODE, job=None, skip_duplicates=True):
+        """
+        Добавляет в библиотеку файлы и папки (папки - со всей структурой, под своим именем).
+        Файлы помещаются в MOVIES_DIR через import_file и сразу обрабатываются через refresh_paths,
+        без полного пересканирования. Ход копирования (в байтах) и отмена - через job.
+        skip_duplicates - файлы, отпечаток которых уже есть в библиотеке, не копируются и не обрабатываются.
+        Возвращает {'success', 'imported', 'movies', 'skipped', 'duplicates', 'errors'}.
+        """
+        plan = []  # (исходный файл, путь назначения без уникального суффикса)
+        skipped = []
+        errors = []
+        library_root = normalize_movie_path(MOVIES_DIR).rstrip(os.sep) + os.sep
+        for source in sources:
+            source = os.path.normpath(source)
+            if os.path.isdir(source):
+                base = os.path.dirname(source)
+                plan.extend((path, os.path.join(MOVIES_DIR, os.path.relpath(path, base)))
+                            for path in self._walk_movie_files(source))
+            elif not os.path.exists(source):
+                errors.append(f"{source}: файл не существует.")
+            elif not source.lower().endswith(SUPPORTED_FORMATS):
+                errors.append(f"{source}: неподдерживаемый формат.")
+            else:
+                plan.append((source, os.path.join(MOVIES_DIR, os.path.basename(source))))
+
+        to_refresh = []  # пути в библиотеке, которые нужно обработать
+        to_copy = []
+        duplicates = []  # (исходный файл, запись с тем же содержимым)
+        for source, destination in plan:
+            if self.get_movie_by_path(source) is not None:
+                skipped.append(source)  # Фильм уже существует
+            elif normalize_movie_path(source).startswith(library_root):
+                to_refresh.append(source)  # Уже лежит в папке с фильмами - копировать не нужно
+            else:
+                # Файл мог пропасть после составления списка (например, извлекли флешку)
+                try:
+                    size = os.path.getsize(source)
+                    # Три коротких чтения вместо копирования и анализа всего файла
+                    existing = self.find_by_fingerprint(compute_fingerprint(source, size)) if skip_duplicates else None
+                except OSError as e:
+                    errors.append(f"{source}: ошибка чтения: {e}")
+                    continue
+                if existing:
+                    print(f"Файл уже есть в библиотеке ({existing[0]['title']}), пропуск: {source}")
+                    duplicates.append({'source': source, 'movie_id': existing[0]['id'], 'title': existing[0]['title']})
+                    continue
+                to_copy.append((source, destination, size))
+
+        total_bytes = sum(size for _, _, size in to_copy)
+        copied_before = 0  # Байт в уже скопированных файлах пакета
+        cancelled = False
+        for source, destination, size in to_copy:
+            def progress(copied, _total):
+                if job is not None:
+                    job.check_cancelled()
+                    job.report(copied_before + copied, total_bytes)
+
+            destination = self._unique_destination(destination)
+            # Копируем под временным именем: наблюдатель и сканирование не увидят недописанный файл
+            partial = f"{destination}.{uuid.uuid4().hex[:8]}.part"
+            try:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                method = import_file(source, partial, mode, progress)
+                os.replace(partial, destination)
+                print(f"Добавлен файл ({method}): {source} -> {destination}")
+                to_refresh.append(destination)
+            except JobCancelled:
+                cancelled = True
+                break
+            except Exception as e:
+                errors.append(f"{source}: ошибка копирования: {e}")
+            finally:
+                if os.path.lexists(partial):
+                    os.remove(partial)
+            copied_before += size
+
+        # Уже скопированные файлы обрабатываются и при отмене, чтобы не оставлять их вне базы
+        if to_refresh:
+            self.refresh_paths(to_refresh)
+        movies = [movie for movie in map(self.get_movie_by_path, to_refresh) if movie is not None]
+        if cancelled:
+            raise JobCancelled()
+        if not movies and not skipped and not duplicates:
+            return {'success': False, 'error': '; '.join(errors) or 'Не удалось добавить в БД.'}
+        if not movies and not errors and len(duplicates) == 1 and not skipped:
+            return {'success': False, 'error': f"Такой фильм уже есть в коллекции: {duplicates[0]['title']}."}
+        if not movies and skipped and not errors and not duplicates:
+            return {'success': False, 'error': 'Фильм уже существует.'}
+        return {'success': True, 'imported': len(movies), 'movies': movies, 'skipped': skipped,
+                'duplicates': duplicates, 'errors': errors}
+
+    @staticmethod
+    def _unique_destination(destination_path):
+        """Добавляет к имени файла _1, _2, ..., если путь в библиотеке уже занят."""
+        base_name, extension = os.path.splitext(destination_path)
+        counter = 1
+        while os.path.lexists(destination_path):
+            destination_path = f"{base_name}_{counter}{extension}"
+            counter += 1
+        return destination_path
+
+    def update_movie_thumbnail(self, movie_id):
+        """Обновляет превью фильма, открывая диалог выбора изображения."""
+        try:
+            import tkinter as tk
+            from tkinter import filedialog
+
+            root = tk.Tk()
+            root.withdraw()
+            root.attributes('-topmost', True)
+
+            thumbnail_path = filedialog.askopenfilename(
+                title="Выберите изображение для превью",
+                filetypes=[("Изображения", "*.jpg *.jpeg *.png *.gif *.webp"), ("Все файлы", "*.*")]
+            )
+            root.destroy()
+
+            if not thumbnail_path:
+                return {'success': False, 'error': 'Выбор отменен.'}
+
+            movie = self.get_movie_details(movie_id)
+            if not movie:
+                return {'success': False, 'error': 'Фильм не найден.'}
+
+            # Любое изображение (GIF, PNG, фото с поворотом в EXIF) превращается в обычный набор размеров превью.
+            # Старое превью удалит _apply_changes, если на него больше не ссылается ни одна запись.
+            # phash считается по новому изображению: иначе поиск похожих сравнивал бы уже замененный кадр
+            from PIL import ImageOps
+            with Image.open(thumbnail_path) as img:
+                img.draft('RGB', max(THUMBNAIL_VARIANTS.values()))  # JPEG декодируется сразу в уменьшенном виде
+                frame = ImageOps.exif_transpose(img)
+                key, files = encode_thumbnail(frame)
+                phash = perceptual_hash(frame)
+
+            with self._lock:
+                movie = self._record(movie_id) or movie
+                store_thumbnail_files(files)
+                self._apply_changes(upserted=[dict(movie, thumbnail=key, phash=phash)])
+            print(f"Превью обновлено для фильма {movie['title']}: {key}")
+            return {'success': True, 'thumbnail': key}
+        except ImportError:
+            return {'success': False, 'error': 'Tkinter не установлен.'}
+        except Exception as e:
+            return {'success': False, 'error': f'Ошибка обновления превью: {e}'}
+
+
+class LruFileCache(abc.ABC):
+    """
+    LRU-кэш производных файлов фильмов на диске с ограничением по суммарному размеру. Порядок
+    использования хранится в памяти и на диске (mtime файла обновляется при каждом обращении),
+    поэтому переживает перезапуск. Имя файла начинается с id фильма и включает stat видео:
+    изменившийся файл получает новую запись, а старая удаляется. Подклассы задают entry_name.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._entries = collections.OrderedDict()  # имя файла -> размер, от давно использованных к недавним
+        self._total = 0
+        self._load()
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith('.tmp'):
+                    os.remove(entry.path)  # Недописанный файл после сбоя
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._total += size
+        self._evict()
+
+    @abc.abstractmethod
+    def entry_name(self, movie):
+        """Имя файла кэша для записи movie: начинается с '<id>_' и меняется вместе с файлом видео."""
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def lookup(self, movie):
+        """Имя готового файла (и отметка об использовании) или None."""
+        name = self.entry_name(movie)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        try:
+            os.utime(self.path(name))
+        except OSError:
+            pass
+        return name
+
+    def _store(self, movie, create):
+        """
+        Создает файл через create(tmp_path) -> bool, атомарно переносит его в кэш
+        и возвращает имя (или None при ошибке).
+        """
+        name = self.entry_name(movie)
+        path = self.path(name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if not create(tmp_path):
+                return None
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self.discard(movie['id'], keep=name)
+            self._total += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict()
+        return name
+
+    def discard(self, movie_id, keep=None):
+        """Удаляет файлы фильма (кроме keep)."""
+        with self._lock:
+            for name in [n for n in self._entries if n.startswith(f"{movie_id}_") and n != keep]:
+                self._remove(name)
+
+    def _evict(self):
+        # Самый свежий файл оставляем, даже если он один больше бюджета
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, name):
+        self._total -= self._entries.pop(name)
+        try:
+            os.remove(self.path(name))
+        except OSError as e:
+            print(f"Ошибка удаления {name} из кэша: {e}")
+
+
+class SpriteCache(LruFileCache):
+    """Кэш раскадровок для просмотра фильма при наведении."""
+
+    def __init__(self, directory, max_bytes=SPRITE_CACHE_BYTES, frames=SPRITE_FRAMES, frame_width=SPRITE_FRAME_WIDTH):
+        self.frames = frames
+        self.frame_width = frame_width
+        super().__init__(directory, max_bytes)
+
+    def entry_name(self, movie):
+        return (f"{movie['id']}_{int(movie.get('mtime') or 0)}_{movie.get('size') or 0}"
+                f"_{self.frames}x{self.frame_width}.jpg")
+
+    def url(self, name):
+        return f"thumbnails/sprites/{name}"
+
+    def build(self, movie):
+        """Создает раскадровку фильма, добавляет ее в кэш и возвращает имя (или None при ошибке)."""
+        return self._store(movie, lambda tmp_path: generate_sprite_sheet(
+            movie['path'], tmp_path, movie.get('duration') or 0, self.frames, self.frame_width))
+
+
+class PlaybackCache(LruFileCache):
+    """
+    Кэш фильмов, подготовленных к воспроизведению в браузере (фрагментированный MP4).
+    Одновременно работает не больше workers процессов ffmpeg, остальные ждут очереди.
+    """
+
+    def __init__(self, directory, max_bytes=PLAYBACK_CACHE_BYTES, workers=PLAYBACK_WORKERS):
+        self._slots = threading.BoundedSemaphore(max(1, workers))
+        super().__init__(directory, max_bytes)
+
+    def entry_name(self, movie):
+        return f"{movie['id']}_{int(movie.get('mtime') or 0)}_{movie.get('size') or 0}.mp4"
+
+    def url(self, movie_id):
+        return f"/stream/{movie_id}/playback.mp4"
+
+    def prepare(self, movie, job=None):
+        """
+        Перепаковывает или перекодирует фильм согласно playback_plan и возвращает имя файла в кэше
+        (или None, если подготовка не нужна или не удалась). Если копирование потоков не удалось
+        (например, битые временные метки), фильм перекодируется полностью.
+        """
+        plan = playback_plan(movie)
+        if plan['mode'] == 'direct':
+            return None
+        duration = movie.get('duration') or 0
+        progress = None
+        if job is not None:
+            def progress(fraction):
+                job.check_cancelled()
+                job.report(int(fraction * 1000), 1000)
+
+        # Ждем свободный слот, не переставая реагировать на отмену задачи
+        while not self._slots.acquire(timeout=0.5):
+            if job is not None:
+                job.check_cancelled()
+        try:
+            name = self.lookup(movie)  # Могли подготовить, пока мы ждали слот
+            if name is None:
+                name = self._store(movie, lambda tmp_path: convert_for_browser(
+                    movie['path'], tmp_path, plan['copy_video'], plan['copy_audio'], duration, progress))
+            if name is None and (plan['copy_video'] or plan['copy_audio']):
+                print(f"Копирование потоков не удалось, перекодирование: {movie['path']}")
+                name = self._store(movie, lambda tmp_path: convert_for_browser(
+                    movie['path'], tmp_path, False, False, duration, progress))
+            return name
+        finally:
+            self._slots.release()
+
+
+class LibraryWatcher:
+    """
+    Фоновый наблюдатель за папками библиотеки. Через watchdog получает события файловой системы
+    и применяет их точечно (MovieManager.refresh_paths); без watchdog периодически запускает
+    быстрое инкрементальное сканирование, которое при отсутствии изменений почти ничего не стоит.
+    """
 
-try:
-    from tqdm import tqdm  # Для отображения прогресса в консоли при сканировании
-except ImportError:
-    tqdm = None  # Если tqdm не установлен, используем простой цикл
-import uuid  # Для генерации уникальных ID фильмов
-import re  # Для парсинга года из названия фильма
-import time  # Для отметки времени добавления фильма
-import urllib.parse  # Для кодирования URL-путей
-import webbrowser  # Для fallback-открытия в системном браузере
+    def __init__(self, manager, roots, mode=WATCH_MODE, poll_interval=WATCH_POLL_INTERVAL, debounce=WATCH_DEBOUNCE,
+                 initial_delay=0, on_changed=None):
+        self.manager = manager
+        # Вызывается после прохода, изменившего базу (в потоке наблюдателя, без блокировки базы)
+        self.on_changed = on_changed
+        self.roots = [roots] if isinstance(roots, str) else list(roots)
+        self.mode = mode
+        self.initial_delay = initial_delay  # Секунды до первой сверки с диском (события за это время копятся)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.active_mode = None  # 'watchdog' или 'poll' после запуска
+        self._observer = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._pending = {}  # путь -> время последнего события
+        self._pending_lock = threading.Lock()
 
-# --- Конфигурация папок ---
-# Получаем директорию, где запущен скрипт
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
 
-# Пути к папкам для фильмов, превью и базы данных
-# ВНИМАНИЕ: Для старых версий Eel, папки MOVIES_DIR и THUMBNAILS_DIR
-# должны находиться ВНУТРИ папки 'web', чтобы Eel мог их обслуживать.
-# Например, web/movies и web/thumbnails
-web_dir = os.path.join(SCRIPT_DIR, 'web')
-MOVIES_DIR = os.path.join(web_dir, 'movies')  # ИЗМЕНЕНО: теперь movies находится внутри web
-THUMBNAILS_DIR = os.path.join(web_dir, 'thumbnails')  # ИЗМЕНЕНО: теперь thumbnails находится внутри web
-DB_FILE = os.path.join(SCRIPT_DIR, 'movies_db.json')  # DB_FILE может оставаться рядом с main.py
+    def start(self):
+        if self.mode == 'off' or self.is_running:
+            return False
+        if self.mode in ('auto', 'watchdog') and Observer is not None:
+            try:
+                self._observer = Observer()
+                for root in self.roots:
+                    self._observer.schedule(self, root, recursive=True)
+                self._observer.start()
+                self.active_mode = 'watchdog'
+            except Exception as e:
+                print(f"Не удалось запустить watchdog ({e}), переход на опрос папки.")
+                self._observer = None
+        if self._observer is None:
+            if self.mode == 'watchdog':
+                print("watchdog не установлен (pip install watchdog), наблюдатель за папкой не запущен.")
+                return False
+            self.active_mode = 'poll'
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='library-watcher', daemon=True)
+        self._thread.start()
+        print(f"Наблюдатель за папкой с фильмами запущен (режим: {self.active_mode}).")
+        return True
 
-# Создаем необходимые папки, если их нет
-os.makedirs(MOVIES_DIR, exist_ok=True)
-os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+    def stop(self):
+        self._stop_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
 
-# Поддерживаемые расширения видеофайлов
-SUPPORTED_FORMATS = ('.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm', '.m4v', '.3gp')
+    def dispatch(self, event):
+        """Обработчик событий watchdog (вызывается из потока Observer)."""
+        if event.event_type not in ('created', 'deleted', 'modified', 'moved', 'closed'):
+            return
+        paths = [event.src_path]
+        if getattr(event, 'dest_path', None):
+            paths.append(event.dest_path)
+        now = time.monotonic()
+        with self._pending_lock:
+            for path in paths:
+                if event.is_directory and event.event_type == 'modified':
+                    continue  # Изменение содержимого папки придет отдельными событиями по файлам
+                self._pending[os.fsdecode(path)] = now
+
+    def _run(self):
+        # Первый проход сверяет базу с диском: файлы могли измениться, пока приложение было закрыто.
+        # При запуске он откладывается, чтобы не отнимать процессор у первой отрисовки списка.
+        if self._stop_event.wait(self.initial_delay):
+            return
+        self._sync(self.manager.scan_movies, quiet=True)
+        while not self._stop_event.is_set():
+            if self.active_mode == 'poll':
+                if self._stop_event.wait(self.poll_interval):
+                    break
+                self._sync(self.manager.scan_movies, quiet=True, full=False)
+            else:
+                if self._stop_event.wait(min(self.debounce, 0.5)):
+                    break
+                ready = self._take_ready_paths()
+                if ready:
+                    self._sync(self.manager.refresh_paths, ready)
+
+    def _sync(self, func, *args, **kwargs):
+        """Проход сверки с диском; если база изменилась - один вызов on_changed на весь проход."""
+        version = self.manager.version
+        self._safe_call(func, *args, **kwargs)
+        if self.on_changed is not None and self.manager.version != version:
+            self._safe_call(self.on_changed)
+
+    def _take_ready_paths(self):
+        """Забирает пути, по которым события прекратились не менее debounce секунд назад (копирование завершено)."""
+        deadline = time.monotonic() - self.debounce
+        with self._pending_lock:
+            ready = [path for path, last_event in self._pending.items() if last_event <= deadline]
+            for path in ready:
+                del self._pending[path]
+        return ready
 
+    @staticmethod
+    def _safe_call(func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            print(f"Ошибка наблюдателя за папкой с фильмами: {e}")
+            return None
 
-def get_video_metadata_with_ffprobe(file_path):
+
+class UiEventBus:
     """
-    Использует ffprobe для получения длительности и других метаданных видео.
-    Возвращает словарь с 'duration' (секунды), 'width', 'height'.
+    Доставка событий из Python в интерфейс. Фоновые потоки (наблюдатель, пул обработки)
+    не вызывают Eel напрямую: события складываются в очередь, а отправляет их
+    гринлет Eel (run), запущенный через eel.spawn. События с одинаковым coalesce_key
+    схлопываются до последнего - интерфейсу важно только актуальное значение.
     """
-    try:
-        # Команда ffprobe для получения информации о длительности и разрешении в формате JSON
-        cmd = [
-            'ffprobe',
-            '-v', 'error',  # Выводить только ошибки
-            '-select_streams', 'v:0',  # Выбрать только первый видеопоток
-            '-show_entries', 'stream=duration,width,height',  # Показать длительность, ширину, высоту
-            '-of', 'json',  # Вывод в формате JSON
-            file_path
-        ]
-
-        # Запускаем ffprobe как подпроцесс
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True,
-                                creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == "Windows" else 0)
-
-        # Парсим JSON-вывод
-        data = json.loads(result.stdout)
-
-        duration = 0
-        width = 0
-        height = 0
-
-        # Извлекаем данные из JSON-ответа
-        if 'streams' in data and len(data['streams']) > 0:
-            stream = data['streams'][0]
-            if 'duration' in stream:
+
+    def __init__(self, interval=UI_PUSH_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._events = []  # (имя JS-функции, данные)
+        self._coalesced = {}  # coalesce_key -> (имя JS-функции, данные)
+
+    def publish(self, js_function, payload, coalesce_key=None):
+        with self._lock:
+            if coalesce_key is None:
+                self._events.append((js_function, payload))
+            else:
+                self._coalesced[coalesce_key] = (js_function, payload)
+
+    def _take(self):
+        with self._lock:
+            events = self._events + list(self._coalesced.values())
+            self._events = []
+            self._coalesced = {}
+        return events
+
+    def run(self):
+        while True:
+            eel.sleep(self.interval)
+            for js_function, payload in self._take():
                 try:
-                    duration = float(stream['duration'])
-                except ValueError:
-                    duration = 0  # Если длительность не является числом
-            width = stream.get('width', 0)
-            height = stream.get('height', 0)
-
-        return {'duration': int(duration), 'width': width, 'height': height}
-    except FileNotFoundError:
-        print("Ошибка: ffprobe не найден. Убедитесь, что FFmpeg установлен и добавлен в PATH.")
-        return {'duration': 0, 'width': 0, 'height': 0}
-    except subprocess.CalledProcessError as e:
-        print(f"Ошибка при вызове ffprobe для {file_path}: {e.stderr.strip()}")
-        return {'duration': 0, 'width': 0, 'height': 0}
-    except json.JSONDecodeError as e:
-        print(f"Ошибка парсинга JSON от ffprobe для {file_path}: {e}")
-        return {'duration': 0, 'width': 0, 'height': 0}
-    except Exception as e:
-        print(f"Неизвестная ошибка при получении метаданных для {file_path}: {e}")
-        return {'duration': 0, 'width': 0, 'height': 0}
+                    getattr(eel, js_function)(payload)
+                except Exception as e:
+                    print(f"Не удалось отправить событие {js_function} в интерфейс: {e}")
+
 
+class JobCancelled(Exception):
+    """Задача отменена (бросается из Job.check_cancelled внутри выполняемой функции)."""
 
-def generate_thumbnail_with_opencv(file_path, thumbnail_path):
+
+class Job:
     """
-    Генерирует миниатюру видео, используя OpenCV.
-    Попытается взять кадр на 10% от длительности или первый кадр.
+    Фоновая задача планировщика. Выполняемая функция получает задачу первым аргументом,
+    сообщает о ходе через report(done, total) и периодически вызывает check_cancelled().
+    Состояния: queued -> running -> done / failed / cancelled.
     """
-    cap = cv2.VideoCapture(file_path)
-    if not cap.isOpened():
-        print(f"Не удалось открыть видеофайл для миниатюры: {file_path}")
-        return False
 
-    # Получаем общую длительность в миллисекундах и FPS
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_duration_ms = (frame_count / fps) * 1000 if fps > 0 else 0
+    def __init__(self, kind, func, args, priority, key=None, title=None, on_update=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.key = key
+        self.title = title or kind
+        self.state = 'queued'
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel_event = threading.Event()
+        self._on_update = on_update
 
-    # Устанавливаем позицию для захвата кадра
-    if total_duration_ms > 0:
-        target_ms = total_duration_ms * 0.1
-        cap.set(cv2.CAP_PROP_POS_MSEC, target_ms)
-    else:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # Устанавливаем на первый кадр
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
 
-    ret, frame = cap.read()  # Читаем кадр
-    cap.release()  # Освобождаем ресурсы
+    @property
+    def is_finished(self):
+        return self.state in ('done', 'failed', 'cancelled')
 
-    if ret:
-        # Конвертируем BGR в RGB
-        img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        # Ресайз до 300x300, сохраняя пропорции
-        img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-        img.save(thumbnail_path, quality=85)
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def report(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        if self._on_update:
+            self._on_update(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'title': self.title,
+            'priority': self.priority,
+            'state': self.state,
+            'done': self.done,
+            'total': self.total,
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobScheduler:
+    """
+    Очередь фоновых задач с приоритетами (JOB_PRIORITIES) и пулом потоков.
+    Задачи с одинаковым key не дублируются: повторная постановка возвращает уже активную задачу
+    (и поднимает ее приоритет, если она еще в очереди). Задачи 'backfill' не занимают последний
+    свободный поток, чтобы пользовательские задачи не ждали массовую фоновую обработку.
+    Изменения задач отправляются в интерфейс через UiEventBus (JS-функция on_job_event).
+    """
+
+    def __init__(self, workers=JOB_WORKERS, events=None, history_size=JOB_HISTORY_SIZE):
+        self.workers = max(1, workers)
+        self.events = events
+        self.history_size = history_size
+        self._cond = threading.Condition()
+        self._queue = []  # куча (приоритет, порядковый номер, задача)
+        self._counter = 0
+        self._jobs = {}  # id -> задача (активные и последние завершенные)
+        self._active_by_key = {}  # key -> активная задача
+        self._finished_ids = collections.deque()
+        self._running_backfill = 0
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stopping = True
+            for job in self._jobs.values():
+                if not job.is_finished:
+                    job._cancel_event.set()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def submit(self, kind, func, *args, priority='normal', key=None, title=None):
+        """Ставит func(job, *args) в очередь и возвращает задачу (или уже активную задачу с тем же key)."""
+        if priority not in JOB_PRIORITIES:
+            raise ValueError(f"Неизвестный приоритет задачи: {priority}")
+        with self._cond:
+            existing = self._active_by_key.get(key) if key is not None else None
+            if existing is not None:
+                if existing.state == 'queued' and JOB_PRIORITIES[priority] < JOB_PRIORITIES[existing.priority]:
+                    existing.priority = priority
+                    self._push(existing)  # Старая запись в куче станет устаревшей и будет пропущена
+                    self._cond.notify()
+                return existing
+            job = Job(kind, func, args, priority, key, title, on_update=self._publish)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active_by_key[key] = job
+            self._push(job)
+            self._cond.notify()
+        self._publish(job)
+        return job
+
+    def cancel(self, job_id):
+        """Отменяет задачу: из очереди она убирается сразу, выполняемая останавливается при ближайшей проверке."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.is_finished:
+                return False
+            job._cancel_event.set()
+            if job.state == 'queued':
+                self._finish(job, 'cancelled')
         return True
-    else:
-        print(f"Не удалось захватить кадр для миниатюры из: {file_path}")
-        return False
 
+    def get_job(self, job_id):
+        return self._jobs.get(job_id)
 
-class MovieManager:
-    """Класс для управления коллекцией фильмов: загрузка, сохранение, сканирование, CRUD операции."""
+    def list_jobs(self):
+        with self._cond:
+            return [job.to_dict() for job in self._jobs.values()]
 
-    def __init__(self, db_file):
-        self.db_file = db_file
-        self.movies = self._load_movies()
-        self._ensure_ids_are_strings()  # Убеждаемся, что ID в БД хранятся как строки
+    def _push(self, job):
+        self._counter += 1
+        heapq.heappush(self._queue, (JOB_PRIORITIES[job.priority], self._counter, job))
 
-    def _load_movies(self):
-        """Загружает базу данных фильмов из JSON-файла."""
-        if os.path.exists(self.db_file):
+    def _take_next(self):
+        """Берет следующую задачу из очереди (вызывается под self._cond). None - подходящих задач нет."""
+        backfill_limit = max(1, self.workers - 1)
+        while self._queue:
+            rank, _, job = self._queue[0]
+            if job.state != 'queued' or rank != JOB_PRIORITIES[job.priority]:
+                heapq.heappop(self._queue)  # Отмененная задача или устаревшая запись после смены приоритета
+                continue
+            if job.priority == 'backfill' and self._running_backfill >= backfill_limit:
+                return None  # Выше в куче только backfill-задачи, а их лимит исчерпан
+            heapq.heappop(self._queue)
+            return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._take_next()
+                while job is None and not self._stopping:
+                    self._cond.wait()
+                    job = self._take_next()
+                if self._stopping:
+                    return
+                job.state = 'running'
+                job.started = time.time()
+                if job.priority == 'backfill':
+                    self._running_backfill += 1
+            self._publish(job)
+            state, result, error = 'done', None, None
             try:
-                with open(self.db_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print(f"Предупреждение: База данных повреждена. Создаю новую.")
-                return []
+                result = job.func(job, *job.args)
+                if isinstance(result, dict) and result.get('success') is False:
+                    state, error = 'failed', result.get('error')
+            except JobCancelled:
+                state = 'cancelled'
             except Exception as e:
-                print(f"Ошибка загрузки БД: {e}")
-                return []
-        print("База данных не найдена. Создаю новую.")
-        return []
+                print(f"Ошибка фоновой задачи {job.title}: {e}")
+                state, error = 'failed', str(e)
+            with self._cond:
+                if job.priority == 'backfill':
+                    self._running_backfill -= 1
+                self._finish(job, state, result, error)
+                self._cond.notify_all()
 
-    def _save_movies(self):
-        """Сохраняет текущее состояние базы данных фильмов в JSON-файл."""
+    def _finish(self, job, state, result=None, error=None):
+        """Завершает задачу (вызывается под self._cond) и ограничивает историю завершенных."""
+        job.state = state
+        job.result = result
+        job.error = error
+        job.finished = time.time()
+        if job.key is not None and self._active_by_key.get(job.key) is job:
+            del self._active_by_key[job.key]
+        self._finished_ids.append(job.id)
+        while len(self._finished_ids) > self.history_size:
+            self._jobs.pop(self._finished_ids.popleft(), None)
+        self._publish(job)
+
+    def _publish(self, job):
+        if self.events is not None:
+            # Схлопываем по задаче: интерфейсу важно последнее состояние и прогресс
+            self.events.publish('on_job_event', job.to_dict(), coalesce_key=f'job:{job.id}')
+
+
+# Экземпляры менеджера фильмов и наблюдателя создаются в main(), чтобы модуль
+# можно было импортировать (например, в бенчмарках) без загрузки базы и запуска Eel
+movie_manager = None
+library_watcher = None
+job_scheduler = None
+sprite_cache = None
+playback_cache = None
+ui_events = UiEventBus()
+_library_loader = None  # Поток open_library при запуске: окно открывается, не дожидаясь загрузки базы
+_library_error = None  # Текст ошибки, если open_library не смог открыть базу
+
+
+def _wait_for_library():
+    """Ждет открытия библиотеки, уступая другим гринлетам Eel (статика и сокет продолжают обслуживаться)."""
+    while _library_loader is not None and _library_loader.is_alive():
+        eel.sleep(0.05)
+
+
+def _wait_for_manager_lock():
+    """
+    Ждет, пока фоновые потоки отпустят блокировку базы, уступая другим гринлетам. Eel не подменяет threading,
+    и ожидание внутри with movie_manager._lock остановило бы весь сервер: сокет, статику и /stream.
+    """
+    lock = movie_manager._lock if movie_manager is not None else None
+    if lock is None:
+        return
+    while not lock.acquire(blocking=False):
+        eel.sleep(0.005)
+    lock.release()
+
+
+# --- HTTP-раздача видео ---
+# Eel отдает статику только из web/, а у длинных файлов важно корректно обрабатывать Range:
+# при перемотке браузер запрашивает нужный диапазон, и сервер сразу переходит к этому смещению,
+# поэтому время старта и перемотки не зависит от размера файла.
+
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONCURRENT)
+
+
+def is_in_library_roots(path, roots=None):
+    """Лежит ли path внутри одной из папок библиотеки (символьные ссылки внутри библиотеки допустимы)."""
+    path = os.path.normcase(os.path.abspath(path))
+    for root in roots if roots is not None else LIBRARY_ROOTS:
+        root = os.path.normcase(os.path.abspath(root))
         try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
-                json.dump(self.movies, f, indent=4, ensure_ascii=False)
-        except Exception as e:
-            print(f"Ошибка сохранения БД: {e}")
+            if os.path.commonpath([path, root]) == root:
+                return True
+        except ValueError:
+            continue  # Разные диски в Windows
+    return False
 
-    def _ensure_ids_are_strings(self):
-        """Преобразует любые числовые ID в строковые."""
-        changed = False
-        for movie in self.movies:
-            if 'id' in movie and not isinstance(movie['id'], str):
-                movie['id'] = str(movie['id'])
-                changed = True
-        if changed:
-            self._save_movies()
 
-    def scan_movies(self):
-        """
-        Сканирует папку с фильмами, добавляет новые, обновляет существующие
-        и удаляет отсутствующие файлы из базы данных.
-        """
-        found_movies = []
-        existing_movies_by_path = {os.path.normcase(os.path.normpath(m['path'])): m for m in self.movies}
+def parse_byte_range(header, size):
+    """
+    Разбирает заголовок Range ('bytes=500-999', 'bytes=500-', 'bytes=-500').
+    Возвращает (начало, конец) включительно или None, если заголовок не про байты.
+    Из нескольких диапазонов используется первый. ValueError - диапазон вне файла (ответ 416).
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not ranges:
+        return None
+    first, _, last = ranges.split(',')[0].strip().partition('-')
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise ValueError(header)
+            return max(0, size - suffix), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None  # Некорректный заголовок игнорируется - отдаем файл целиком
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
 
-        print("\n--- Запуск сканирования фильмов ---")
-        all_files_to_scan = [os.path.join(root, filename) for root, _, files in os.walk(MOVIES_DIR) for filename in
-                             files]
 
-        iterator = tqdm(all_files_to_scan, desc="Сканирование файлов") if tqdm else all_files_to_scan
-        for file_path in iterator:
-            normalized_path = os.path.normcase(os.path.normpath(file_path))
-            if not normalized_path.lower().endswith(SUPPORTED_FORMATS):
-                continue
+class _FileRangeIterator:
+    """Тело ответа: length байт файла с текущей позиции, кусками; close() освобождает слот раздачи."""
 
-            existing_movie = existing_movies_by_path.pop(normalized_path, None)
-            if existing_movie:
-                found_movies.append(existing_movie)
-                continue
+    def __init__(self, f, length, chunk_size, on_close):
+        self.f = f
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self._on_close = on_close
 
-            print(f"Обработка нового фильма: {os.path.basename(file_path)}")
-            metadata = get_video_metadata_with_ffprobe(file_path)
-            duration_seconds = metadata.get('duration', 0)
-            width = metadata.get('width', 0)
-            height = metadata.get('height', 0)
-
-            title = os.path.splitext(os.path.basename(file_path))[0].replace('.', ' ').strip().title()
-            year = "Неизвестен"
-            match = re.search(r'(\d{4})', title)
-            if match:
-                year = match.group(1)
-
-            genre = "Неизвестен"
-            rating = 0.0
-            description = "Нет описания."
-
-            thumbnail_filename = f"{uuid.uuid4().hex}.jpg"
-            thumbnail_path = os.path.join(THUMBNAILS_DIR, thumbnail_filename)
-            if not generate_thumbnail_with_opencv(file_path, thumbnail_path):
-                thumbnail_filename = None
-
-            file_size = os.path.getsize(file_path)
-
-            new_movie = {
-                'id': str(uuid.uuid4()),
-                'title': title,
-                'path': os.path.normpath(file_path),  # Сохраняем оригинальный путь
-                'genre': genre,
-                'year': year,
-                'rating': rating,
-                'duration': duration_seconds,
-                'resolution': f"{width}x{height}" if width and height else 'Unknown',
-                'size': file_size,
-                'thumbnail': thumbnail_filename,
-                'description': description,
-                'date_added': int(time.time())
-            }
-            found_movies.append(new_movie)
-
-        # Удаление отсутствующих фильмов
-        removed_count = 0
-        for movie_path_to_remove, movie_data_to_remove in existing_movies_by_path.items():
-            print(f"Удаление отсутствующего фильма: {movie_data_to_remove['title']}")
-            if movie_data_to_remove.get('thumbnail'):
-                thumbnail_path = os.path.join(THUMBNAILS_DIR, movie_data_to_remove['thumbnail'])
-                try:
-                    if os.path.exists(thumbnail_path):
-                        os.remove(thumbnail_path)
-                        print(f"Удалено превью: {thumbnail_path}")
-                except Exception as e:
-                    print(f"Ошибка удаления превью: {e}")
-            removed_count += 1
+    def __iter__(self):
+        return self
 
-        self.movies = found_movies
-        self._save_movies()
-        print(f"Сканирование завершено. Обнаружено {len(found_movies)} фильмов. Удалено {removed_count}.")
-        return self.movies
+    def __next__(self):
+        if self.remaining <= 0:
+            raise StopIteration
+        data = self.f.read(min(self.chunk_size, self.remaining))
+        if not data:
+            raise StopIteration
+        self.remaining -= len(data)
+        return data
 
-    def get_movies(self):
-        return self.movies
+    def close(self):
+        if self._on_close is not None:
+            self.f.close()
+            self._on_close()
+            self._on_close = None
 
-    def get_movie_details(self, movie_id):
-        return next((m for m in self.movies if m['id'] == movie_id), None)
 
-    def update_movie_info(self, movie_id, title, genre, year, rating, description):
-        for movie in self.movies:
-            if movie['id'] == movie_id:
-                movie['title'] = title
-                movie['genre'] = genre
-                movie['year'] = int(year)
-                movie['rating'] = float(rating)
-                movie['description'] = description
-                self._save_movies()
-                return {'success': True}
-        return {'success': False, 'error': 'Фильм не найден.'}
+def _serve_file(path):
+    """Отдает файл с поддержкой Range/206, ETag/Last-Modified и ограничением одновременных раздач."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return bottle.HTTPError(404, "Файл не найден.")
 
-    def delete_movie(self, movie_id):
-        """Удаляет фильм из базы данных, файл с диска и превью."""
-        for i, movie in enumerate(self.movies):
-            if movie['id'] == movie_id:
-                movie_to_delete = self.movies.pop(i)
-                # Удаление файла фильма
-                try:
-                    if os.path.exists(movie_to_delete['path']):
-                        os.remove(movie_to_delete['path'])
-                        print(f"Удален файл: {movie_to_delete['path']}")
-                except Exception as e:
-                    print(f"Ошибка удаления файла: {e}")
+    request = bottle.request
+    etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+    headers = {
+        'Content-Type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': email.utils.formatdate(st.st_mtime, usegmt=True),
+        'Cache-Control': 'no-cache',  # Кэшировать можно, но с проверкой по ETag
+    }
 
-                # Удаление превью
-                if movie_to_delete.get('thumbnail'):
-                    thumbnail_path = os.path.join(THUMBNAILS_DIR, movie_to_delete['thumbnail'])
-                    try:
-                        if os.path.exists(thumbnail_path):
-                            os.remove(thumbnail_path)
-                            print(f"Удалено превью: {thumbnail_path}")
-                    except Exception as e:
-                        print(f"Ошибка удаления превью: {e}")
+    if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = bottle.parse_date(request.environ.get('HTTP_IF_MODIFIED_SINCE', '') or '')
+    if (if_none_match and etag in if_none_match) or \
+            (not if_none_match and if_modified_since and int(st.st_mtime) <= if_modified_since):
+        return bottle.HTTPResponse(status=304, headers=headers)
 
-                self._save_movies()
-                return {'success': True}
+    byte_range = None
+    range_header = request.environ.get('HTTP_RANGE')
+    if_range = request.environ.get('HTTP_IF_RANGE')
+    # If-Range: диапазон действителен, только если файл не изменился с прошлого ответа
+    if range_header and (not if_range or if_range == etag or
+                         bottle.parse_date(if_range) == int(st.st_mtime)):
+        try:
+            byte_range = parse_byte_range(range_header, st.st_size)
+        except ValueError:
+            return bottle.HTTPResponse(status=416, headers=dict(headers, **{'Content-Range': f"bytes */{st.st_size}"}))
+
+    start, end = byte_range or (0, st.st_size - 1)
+    length = max(0, end - start + 1)
+    status = 206 if byte_range else 200
+    headers['Content-Length'] = str(length)
+    if byte_range:
+        headers['Content-Range'] = f"bytes {start}-{end}/{st.st_size}"
+    if request.method == 'HEAD':
+        return bottle.HTTPResponse(status=status, headers=headers)
+
+    if not _stream_slots.acquire(blocking=False):
+        return bottle.HTTPResponse(status=503, headers={'Retry-After': '1'})
+    try:
+        f = open(path, 'rb')
+        f.seek(start)
+    except OSError:
+        _stream_slots.release()
+        return bottle.HTTPError(404, "Файл не найден.")
+    return bottle.HTTPResponse(_FileRangeIterator(f, length, STREAM_CHUNK_SIZE, _stream_slots.release),
+                               status=status, headers=headers)
+
+
+@bottle.route('/stream/<movie_id>', method=['GET', 'HEAD'])
+def stream_movie(movie_id):
+    """Отдает файл фильма как есть."""
+    _wait_for_manager_lock()
+    movie = movie_manager.get_movie_details(movie_id) if movie_manager is not None else None
+    if movie is None or not is_in_library_roots(movie['path']):
+        return bottle.HTTPError(404, "Фильм не найден.")
+    return _serve_file(movie['path'])
+
+
+@bottle.route('/stream/<movie_id>/playback.mp4', method=['GET', 'HEAD'])
+def stream_playback_copy(movie_id):
+    """Отдает подготовленную к воспроизведению копию фильма из PlaybackCache."""
+    _wait_for_manager_lock()
+    movie = movie_manager.get_movie_details(movie_id) if movie_manager is not None else None
+    name = playback_cache.lookup(movie) if movie is not None and playback_cache is not None else None
+    if name is None:
+        return bottle.HTTPError(404, "Фильм не подготовлен к воспроизведению.")
+    return _serve_file(playback_cache.path(name))
+
+
+@bottle.route('/thumb/<size>/<name>', method=['GET', 'HEAD'])
+def serve_thumbnail(size, name):
+    """
+    Отдает превью нужного размера: WebP/AVIF, если браузер их принимает (заголовок Accept), иначе JPEG.
+    Сначала ищется файл в текущем thumbnail_format(), затем в других форматах: превью, созданные до смены
+    формата, остаются в прежнем. Последний вариант - JPEG размера 'grid'.
+    Имя файла зависит только от содержимого, поэтому ответ кэшируется браузером навсегда (immutable).
+    """
+    if size not in THUMBNAIL_VARIANTS or name != os.path.basename(name) or name.startswith('.'):
+        return bottle.HTTPError(404, "Превью не найдено.")
+    candidates = []
+    if _THUMBNAIL_KEY_RE.fullmatch(name):
+        accept = bottle.request.environ.get('HTTP_ACCEPT', '')
+        for fmt in dict.fromkeys([thumbnail_format(), *_THUMBNAIL_EXTENSIONS]):
+            if fmt == 'jpeg' or f"image/{fmt}" in accept:
+                candidates.append((thumbnail_file(name, size, fmt), f"image/{fmt}"))  # .avif есть не во всех mimetypes
+    candidates.append((thumbnail_file(name), True))  # JPEG размера 'grid' или файл прежних версий - тип по расширению
+    for filename, mimetype in candidates:
+        if os.path.isfile(os.path.join(THUMBNAILS_DIR, filename)):
+            return bottle.static_file(filename, root=THUMBNAILS_DIR, mimetype=mimetype,
+                                      headers={'Cache-Control': 'public, max-age=31536000, immutable',
+                                               'Vary': 'Accept'})
+    return bottle.HTTPError(404, "Превью не найдено.")
+
+
+# --- Фоновые задачи, запускаемые из интерфейса ---
+
+def _scan_job(job, full=True):
+    total = movie_manager.scan_movies(job=job, full=full)
+    prewarm_playback()  # Один раз на сканирование, а не на каждое изменение базы
+    return {'success': True, 'total': total}
+
+
+def _import_job(job, sources):
+    result = movie_manager.import_movies(sources, job=job)
+    prewarm_playback()
+    return result
+
+
+def submit_import_job(sources):
+    """Пакетное добавление выбранных файлов/папок одной пользовательской задачей."""
+    sources = [os.path.normpath(path) for path in sources]
+    if len(sources) == 1:
+        title = f"Добавление {os.path.basename(sources[0])}"
+    else:
+        title = f"Добавление {len(sources)} объектов"
+    key = 'import:' + '|'.join(sorted(os.path.normcase(path) for path in sources))
+    return job_scheduler.submit('import', _import_job, sources, priority='user', key=key, title=title)
+
+
+def _thumbnails_job(job, movie_ids=None, fast=False):
+    return {'success': True, 'created': movie_manager.generate_missing_thumbnails(movie_ids, job=job, fast=fast)}
+
+
+def _thumbnail_gc_job(job):
+    return movie_manager.collect_thumbnail_garbage(job=job)
+
+
+def _sprite_job(job, movie_id):
+    movie = movie_manager.get_movie_details(movie_id)
+    if movie is None:
         return {'success': False, 'error': 'Фильм не найден.'}
+    name = sprite_cache.lookup(movie) or sprite_cache.build(movie)
+    if name is None:
+        return {'success': False, 'error': 'Не удалось создать раскадровку.'}
+    return {'success': True, 'sprite': sprite_cache.url(name), 'frames': sprite_cache.frames}
 
-    def get_movies_stats(self):
-        total_movies = len(self.movies)
-        total_size = sum(m.get('size', 0) for m in self.movies)
-        total_duration = sum(m.get('duration', 0) for m in self.movies)
-        valid_ratings = [m.get('rating', 0) for m in self.movies if isinstance(m.get('rating'), (int, float))]
-        avg_rating = round(sum(valid_ratings) / len(valid_ratings), 1) if valid_ratings else 0.0
-        return {
-            'total_movies': total_movies,
-            'total_size': total_size,
-            'total_duration': total_duration,
-            'avg_rating': avg_rating
-        }
 
-    def add_movie_from_path(self, file_path):
-        normalized_path = os.path.normpath(file_path)
-        if not os.path.exists(normalized_path):
-            return {'success': False, 'error': 'Файл не существует.'}
-        if not normalized_path.lower().endswith(SUPPORTED_FORMATS):
-            return {'success': False, 'error': 'Неподдерживаемый формат.'}
-
-        # Проверка на дубликат
-        if any(os.path.normpath(m['path']) == normalized_path for m in self.movies):
-            return {'success': False, 'error': 'Фильм уже существует.'}
+def _playback_job(job, movie_id):
+    movie = movie_manager.get_movie_details(movie_id)
+    if movie is None:
+        return {'success': False, 'error': 'Фильм не найден.'}
+    name = playback_cache.lookup(movie) or playback_cache.prepare(movie, job=job)
+    if name is None:
+        if playback_plan(movie)['mode'] == 'direct':
+            return {'success': True, 'local_url': f"/stream/{urllib.parse.quote(movie_id)}"}
+        return {'success': False, 'error': 'Не удалось подготовить фильм к воспроизведению.'}
+    return {'success': True, 'local_url': playback_cache.url(urllib.parse.quote(movie_id))}
 
-        original_filename = os.path.basename(normalized_path)
-        destination_path = os.path.join(MOVIES_DIR, original_filename)
-        counter = 1
-        base_name, extension = os.path.splitext(original_filename)
-        while os.path.exists(destination_path):
-            destination_path = os.path.join(MOVIES_DIR, f"{base_name}_{counter}{extension}")
-            counter += 1
 
-        try:
-            shutil.copy2(normalized_path, destination_path)
-        except Exception as e:
-            return {'success': False, 'error': f'Ошибка копирования: {e}'}
+def submit_playback_job(movie, priority='user'):
+    job = job_scheduler.submit('playback', _playback_job, movie['id'], priority=priority,
+                               key=f"playback:{movie['id']}", title=f"Подготовка {movie['title']}")
+    if priority == 'user':
+        # Пользователь ждет у плеера: заблаговременная подготовка других фильмов уступает ему ffmpeg
+        for other in job_scheduler.list_jobs():
+            if other['kind'] == 'playback' and other['priority'] == 'backfill' and other['id'] != job.id \
+                    and other['state'] in ('queued', 'running'):
+                job_scheduler.cancel(other['id'])
+    return job
 
-        self.scan_movies()
-        new_movie = next((m for m in self.movies if os.path.normpath(m['path']) == os.path.normpath(destination_path)),
-                         None)
-        if new_movie:
-            return {'success': True, 'movie': new_movie}
-        return {'success': False, 'error': 'Не удалось добавить в БД.'}
 
-    def update_movie_thumbnail(self, movie_id):
-        """Обновляет превью фильма, открывая диалог выбора изображения."""
-        try:
-            import tkinter as tk
-            from tkinter import filedialog
+def prewarm_playback():
+    """
+    Ставит в фоновую очередь подготовку последних добавленных фильмов, которым она нужна. Вызывается после
+    сканирования, импорта и прохода наблюдателя, изменившего базу, - вне блокировки базы.
+    """
+    if job_scheduler is None or playback_cache is None or PLAYBACK_PREWARM_COUNT <= 0:
+        return
+    recent = movie_manager.get_movies_page(0, PLAYBACK_PREWARM_COUNT, '-date_added')['movies']
+    for movie in recent:
+        if playback_plan(movie)['mode'] != 'direct' and playback_cache.lookup(movie) is None:
+            submit_playback_job(movie, priority='backfill')
 
-            root = tk.Tk()
-            root.withdraw()
-            root.attributes('-topmost', True)
 
-            thumbnail_path = filedialog.askopenfilename(
-                title="Выберите изображение для превью",
-                filetypes=[("Изображения", "*.jpg *.jpeg *.png *.gif"), ("Все файлы", "*.*")]
-            )
-            root.destroy()
+def _fingerprints_job(job):
+    return {'success': True, 'updated': movie_manager.generate_missing_fingerprints(job=job)}
 
-            if not thumbnail_path:
-                return {'success': False, 'error': 'Выбор отменен.'}
 
-            movie = self.get_movie_details(movie_id)
-            if not movie:
-                return {'success': False, 'error': 'Фильм не найден.'}
+def _duplicates_job(job):
+    return movie_manager.find_duplicates(job=job)
 
-            # Удаление старого превью, если есть
-            if movie.get('thumbnail'):
-                old_thumbnail_path = os.path.join(THUMBNAILS_DIR, movie['thumbnail'])
-                try:
-                    if os.path.exists(old_thumbnail_path):
-                        os.remove(old_thumbnail_path)
-                        print(f"Удалено старое превью: {old_thumbnail_path}")
-                except Exception as e:
-                    print(f"Ошибка удаления старого превью: {e}")
 
-            # Генерация уникального имени и копирование
-            new_thumbnail_filename = f"{uuid.uuid4().hex}{os.path.splitext(thumbnail_path)[1]}"
-            new_thumbnail_path = os.path.join(THUMBNAILS_DIR, new_thumbnail_filename)
+def _migration_job(job):
+    return {'success': True, 'migrated': movie_manager.migrate_storage(job=job)}
 
-            img = Image.open(thumbnail_path)
-            img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-            img.save(new_thumbnail_path, quality=85)
 
-            movie['thumbnail'] = new_thumbnail_filename
-            self._save_movies()
-            print(f"Превью обновлено для фильма {movie['title']}: {new_thumbnail_filename}")
-            return {'success': True, 'thumbnail': new_thumbnail_filename}
-        except ImportError:
-            return {'success': False, 'error': 'Tkinter не установлен.'}
-        except Exception as e:
-            return {'success': False, 'error': f'Ошибка обновления превью: {e}'}
+def _snapshot_job(job):
+    return {'success': True, 'saved': movie_manager.save_snapshot()}
 
 
-# Создаем экземпляр менеджера фильмов
-movie_manager = MovieManager(DB_FILE)
+def submit_scan_job(full=True):
+    """full=False - быстрая сверка с диском по mtime папок (открытие интерфейса без наблюдателя)."""
+    key = 'scan' if full else 'scan:quick'
+    return job_scheduler.submit('scan', _scan_job, full, key=key, title="Сканирование фильмов")
 
 
 # --- Eel Exposing Functions ---
 
-@eel.expose
+@expose
 def get_movies():
     try:
-        movies_data = movie_manager.scan_movies()
-        return {'success': True, 'movies': movies_data}
+        result = {'success': True, 'movies': movie_manager.get_movies()}
+        if library_watcher is None or not library_watcher.is_running:
+            # Без наблюдателя сверяем базу с диском в фоне; интерфейс узнает об изменениях через on_library_changed
+            result['job_id'] = submit_scan_job(full=False).id
+        return result
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+@expose
+def scan_movies(full=True):
+    """
+    Пересканирование (инкрементальное, по size/mtime/inode): полное по кнопке "Сканировать",
+    быстрое (full=False, см. LibraryWalker) - при открытии интерфейса без наблюдателя за папкой.
+    Выполняется в фоне: сразу возвращает job_id, ход и результат приходят событиями on_job_event.
+    """
+    try:
+        return {'success': True, 'job_id': submit_scan_job(full=bool(full)).id}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+@expose
+def cancel_job(job_id):
+    return {'success': job_scheduler.cancel(job_id)}
+
+
+@expose
+def get_jobs():
+    return job_scheduler.list_jobs()
+
+
+@expose
+def ensure_thumbnails(movie_ids):
+    """Создает недостающие превью для видимых в интерфейсе фильмов в первую очередь (приоритет 'user')."""
+    try:
+        missing = movie_manager.missing_thumbnail_ids(movie_ids)
+        if not missing:
+            return {'success': True, 'job_id': None}
+        job = job_scheduler.submit('thumbnails', _thumbnails_job, missing, priority='user', title="Создание превью")
+        return {'success': True, 'job_id': job.id}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+@expose
+def get_movies_page(offset=0, limit=50, sort_key=DEFAULT_SORT_KEY, filters=None):
+    """Страница списка для виртуализированной ленты в интерфейсе (без передачи всей библиотеки)."""
+    try:
+        page = movie_manager.get_movies_page(offset, limit, sort_key, filters)
+        # Без наблюдателя интерфейс сам запускает сканирование после первой отрисовки
+        return dict(page, success=True, watching=library_watcher is not None and library_watcher.is_running)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+@expose
+def get_changes_since(version, epoch=None, snapshot=True):
+    """Изменения библиотеки с версии version (или полный снимок, если журнал их уже не хранит)."""
+    try:
+        return dict(movie_manager.get_changes_since(version, epoch, snapshot), success=True)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+@expose
+def search_movies(query, limit=None):
+    if not movie_manager.get_movie_count():
+        submit_scan_job(full=False)  # Результаты появятся в интерфейсе после сканирования (on_library_changed)
+    return movie_manager.search_movies(query, limit)
+
+
+@expose
+def get_sprite_sheet(movie_id):
+    """
+    Раскадровка для просмотра при наведении. Если она уже в кэше, сразу возвращается ее URL,
+    иначе ставится пользовательская задача, результат которой придет событием on_job_event.
+    """
+    try:
+        movie = movie_manager.get_movie_details(movie_id)
+        if movie is None:
+            return {'success': False, 'error': 'Фильм не найден.'}
+        name = sprite_cache.lookup(movie)
+        if name is not None:
+            return {'success': True, 'sprite': sprite_cache.url(name), 'frames': sprite_cache.frames}
+        job = job_scheduler.submit('sprite', _sprite_job, movie_id, priority='user', key=f'sprite:{movie_id}',
+                                   title=f"Раскадровка {movie['title']}")
+        return {'success': True, 'sprite': None, 'job_id': job.id}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
 
-@eel.expose
-def search_movies(query):
-    if not movie_manager.movies:
-        movie_manager.scan_movies()
-    query = query.lower()
-    results = [m for m in movie_manager.movies if
-               query in m['title'].lower() or query in m['genre'].lower() or query in m['description'].lower() or str(
-                   m['year']) == query]
-    return results
+@expose
+def find_duplicates():
+    """Отчет о дубликатах строится в фоне (может досчитывать отпечатки старых записей): возвращает job_id."""
+    try:
+        job = job_scheduler.submit('duplicates', _duplicates_job, priority='user', key='duplicates',
+                                   title="Поиск дубликатов")
+        return {'success': True, 'job_id': job.id}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
 
 
-@eel.expose
+@expose
 def get_movies_stats():
     return movie_manager.get_movies_stats()
 
 
-@eel.expose
+@expose
+def get_metrics(fmt='json'):
+    """
+    Замеры времени по этапам и счетчики (см. METRICS_ENABLED). fmt='prometheus' - тот же снимок
+    в текстовом формате Prometheus (поле text), как в METRICS_DUMP_FILE.
+    """
+    if fmt == 'prometheus':
+        return {'success': True, 'text': metrics.to_prometheus()}
+    return dict(metrics.snapshot(), success=True)
+
+
+@expose
 def prepare_movie_for_playback(movie_path):
-    if not os.path.exists(movie_path):
+    """
+    Адрес для воспроизведения: маршрут /stream/<id>, работающий для любой папки из LIBRARY_ROOTS.
+    Форматы, которые браузер не играет сам, отдаются из PlaybackCache; если копии еще нет,
+    возвращается local_url None и job_id задачи подготовки (ее результат содержит local_url).
+    """
+    movie = movie_manager.get_movie_by_path(movie_path)
+    if movie is None:
+        return {'success': False, 'error': 'Фильм не найден в базе.'}
+    if not os.path.exists(movie['path']):
         return {'success': False, 'error': 'Файл не найден.'}
-    try:
-        if not os.path.exists(web_dir):
-            return {'success': False, 'error': 'Веб-директория не найдена.'}
-        path_relative_to_web_dir = os.path.relpath(movie_path, web_dir)
-        local_url = '/' + urllib.parse.quote(path_relative_to_web_dir.replace(os.sep, '/'))
-        return {'success': True, 'local_url': local_url}
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
+    if not is_in_library_roots(movie['path']):
+        return {'success': False, 'error': 'Файл находится вне папок библиотеки.'}
+    if playback_plan(movie)['mode'] != 'direct':
+        if playback_cache.lookup(movie) is not None:
+            return {'success': True, 'local_url': playback_cache.url(urllib.parse.quote(movie['id']))}
+        return {'success': True, 'local_url': None, 'job_id': submit_playback_job(movie).id}
+    return {'success': True, 'local_url': f"/stream/{urllib.parse.quote(movie['id'])}"}
 
 
-@eel.expose
+@expose
 def get_movie_details(movie_id):
     return movie_manager.get_movie_details(movie_id)
 
 
-@eel.expose
+@expose
 def update_movie_info(movie_id, title, genre, year, rating, description):
     return movie_manager.update_movie_info(movie_id, title, genre, year, rating, description)
 
 
-@eel.expose
+@expose
 def delete_movie(movie_id):
-    return movie_manager.delete_movie(movie_id)
+    result = movie_manager.delete_movie(movie_id)
+    if result.get('success'):
+        sprite_cache.discard(movie_id)
+        playback_cache.discard(movie_id)
+    return result
 
 
-@eel.expose
+@expose
 def browse_for_movie():
+    """Диалог выбора одного или нескольких видеофайлов; добавление идет в фоне (возвращает job_id)."""
     try:
         import tkinter as tk
         from tkinter import filedialog
         root = tk.Tk()
         root.withdraw()
         root.attributes('-topmost', True)
-        file_path = filedialog.askopenfilename(
-            title="Выберите видеофайл",
+        file_paths = filedialog.askopenfilenames(
+            title="Выберите видеофайлы",
             filetypes=[("Видеофайлы", "*.mp4 *.avi *.mkv *.mov *.wmv *.flv *.webm *.m4v *.3gp"), ("Все файлы", "*.*")]
         )
         root.destroy()
-        if file_path:
-            return movie_manager.add_movie_from_path(file_path)
+        if file_paths:
+            # Копирование и обработка идут в фоне; результат придет событием on_job_event
+            return {'success': True, 'job_id': submit_import_job(list(file_paths)).id}
         return {'success': False, 'error': 'Выбор отменен.'}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
 
-@eel.expose
-def update_movie_thumbnail(movie_id):
-    return movie_manager.update_movie_thumbnail(movie_id)
+@expose
+def browse_for_movie_folder():
+    """Диалог выбора папки: все видеофайлы из нее добавляются одной фоновой задачей."""
+    try:
+        import tkinter as tk
+        from tkinter import filedialog
+        root = tk.Tk()
+        root.withdraw()
+        root.attributes('-topmost', True)
+        folder = filedialog.askdirectory(title="Выберите папку с фильмами")
+        root.destroy()
+        if folder:
+            return {'success': True, 'job_id': submit_import_job([folder]).id}
+        return {'success': False, 'error': 'Выбор отменен.'}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
 
 
-# Инициализация Eel
-if not os.path.exists(web_dir):
-    print(f"Ошибка: Веб-директория не найдена: {web_dir}")
-    sys.exit(1)
+@expose
+def update_movie_thumbnail(movie_id):
+    return movie_manager.update_movie_thumbnail(movie_id)
 
-eel.init(web_dir)
 
-print("==================================================")
-print("🎬 КИНОМАН - Ваша личная коллекция фильмов")
-print("==================================================")
-# ... (остальной вывод без изменений)
+def _on_library_changed(version):
+    # Интерфейс узнает о любых изменениях базы (в том числе фоновых) и сам забирает дельту
+    ui_events.publish('on_library_changed', version, coalesce_key='library_version')
 
-# --- Нормальный запуск с fallback ---
-print("\n--- Попытка нормального запуска приложения ---")
-BROWSER_LAUNCH_MODES = ['chrome-app', 'edge', 'chrome', 'default']
-LAUNCHED_SUCCESSFULLY = False
 
-for mode in BROWSER_LAUNCH_MODES:
+def open_library():
+    """
+    Открывает базу (из снимка, если он актуален) и запускает наблюдатель за папками. Выполняется в потоке
+    _library_loader параллельно с запуском окна. Сверка с диском и фоновые задачи начинаются через
+    STARTUP_BACKGROUND_DELAY секунд, когда интерфейс уже отрисовал первую страницу.
+    """
+    global movie_manager, library_watcher, _library_error
+    start = time.perf_counter()
     try:
-        print(f"Попытка запуска в режиме '{mode}'...")
-        eel.start('index.html', size=(1400, 900), mode=mode)
-        LAUNCHED_SUCCESSFULLY = True
-        print(f"✅ Успешный запуск в режиме '{mode}'.")
-        break
+        manager = MovieManager(DB_FILE)
     except Exception as e:
-        print(f"❌ Ошибка в режиме '{mode}': {e}")
-
-if not LAUNCHED_SUCCESSFULLY:
-    print("\n--- Все стандартные режимы провалились. Переход в серверный режим (fallback) ---")
-    print("   Запускаю локальный сервер Eel и открываю в системном браузере...")
+        # Например, поврежденный файл SQLite: вызовы из интерфейса вернут эту ошибку (см. expose)
+        print(f"Критическая ошибка открытия библиотеки: {e}")
+        _library_error = str(e)
+        return
+    manager.add_change_listener(_on_library_changed)
+    atexit.register(manager.save_snapshot)  # Следующий запуск загрузит библиотеку из снимка
+    watcher = LibraryWatcher(manager, library_roots(), initial_delay=STARTUP_BACKGROUND_DELAY,
+                             on_changed=prewarm_playback)
     try:
-        # Запуск Eel в серверном режиме (без автоматического браузера, на случайном порту)
-        # port=0 - Eel выберет свободный порт
-        eel.start('index.html', mode=False, host='localhost', port=0, block=False)
+        watcher.start()
+    except Exception as e:
+        # Без наблюдателя интерфейс сам запускает сверку с диском (см. get_movies, get_movies_page)
+        print(f"Не удалось запустить наблюдатель за папками: {e}")
+        watcher = None
+    movie_manager, library_watcher = manager, watcher
+    print(f"Библиотека открыта за {time.perf_counter() - start:.2f} с ({manager.get_movie_count()} фильмов).")
+    timer = threading.Timer(STARTUP_BACKGROUND_DELAY, start_background_tasks)
+    timer.daemon = True
+    timer.start()
 
-        # Получаем порт, на котором запустился сервер (Eel хранит его в eel._port)
-        port = eel._websockets_port  # Это внутренний атрибут, но он работает в старых версиях Eel
 
-        # Формируем URL
-        url = f'http://localhost:{port}/index.html'
-        print(f"✅ Сервер запущен на {url}")
-        print("   Открываю в системном браузере... Если не открылось, перейдите по ссылке вручную.")
+def start_background_tasks():
+    """Фоновые задачи запуска; идут с приоритетом backfill и не мешают пользовательским задачам."""
+    if movie_manager.storage.pending_migration is not None:
+        job_scheduler.submit('migration', _migration_job, priority='backfill', key='migration',
+                             title="Перенос базы в SQLite")
+    # Недостающие превью (например, после сбоя) догоняются в фоне
+    job_scheduler.submit('thumbnails', _thumbnails_job, None, True, priority='backfill', key='thumbnails:backfill',
+                         title="Создание недостающих превью")
+    job_scheduler.submit('thumbnails', _thumbnail_gc_job, priority='backfill', key='thumbnails:gc',
+                         title="Удаление неиспользуемых превью")
+    job_scheduler.submit('fingerprints', _fingerprints_job, priority='backfill', key='fingerprints:backfill',
+                         title="Отпечатки для поиска дубликатов")
+    if not movie_manager.loaded_from_snapshot:
+        job_scheduler.submit('snapshot', _snapshot_job, priority='backfill', key='snapshot',
+                             title="Снимок библиотеки для быстрого запуска")
+    prewarm_playback()
 
-        # Открываем в дефолтном браузере
-        webbrowser.open(url)
 
-        # Блокируем скрипт, чтобы сервер продолжал работать (бесконечный цикл)
-        while True:
-            time.sleep(1)  # Держим сервер живым
-    except Exception as e:
-        print(f"❌ Ошибка в fallback-режиме: {e}")
-        print("   Убедитесь, что установлен браузер и порт свободен.")
-        print("   Попробуйте открыть http://localhost:8000/index.html вручную после запуска скрипта.")
+def main():
+    global job_scheduler, sprite_cache, playback_cache, _library_loader
+    ensure_directories()
+
+    # Инициализация Eel
+    if not os.path.exists(web_dir):
+        print(f"Ошибка: Веб-директория не найдена: {web_dir}")
         sys.exit(1)
+
+    eel.init(web_dir)
+    eel.spawn(ui_events.run)
+    sprite_cache = SpriteCache(SPRITES_DIR)
+    playback_cache = PlaybackCache(PLAYBACK_CACHE_DIR)
+    job_scheduler = JobScheduler(events=ui_events)
+    job_scheduler.start()
+    # База открывается параллельно с запуском окна; вызовы из интерфейса дождутся ее (см. expose)
+    _library_loader = threading.Thread(target=open_library, name='library-loader', daemon=True)
+    _library_loader.start()
+    if metrics.enabled and METRICS_DUMP_FILE:
+        threading.Thread(target=_dump_metrics_periodically, args=(METRICS_DUMP_FILE,), name='metrics-dump',
+                         daemon=True).start()
+
+    print("==================================================")
+    print("🎬 КИНОМАН - Ваша личная коллекция фильмов")
+    print("==================================================")
+    # ... (остальной вывод без изменений)
+
+    # --- Нормальный запуск с fallback ---
+    print("\n--- Попытка нормального запуска приложения ---")
+    BROWSER_LAUNCH_MODES = ['chrome-app', 'edge', 'chrome', 'default']
+    LAUNCHED_SUCCESSFULLY = False
+
+    for mode in BROWSER_LAUNCH_MODES:
+        try:
+            print(f"Попытка запуска в режиме '{mode}'...")
+            eel.start('index.html', size=(1400, 900), mode=mode)
+            LAUNCHED_SUCCESSFULLY = True
+            print(f"✅ Успешный запуск в режиме '{mode}'.")
+            break
+        except Exception as e:
+            print(f"❌ Ошибка в режиме '{mode}': {e}")
+
+    if not LAUNCHED_SUCCESSFULLY:
+        print("\n--- Все стандартные режимы провалились. Переход в серверный режим (fallback) ---")
+        print("   Запускаю локальный сервер Eel и открываю в системном браузере...")
+        try:
+            # Запуск Eel в серверном режиме (без автоматического браузера, на случайном порту)
+            # port=0 - Eel выберет свободный порт
+            eel.start('index.html', mode=False, host='localhost', port=0, block=False)
+
+            # Получаем порт, на котором запустился сервер (Eel хранит его в eel._port)
+            port = eel._websockets_port  # Это внутренний атрибут, но он работает в старых версиях Eel
+
+            # Формируем URL
+            url = f'http://localhost:{port}/index.html'
+            print(f"✅ Сервер запущен на {url}")
+            print("   Открываю в системном браузере... Если не открылось, перейдите по ссылке вручную.")
+
+            # Открываем в дефолтном браузере
+            webbrowser.open(url)
+
+            # Блокируем скрипт, чтобы сервер продолжал работать (бесконечный цикл)
+            while True:
+                time.sleep(1)  # Держим сервер живым
+        except Exception as e:
+            print(f"❌ Ошибка в fallback-режиме: {e}")
+            print("   Убедитесь, что установлен браузер и порт свободен.")
+            print("   Попробуйте открыть http://localhost:8000/index.html вручную после запуска скрипта.")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
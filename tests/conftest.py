@@ -0,0 +1,31 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    """Фабрика MovieManager с базой во временной папке (без снимка); хранилища закрываются после теста."""
+    import main as kinoman
+    managers = []
+
+    def make(backend='sqlite', movies=None, **kwargs):
+        kwargs.setdefault('snapshot', False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager = kinoman.MovieManager(str(tmp_path / 'movies_db.json'), backend=backend, **kwargs)
+            if movies is not None:
+                manager.movies = movies
+                manager._save_movies()
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.storage.close()
@@ -0,0 +1,35 @@
+import main as kinoman
+from synthetic_library import make_records
+
+
+def test_delta_since_version(make_manager, tmp_path):
+    records = make_records(10, str(tmp_path / 'movies'), seed=2)
+    manager = make_manager(movies=records)
+    version = manager.version
+    changed = dict(records[0], title='Новое название')
+    manager._apply_changes(upserted=[changed])
+    manager._apply_changes(deleted_ids=[records[1]['id']])
+
+    changes = manager.get_changes_since(version, manager.epoch)
+    assert changes['full'] is False and changes['version'] == manager.version
+    assert changes['upserts'] == [changed] and changes['deletes'] == [records[1]['id']]
+    assert manager.get_changes_since(manager.version, manager.epoch)['upserts'] == []
+
+
+def test_full_snapshot_fallback(make_manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(kinoman, 'CHANGELOG_SIZE', 3)
+    records = make_records(10, str(tmp_path / 'movies'), seed=2)
+    manager = make_manager(movies=records)
+    version = manager.version
+    for movie in records[:5]:
+        manager._apply_changes(upserted=[dict(movie, rating=9.0)])
+
+    # Журнал уже не содержит нужных версий
+    changes = manager.get_changes_since(version, manager.epoch)
+    assert changes['full'] is True and len(changes['movies']) == len(records)
+    # Другой запуск приложения, версия из будущего, мусор вместо версии
+    assert manager.get_changes_since(manager.version, 'другой запуск')['full'] is True
+    assert manager.get_changes_since(manager.version + 1, manager.epoch)['full'] is True
+    assert manager.get_changes_since('abc', manager.epoch)['full'] is True
+    # snapshot=False - только признак полной перезагрузки, без списка
+    assert 'movies' not in manager.get_changes_since(version, manager.epoch, snapshot=False)
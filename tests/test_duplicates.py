@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+import main as kinoman
+from synthetic_library import make_records
+
+
+def test_fingerprint_samples_three_fragments(tmp_path):
+    sample = 1024
+    data = bytearray(os.urandom(10 * sample))
+    path = tmp_path / 'a.bin'
+    path.write_bytes(data)
+    fingerprint = kinoman.compute_fingerprint(str(path), sample_size=sample)
+    assert fingerprint.startswith(f"{len(data)}:")
+    # Изменение вне фрагментов не видно, изменение в середине файла - видно
+    data[2 * sample] ^= 0xFF
+    path.write_bytes(data)
+    assert kinoman.compute_fingerprint(str(path), sample_size=sample) == fingerprint
+    data[len(data) // 2] ^= 0xFF
+    path.write_bytes(data)
+    assert kinoman.compute_fingerprint(str(path), sample_size=sample) != fingerprint
+    # Маленький файл хешируется целиком
+    small = tmp_path / 'b.bin'
+    small.write_bytes(bytes(2 * sample))
+    assert kinoman.compute_fingerprint(str(small), sample_size=sample) != \
+        kinoman.compute_fingerprint(str(small), size=2 * sample - 1, sample_size=sample)
+
+
+def test_perceptual_hash_survives_resize():
+    rng = np.random.default_rng(12)
+    frame = Image.fromarray(np.kron(rng.integers(0, 255, (9, 16, 3), dtype=np.uint8), np.ones((40, 40, 1), np.uint8)))
+    phash = kinoman.perceptual_hash(frame)
+    assert len(phash) == 16
+    assert kinoman.hamming_distance(phash, kinoman.perceptual_hash(frame.resize((320, 180)))) <= kinoman.PHASH_MAX_DISTANCE
+    other = Image.fromarray(rng.integers(0, 255, (360, 640, 3), dtype=np.uint8))
+    assert kinoman.hamming_distance(phash, kinoman.perceptual_hash(other)) > kinoman.PHASH_MAX_DISTANCE
+
+
+def test_find_duplicates_groups(make_manager, tmp_path):
+    records = make_records(100, str(tmp_path / 'movies'), seed=12)
+    a, b, c, d, e = records[:5]
+    b['fingerprint'] = a['fingerprint']  # Точная копия
+    # Перекодированная копия: phash отличается двумя битами, длительность почти та же
+    c['phash'] = f"{int(a['phash'], 16) ^ 0b101:016x}"
+    c['duration'] = int(a['duration']) + 1
+    d['phash'] = c['phash']  # Тот же кадр, но фильм намного длиннее - не копия
+    d['duration'] = int(a['duration']) * 3 + 100
+    e['phash'] = '0' * 16  # Однотонный кадр не сравнивается
+    records[5]['phash'] = '0' * 16
+    manager = make_manager(movies=records)
+    report = manager.find_duplicates()
+    assert report['success']
+    groups = [(group['kind'], sorted(movie['id'] for movie in group['movies'])) for group in report['groups']]
+    assert groups == [('similar', sorted([a['id'], b['id'], c['id']]))]
+    sizes = [a['size'], b['size'], c['size']]
+    assert report['wasted_bytes'] == sum(sizes) - max(sizes)
+
+    manager._apply_changes(deleted_ids=[c['id']])
+    report = manager.find_duplicates()
+    assert [(group['kind'], len(group['movies'])) for group in report['groups']] == [('exact', 2)]
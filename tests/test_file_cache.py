@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+
+import main as kinoman
+
+
+class BytesCache(kinoman.LruFileCache):
+    def entry_name(self, movie):
+        return f"{movie['id']}_{movie['size']}.bin"
+
+    def put(self, movie, data):
+        def create(tmp_path):
+            if data is None:
+                return False
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            return True
+        return self._store(movie, create)
+
+
+def movie(movie_id, size=100):
+    return {'id': movie_id, 'size': size}
+
+
+def test_eviction_order_and_budget(tmp_path):
+    cache = BytesCache(str(tmp_path), max_bytes=250)
+    for movie_id in ('a', 'b'):
+        assert cache.put(movie(movie_id), bytes(100)) == f"{movie_id}_100.bin"
+    assert cache.lookup(movie('a')) == 'a_100.bin'  # 'a' стал самым недавним
+    cache.put(movie('c'), bytes(100))
+    assert sorted(os.listdir(tmp_path)) == ['a_100.bin', 'c_100.bin'] and cache._total == 200
+    assert cache.lookup(movie('b')) is None
+
+    # Изменившийся файл фильма - новая запись, старая удаляется сразу
+    cache.put(movie('a', 120), bytes(120))
+    assert sorted(os.listdir(tmp_path)) == ['a_120.bin', 'c_100.bin'] and cache._total == 220
+    # Файл больше бюджета остается, если он единственный и самый свежий
+    cache.put(movie('d'), bytes(300))
+    assert os.listdir(tmp_path) == ['d_100.bin'] and cache._total == 300
+    assert cache.put(movie('e'), None) is None and not [n for n in os.listdir(tmp_path) if n.endswith('.tmp')]
+    cache.discard('d')
+    assert os.listdir(tmp_path) == [] and cache._total == 0
+
+
+def test_order_survives_restart(tmp_path):
+    cache = BytesCache(str(tmp_path), max_bytes=1000)
+    for movie_id in ('a', 'b', 'c'):
+        cache.put(movie(movie_id), bytes(100))
+    now = time.time()
+    for age, name in enumerate(('b_100.bin', 'c_100.bin', 'a_100.bin')):
+        os.utime(tmp_path / name, (now - 100 + age, now - 100 + age))
+    (tmp_path / 'x_100.bin.123.tmp').write_bytes(b'partial')
+    # Меньший бюджет при следующем запуске: удаляются давно использованные
+    cache = BytesCache(str(tmp_path), max_bytes=200)
+    assert sorted(os.listdir(tmp_path)) == ['a_100.bin', 'c_100.bin']
+    assert list(cache._entries) == ['c_100.bin', 'a_100.bin']
+
+
+def test_entry_name_is_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        kinoman.LruFileCache(str(tmp_path), 100)
@@ -0,0 +1,109 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import main as kinoman
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """Папки библиотеки и превью во временной папке."""
+    movies_dir = tmp_path / 'movies'
+    movies_dir.mkdir()
+    (tmp_path / 'thumbnails').mkdir()
+    monkeypatch.setattr(kinoman, 'MOVIES_DIR', str(movies_dir))
+    monkeypatch.setattr(kinoman, 'THUMBNAILS_DIR', str(tmp_path / 'thumbnails'))
+    return movies_dir
+
+
+def write_video(path, shade):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+    for number in range(25):
+        writer.write(np.full((48, 64, 3), (shade + number) % 256, dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+
+def test_import_and_duplicates(make_manager, library, tmp_path):
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    source = write_video(outside / 'clip.avi', 10)
+    manager = make_manager()
+    result = manager.import_movies([source])
+    assert result['success'] and result['imported'] == 1
+    movie = result['movies'][0]
+    assert movie['path'] == str(library / 'clip.avi') and movie['fingerprint']
+    assert os.path.getsize(movie['path']) == os.path.getsize(source)
+    assert not [name for name in os.listdir(library) if name.endswith('.part')]
+
+    # Тот же файл повторно и копия под другим именем - дубликаты по отпечатку, не копируются
+    result = manager.import_movies([source])
+    assert result == {'success': False, 'error': f"Такой фильм уже есть в коллекции: {movie['title']}."}
+    copy = outside / 'copy.avi'
+    copy.write_bytes(open(source, 'rb').read())
+    other = write_video(outside / 'other.avi', 100)
+    result = manager.import_movies([str(copy), other, str(outside / 'нет.avi'), str(outside / 'text.txt')])
+    assert result['success'] and result['imported'] == 1 and result['movies'][0]['path'] == str(library / 'other.avi')
+    assert [duplicate['source'] for duplicate in result['duplicates']] == [str(copy)]
+    assert result['duplicates'][0]['movie_id'] == movie['id']
+    assert len(result['errors']) == 2
+    assert not (library / 'copy.avi').exists()
+
+    # Без пропуска дубликатов файл добавляется под свободным именем
+    result = manager.import_movies([source], skip_duplicates=False)
+    assert result['imported'] == 1 and result['movies'][0]['path'] == str(library / 'clip_1.avi')
+    # Файл, который уже лежит в библиотеке и есть в базе, пропускается
+    result = manager.import_movies([movie['path']])
+    assert result == {'success': False, 'error': 'Фильм уже существует.'}
+    assert manager.get_movie_count() == 3
+
+
+def test_import_file_modes(tmp_path):
+    source = tmp_path / 'src.avi'
+    source.write_bytes(os.urandom(300000))
+    assert kinoman.import_file(str(source), str(tmp_path / 'link.avi'), 'hardlink') == 'hardlink'
+    assert os.stat(tmp_path / 'link.avi').st_ino == os.stat(source).st_ino
+    assert kinoman.import_file(str(source), str(tmp_path / 'sym.avi'), 'symlink') == 'symlink'
+    assert os.readlink(tmp_path / 'sym.avi') == str(source)
+    reports = []
+    method = kinoman.import_file(str(source), str(tmp_path / 'copy.avi'), 'copy',
+                                 lambda copied, total: reports.append((copied, total)))
+    assert method in ('reflink', 'copy_file_range', 'sendfile', 'chunked')
+    assert (tmp_path / 'copy.avi').read_bytes() == source.read_bytes()
+    assert reports[-1] == (300000, 300000)
+    with pytest.raises(ValueError):
+        kinoman.import_file(str(source), str(tmp_path / 'x.avi'), 'move')
+
+
+def test_cancelled_copy_removes_partial_file(tmp_path):
+    source = tmp_path / 'src.avi'
+    source.write_bytes(os.urandom(300000))
+
+    def progress(copied, total):
+        raise kinoman.JobCancelled()
+
+    with pytest.raises(kinoman.JobCancelled):
+        kinoman.copy_file_fast(str(source), str(tmp_path / 'dst.avi'), progress, chunk_size=65536)
+    assert not (tmp_path / 'dst.avi').exists()
+
+
+def test_vanished_source_is_reported_per_file(make_manager, library, tmp_path, monkeypatch):
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    gone = write_video(outside / 'gone.avi', 30)
+    kept = write_video(outside / 'kept.avi', 60)
+    manager = make_manager()
+    getsize = os.path.getsize
+
+    def vanishing_getsize(path):
+        if path == gone:
+            raise FileNotFoundError(2, 'No such file or directory', path)  # Флешку извлекли после выбора файлов
+        return getsize(path)
+
+    monkeypatch.setattr(kinoman.os.path, 'getsize', vanishing_getsize)
+    for skip_duplicates in (True, False):
+        result = manager.import_movies([gone, kept], skip_duplicates=skip_duplicates)
+        assert result['success'] and len(result['errors']) == 1 and gone in result['errors'][0]
+    assert manager.get_movie_count() == 2
@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+import pytest
+
+import main as kinoman
+
+NAMES = [f"film{number:02d}.mp4" for number in range(12)]
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """Папка библиотеки с маленькими файлами; анализ видео заменен: поздние файлы обрабатываются быстрее ранних."""
+    movies_dir = tmp_path / 'movies'
+    movies_dir.mkdir()
+    for name in NAMES:
+        (movies_dir / name).write_bytes(name.encode())
+    monkeypatch.setattr(kinoman, 'MOVIES_DIR', str(movies_dir))
+    monkeypatch.setattr(kinoman, 'LIBRARY_ROOTS', [str(movies_dir)])
+    threads = set()
+
+    def fake_probe(file_path, thumbnail=False, engine=None):
+        threads.add(threading.get_ident())
+        name = os.path.basename(file_path)
+        if name == 'film05.mp4':
+            raise ValueError('битый файл')
+        time.sleep(0.002 * (len(NAMES) - NAMES.index(name)))  # Результаты приходят не по порядку
+        return {'duration': 60, 'width': 640, 'height': 360, 'video_codec': 'h264', 'audio_tracks': None,
+                'frame': None, 'thumbnail': None}
+
+    monkeypatch.setattr(kinoman, 'probe_media', fake_probe)
+    return movies_dir, threads
+
+
+def test_pool_results_keep_walk_order(make_manager, library):
+    movies_dir, threads = library
+    manager = make_manager(scan_workers=4)
+    files = [(str(movies_dir / name), os.stat(movies_dir / name)) for name in NAMES]
+    records = manager._ingest_new_files(files)
+    assert len(threads) > 1
+    # Записи в порядке входного списка; ошибка одного файла - None на его месте, остальные обработаны
+    assert [record and os.path.basename(record['path']) for record in records] == \
+        [None if name == 'film05.mp4' else name for name in NAMES]
+
+
+def test_scan_adds_records_in_walk_order(make_manager, library):
+    manager = make_manager(scan_workers=4)
+    assert manager.scan_movies(quiet=True) == len(NAMES) - 1
+    expected = [name for name in NAMES if name != 'film05.mp4']
+    assert [os.path.basename(movie['path']) for movie in manager.movies] == expected
+    # Тот же результат при одном воркере
+    single = make_manager(scan_workers=1)
+    single.movies = []
+    single.scan_movies(quiet=True)
+    assert [movie['path'] for movie in single.movies] == [movie['path'] for movie in manager.movies]
+
+
+def test_cancelled_job_skips_unstarted_files(make_manager, library):
+    movies_dir, _ = library
+
+    class Job:
+        cancelled = False
+
+        def report(self, done, total):
+            if done == 2:
+                self.cancelled = True
+
+    manager = make_manager(scan_workers=1)
+    files = [(str(movies_dir / name), os.stat(movies_dir / name)) for name in NAMES]
+    records = manager._ingest_new_files(files, Job())
+    # Обработанные до отмены файлы сохраняются, начатый дорабатывается, остальные не запускаются
+    assert len(records) == len(NAMES) and records[0] and records[1]
+    assert all(record is None for record in records[3:])
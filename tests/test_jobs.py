@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+import main as kinoman
+
+
+class Events:
+    """Заменяет UiEventBus: запоминает последнее состояние каждой задачи."""
+
+    def __init__(self):
+        self.states = {}
+
+    def publish(self, name, job, coalesce_key=None):
+        self.states.setdefault(job['id'], []).append(job['state'])
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = kinoman.JobScheduler(workers=1, events=Events(), history_size=3)
+    yield scheduler
+    scheduler.stop()
+
+
+def wait(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.is_finished and time.time() < deadline:
+        time.sleep(0.01)
+    return job.state
+
+
+def test_priority_order_and_key_dedup(scheduler):
+    order = []
+
+    def work(job, name):
+        order.append(name)
+        return name
+
+    jobs = [scheduler.submit('test', work, 'backfill', priority='backfill'),
+            scheduler.submit('test', work, 'normal'),
+            scheduler.submit('test', work, 'user', priority='user', key='k')]
+    # Та же задача по ключу; повторная постановка с более высоким приоритетом поднимает ее в очереди
+    assert scheduler.submit('test', work, 'again', key='k') is jobs[2]
+    late = scheduler.submit('test', work, 'raised', priority='backfill', key='r')
+    assert scheduler.submit('test', work, 'ignored', priority='user', key='r') is late and late.priority == 'user'
+    with pytest.raises(ValueError):
+        scheduler.submit('test', work, priority='urgent')
+    scheduler.start()
+    assert [wait(job) for job in jobs + [late]] == ['done'] * 4
+    assert order == ['user', 'raised', 'normal', 'backfill']
+    assert jobs[2].result == 'user'
+    # Завершенная задача освобождает ключ
+    assert scheduler.submit('test', work, 'next', key='k') is not jobs[2]
+
+
+def test_cancel_failures_and_history(scheduler, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def long_job(job):
+        started.set()
+        while not release.wait(0.01):
+            job.check_cancelled()
+
+    running = scheduler.submit('test', long_job)
+    queued = scheduler.submit('test', lambda job: 'never')
+    scheduler.start()
+    assert started.wait(5)
+    assert scheduler.cancel(queued.id) and queued.state == 'cancelled'  # Из очереди - сразу
+    monkeypatch.setattr(kinoman, 'job_scheduler', scheduler)
+    assert kinoman.cancel_job(running.id) == {'success': True}  # Как отменяет интерфейс
+    assert wait(running) == 'cancelled' and queued.result is None
+    assert not scheduler.cancel(running.id) and not scheduler.cancel('нет такой')
+    assert scheduler.events.states[running.id] == ['queued', 'running', 'cancelled']
+
+    failed = scheduler.submit('test', lambda job: {'success': False, 'error': 'нет места'})
+    crashed = scheduler.submit('test', lambda job: 1 / 0)
+    assert wait(failed) == 'failed' and failed.error == 'нет места'
+    assert wait(crashed) == 'failed' and 'division' in crashed.error
+    # Помнятся только последние history_size завершенных задач
+    assert [job['id'] for job in scheduler.list_jobs()] == [running.id, failed.id, crashed.id]
+    assert scheduler.get_job(queued.id) is None and scheduler.get_job(crashed.id) is crashed
+
+
+def test_backfill_leaves_a_worker_for_user_jobs():
+    scheduler = kinoman.JobScheduler(workers=2)
+    release = threading.Event()
+    try:
+        backfill = [scheduler.submit('test', lambda job: release.wait(5), priority='backfill') for _ in range(2)]
+        scheduler.start()
+        user = scheduler.submit('test', lambda job: 'ok', priority='user')
+        assert wait(user) == 'done'
+        assert [job.state for job in backfill] == ['running', 'queued']
+        release.set()
+        assert [wait(job) for job in backfill] == ['done', 'done']
+    finally:
+        release.set()
+        scheduler.stop()
@@ -0,0 +1,40 @@
+import os
+
+import main as kinoman
+from synthetic_library import make_records
+
+
+def test_lookup_by_id_and_path(make_manager, tmp_path):
+    records = make_records(200, str(tmp_path / 'movies'), seed=4)
+    manager = make_manager(movies=records)
+    movie = records[17]
+    assert manager.get_movie_details(movie['id']) == movie
+    assert manager.get_movie_details('нет такого') is None
+    # Путь сравнивается в нормализованном виде
+    directory, name = os.path.split(movie['path'])
+    assert manager.get_movie_by_path(os.path.join(directory, '.', name)) == movie
+    assert manager.get_movie_by_path(os.path.join(directory, 'sub', '..', name)) == movie
+    assert manager.get_movie_by_path(movie['path'] + '.missing') is None
+
+
+def test_indexes_follow_updates(make_manager, tmp_path):
+    records = make_records(20, str(tmp_path / 'movies'), seed=4)
+    manager = make_manager(movies=records)
+    moved = dict(records[3], path=records[3]['path'] + '.moved')
+    manager._apply_changes(upserted=[moved], deleted_ids=[records[4]['id']])
+    assert manager.get_movie_by_path(records[3]['path']) is None
+    assert manager.get_movie_by_path(moved['path']) == moved
+    assert manager.get_movie_details(records[4]['id']) is None
+    assert manager.get_movie_by_path(records[4]['path']) is None
+    assert manager.get_movie_count() == len(records) - 1
+
+
+def test_numeric_ids_become_strings(make_manager, tmp_path):
+    records = make_records(3, str(tmp_path / 'movies'), seed=4)
+    for number, movie in enumerate(records):
+        movie['id'] = number
+    kinoman.JsonMovieStorage(str(tmp_path / 'movies_db.json')).save_all(records)
+    manager = make_manager(backend='json')
+    assert manager.get_movie_details('1')['path'] == records[1]['path']
+    assert [movie['id'] for movie in kinoman.JsonMovieStorage(str(tmp_path / 'movies_db.json')).load()] == \
+        ['0', '1', '2']
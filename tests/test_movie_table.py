@@ -0,0 +1,83 @@
+import marshal
+
+import main as kinoman
+from synthetic_library import make_records
+
+
+def odd_records(tmp_path):
+    """Синтетические записи и записи из старых баз: значения, которые не помещаются в колонки."""
+    records = make_records(300, str(tmp_path / 'movies'), seed=3)
+    records[0]['rating'] = 7  # Целый рейтинг в колонке float
+    records[1]['fingerprint'] = None
+    records[2]['thumbnail'] = 'legacy.png'
+    records[3]['extra'] = [1, 2]  # Поле не из MovieTable.FIELDS
+    del records[4]['phash']
+    records[5]['inode'] = -1
+    records[6]['size'] = 2 ** 70
+    records[7]['title'] = None
+    return records
+
+
+def test_record_round_trip(tmp_path):
+    records = odd_records(tmp_path)
+    table = kinoman.MovieTable()
+    for record in records:
+        table.put(record)
+    assert len(table) == len(records)
+    assert [table.record(table.row(record['id'])) for record in records] == records
+    assert list(table.records()) == records
+
+
+def test_snapshot_state_round_trip(tmp_path):
+    records = odd_records(tmp_path)
+    table = kinoman.MovieTable()
+    for record in records:
+        table.put(record)
+    table.delete(records[10]['id'])
+    restored = kinoman.MovieTable()
+    restored.restore_state(marshal.loads(marshal.dumps(table.export_state())))
+    assert list(restored.records()) == list(table.records())
+    assert len(restored) == len(records) - 1
+    assert restored.row_by_path(records[11]['path']) == restored.row(records[11]['id'])
+
+
+def test_indexes_follow_changes(tmp_path):
+    records = odd_records(tmp_path)
+    table = kinoman.MovieTable()
+    for record in records:
+        table.put(record)
+    row = table.row(records[9]['id'])
+    assert table.row_by_path(records[9]['path']) == row
+    assert table.find('inode', records[9]['inode']) == [row]
+    assert table.find('thumbnail', 'legacy.png') == [table.row(records[2]['id'])]
+
+    table.delete(records[9]['id'])
+    assert records[9]['id'] not in table and table.row_by_path(records[9]['path']) is None
+    # Строка удаленной записи достается новой
+    moved = dict(records[9], id='new', path=records[9]['path'] + '.moved')
+    assert table.put(moved) == row and table.record(row) == moved
+    assert table.row_by_path(moved['path']) == row and table.row_by_path(records[9]['path']) is None
+
+    renamed = dict(records[12], title='Другое название')
+    table.put(renamed)
+    assert table.record(table.row(renamed['id'])) == renamed
+    assert table.find('title', 'Другое название') == [table.row(renamed['id'])]
+
+
+def test_text_column_compacts_replaced_values():
+    column = kinoman._TextColumn()
+    column.COMPACT_MIN_GARBAGE = 0
+    for row in range(10):
+        column.set(row, f'значение {row}')
+    for row in range(10):
+        column.set(row, f'новое {row}')
+    column.set(3, None)
+    assert len(column.data) < 200
+    assert [column.get(row) for row in range(10)] == [None if row == 3 else f'новое {row}' for row in range(10)]
+    assert column.find('новое 5') == [5] and column.find(None) == [3]
+
+
+def test_manager_reopens_table(make_manager, tmp_path):
+    records = odd_records(tmp_path)
+    make_manager(movies=records)
+    assert make_manager().movies == records
@@ -0,0 +1,69 @@
+import main as kinoman
+from synthetic_library import make_records
+
+
+def page_keys(manager, sort_key, filters=None, offset=0, limit=50):
+    page = manager.get_movies_page(offset, limit, sort_key, filters)
+    return page['total'], [movie['id'] for movie in page['movies']]
+
+
+def expected(records, name, descending=False, keep=lambda movie: True):
+    func = kinoman.SORT_KEY_FUNCS[name]
+    return sorted((movie for movie in records if keep(movie)), key=func, reverse=descending)
+
+
+def test_pages_follow_sort_order(make_manager, tmp_path):
+    records = make_records(300, str(tmp_path / 'movies'), seed=6)
+    manager = make_manager(movies=records)
+    for sort_key in ('title', '-title', 'year', '-rating', 'size', '-date_added'):
+        name, descending = sort_key.lstrip('-'), sort_key.startswith('-')
+        func = kinoman.SORT_KEY_FUNCS[name]
+        # Страницы подряд дают всю библиотеку без пропусков и повторов, ключи - в нужном порядке
+        ids = []
+        for offset in range(0, 300, 70):
+            total, page = page_keys(manager, sort_key, offset=offset, limit=70)
+            assert total == 300
+            ids += page
+        assert sorted(ids) == sorted(movie['id'] for movie in records)
+        by_id = {movie['id']: movie for movie in records}
+        assert [func(by_id[movie_id]) for movie_id in ids] == \
+            [func(movie) for movie in expected(records, name, descending)]
+    assert len(page_keys(manager, 'title', offset=290, limit=50)[1]) == 10
+    assert page_keys(manager, 'title', offset=1000)[1] == []
+    # Неизвестное поле - сортировка по умолчанию
+    assert page_keys(manager, 'нет такого') == page_keys(manager, kinoman.DEFAULT_SORT_KEY)
+
+
+def test_filters_and_totals(make_manager, tmp_path):
+    records = make_records(300, str(tmp_path / 'movies'), seed=6)
+    genre = records[0]['genre']
+    records[1]['genre'] = genre.upper()  # Жанр сравнивается без учета регистра
+    manager = make_manager(movies=records)
+
+    def check(filters, keep):
+        matching = expected(records, 'year', keep=keep)
+        total, ids = page_keys(manager, 'year', filters, limit=kinoman.MAX_PAGE_SIZE)
+        assert total == len(matching) and sorted(ids) == sorted(movie['id'] for movie in matching)
+        return total
+
+    assert check({'genre': genre.lower()}, lambda movie: movie['genre'].casefold() == genre.casefold()) >= 2
+    year = kinoman._as_number
+    check({'year_from': 1990, 'year_to': '2005'}, lambda movie: 1990 <= year(movie['year'], -1) <= 2005)
+    check({'year_from': '', 'min_rating': 7}, lambda movie: year(movie['rating']) >= 7)
+    check({'genre': genre, 'min_rating': '5'},
+          lambda movie: movie['genre'].casefold() == genre.casefold() and year(movie['rating']) >= 5)
+    assert page_keys(manager, 'year', {'genre': 'нет такого'}) == (0, [])
+
+
+def test_relevance_sort_with_query(make_manager, tmp_path):
+    records = make_records(50, str(tmp_path / 'movies'), seed=6)
+    records[10]['title'] = 'Уникальное название'
+    records[20]['description'] = 'Упоминает уникальное слово'
+    manager = make_manager(movies=records)
+    total, ids = page_keys(manager, 'relevance', {'query': 'уникальное'})
+    assert total == 2 and ids == [records[10]['id'], records[20]['id']]
+    # С другим полем сортировки запрос остается фильтром
+    total, ids = page_keys(manager, 'title', {'query': 'уникальное'})
+    assert total == 2 and set(ids) == {records[10]['id'], records[20]['id']}
+    # Без запроса relevance не имеет смысла - сортировка по умолчанию
+    assert page_keys(manager, 'relevance') == page_keys(manager, kinoman.DEFAULT_SORT_KEY)
@@ -0,0 +1,52 @@
+import cv2
+import numpy as np
+import pytest
+
+import main as kinoman
+
+
+@pytest.fixture
+def thumbnails_dir(tmp_path, monkeypatch):
+    directory = tmp_path / 'thumbnails'
+    directory.mkdir()
+    monkeypatch.setattr(kinoman, 'THUMBNAILS_DIR', str(directory))
+    return directory
+
+
+@pytest.fixture
+def video(tmp_path):
+    """Маленькое видео 4 секунды (100 кадров, 25 к/с), каждый кадр своего оттенка."""
+    path = str(tmp_path / 'clip.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (160, 120))
+    for number in range(100):
+        writer.write(np.full((120, 160, 3), number * 2, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_probe_with_thumbnail(video, thumbnails_dir):
+    result = kinoman.probe_media(video, thumbnail=True, engine='opencv')
+    assert (result['duration'], result['width'], result['height']) == (4, 160, 120)
+    assert result['video_codec'] == 'mjpg' and result['audio_tracks'] is None
+    assert result['frame'].size == (160, 120)
+    # Кадр взят с THUMBNAIL_POSITION длительности, а не первый
+    assert abs(result['frame'].getpixel((80, 60))[0] - 10 * 2) <= 4
+    assert result['thumbnail']
+    names = {path.name for path in thumbnails_dir.iterdir()}
+    assert names <= set(kinoman.thumbnail_files(result['thumbnail']))
+    assert {kinoman.thumbnail_file(result['thumbnail'], size, kinoman.thumbnail_format())
+            for size in kinoman.THUMBNAIL_VARIANTS} | {kinoman.thumbnail_file(result['thumbnail'])} == names
+
+
+def test_probe_without_thumbnail_and_fallbacks(video, thumbnails_dir, tmp_path, monkeypatch):
+    assert kinoman.probe_media(video, engine='opencv')['thumbnail'] is None
+    assert not list(thumbnails_dir.iterdir())
+    # ffmpeg недоступен - анализ уходит в OpenCV
+    monkeypatch.setattr(kinoman, 'find_media_tool', lambda name: str(tmp_path / 'нет' / name))
+    assert kinoman.probe_media(video, engine='ffmpeg')['width'] == 160
+    broken = tmp_path / 'broken.avi'
+    broken.write_bytes(b'not a video')
+    result = kinoman.probe_media(str(broken), thumbnail=True, engine='opencv')
+    assert result['duration'] == 0 and result['frame'] is None and result['thumbnail'] is None
+    with pytest.raises(ValueError):
+        kinoman.probe_media(video, engine='vlc')
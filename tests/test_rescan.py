@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import main as kinoman
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """Папка библиотеки; анализ видео заменен счетчиком вызовов (обработанные файлы)."""
+    movies_dir = tmp_path / 'movies'
+    (movies_dir / 'sub').mkdir(parents=True)
+    for name in ('a.mp4', 'b.mkv', 'sub/c.avi'):
+        (movies_dir / name).write_bytes(name.encode() * 10)
+    monkeypatch.setattr(kinoman, 'MOVIES_DIR', str(movies_dir))
+    monkeypatch.setattr(kinoman, 'LIBRARY_ROOTS', [str(movies_dir)])
+    probed = []
+
+    def fake_probe(file_path, thumbnail=False, engine=None):
+        probed.append(os.path.basename(file_path))
+        return {'duration': os.path.getsize(file_path), 'width': 640, 'height': 360, 'video_codec': 'h264',
+                'audio_tracks': None, 'frame': None, 'thumbnail': None}
+
+    monkeypatch.setattr(kinoman, 'probe_media', fake_probe)
+    return movies_dir, probed
+
+
+def by_name(manager):
+    return {os.path.basename(movie['path']): movie for movie in manager.movies}
+
+
+def test_unchanged_tree_is_a_no_op(make_manager, library, monkeypatch):
+    movies_dir, probed = library
+    manager = make_manager()
+    assert manager.scan_movies(quiet=True) == 3 and sorted(probed) == ['a.mp4', 'b.mkv', 'c.avi']
+    commits = []
+    monkeypatch.setattr(manager.storage, 'commit', lambda *args, **kwargs: commits.append(args))
+    version = manager.version
+    for full in (True, False):
+        assert manager.scan_movies(quiet=True, full=full) == 3
+    # Ни повторной обработки, ни записи в базу, ни изменения версии для интерфейса
+    assert len(probed) == 3 and not commits and manager.version == version
+
+
+def test_changes_are_applied_incrementally(make_manager, library):
+    movies_dir, probed = library
+    manager = make_manager()
+    manager.scan_movies(quiet=True)
+    before = by_name(manager)
+    manager.update_movie_info(before['a.mp4']['id'], 'Мое название', 'Драма', 2001, 8.5, 'Описание')
+
+    os.rename(movies_dir / 'a.mp4', movies_dir / 'sub' / 'renamed.mp4')  # Перемещение: тот же inode
+    (movies_dir / 'b.mkv').write_bytes(b'longer content' * 100)  # Изменилось содержимое
+    os.remove(movies_dir / 'sub' / 'c.avi')
+    (movies_dir / 'd.mp4').write_bytes(b'new')
+    del probed[:]
+    assert manager.scan_movies(quiet=True) == 3
+    after = by_name(manager)
+    assert sorted(after) == ['b.mkv', 'd.mp4', 'renamed.mp4']
+    # Перемещенный файл не обрабатывается заново, правки пользователя сохраняются
+    moved = after['renamed.mp4']
+    assert moved['id'] == before['a.mp4']['id'] and moved['title'] == 'Мое название'
+    assert moved['path'] == str(movies_dir / 'sub' / 'renamed.mp4')
+    assert sorted(probed) == ['b.mkv', 'd.mp4']
+    assert after['b.mkv']['id'] == before['b.mkv']['id'] and after['b.mkv']['duration'] == 1400
+
+
+def test_refresh_paths_from_watcher_events(make_manager, library):
+    movies_dir, probed = library
+    manager = make_manager()
+    manager.scan_movies(quiet=True)
+    (movies_dir / 'e.mp4').write_bytes(b'event')
+    os.remove(movies_dir / 'a.mp4')
+    assert manager.refresh_paths([str(movies_dir / 'e.mp4'), str(movies_dir / 'a.mp4')]) == 2
+    assert sorted(by_name(manager)) == ['b.mkv', 'c.avi', 'e.mp4']
+    # Пропавшая папка убирает все записи из нее
+    (movies_dir / 'sub' / 'c.avi').unlink()
+    (movies_dir / 'sub').rmdir()
+    assert manager.refresh_paths([str(movies_dir / 'sub')]) == 1
+    assert sorted(by_name(manager)) == ['b.mkv', 'e.mp4']
+    assert manager.refresh_paths([str(movies_dir / 'b.mkv')]) == 0  # Файл не изменился
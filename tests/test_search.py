@@ -0,0 +1,53 @@
+import main as kinoman
+
+MOVIES = [
+    {'title': 'Матрица', 'year': 1999, 'genre': 'Фантастика', 'description': 'Хакер узнает правду о мире.'},
+    {'title': 'Матрица: Перезагрузка', 'year': 2003, 'genre': 'Фантастика', 'description': 'Продолжение.'},
+    {'title': 'Ёлки', 'year': 2010, 'genre': 'Комедия', 'description': 'Новогодние истории.'},
+    {'title': 'Мир', 'year': 2001, 'genre': 'Драма', 'description': 'Фильм о матрице жизни.'},
+    {'title': 'Интерстеллар', 'year': 2014, 'genre': 'Фантастика', 'description': 'Полет сквозь червоточину.'},
+]
+
+
+def build(movies=MOVIES):
+    index = kinoman.SearchIndex()
+    index.build(enumerate(movies))
+    return index
+
+
+def test_exact_prefix_and_ranking():
+    index = build()
+    assert index.search('матрица') == [0, 1]  # Слово из названия весит больше, чем похожее в описании
+    assert set(index.search('матр')) == {0, 1, 3}  # По префиксу, включая "матрице" в описании
+    assert index.search('матр')[-1] == 3
+    assert index.search('матрица 2003') == [1]  # Все слова запроса
+    assert index.search('елки') == [2] and index.search('Ёлки') == [2]
+    assert index.search('') == [] and index.search('несуществующее') == []
+    assert len(index.search('фантастика', limit=2)) == 2
+
+
+def test_fuzzy_matching():
+    index = build()
+    assert index.search('интерстелар') == [4]  # Пропущена буква
+    assert index.search('матрциа')[:2] == [0, 1]  # Переставлены соседние буквы; название выше описания
+    assert index.search('комдия') == [2]
+    assert index.search('2011') == []  # Числа нечетко не сравниваются
+    assert index.search('мур') == []  # Короткие слова - тоже
+
+
+def test_updates_and_delta_merge():
+    movies = [{'title': f'Фильм {n}', 'year': 2000, 'genre': 'Драма', 'description': ''} for n in range(1500)]
+    index = build(movies)
+    index.remove(0)
+    index.add(0, {'title': 'Совсем другое', 'year': 1990, 'genre': 'Драма', 'description': ''})
+    assert index.search('совсем') == [0] and index.search('фильм 0') == []
+    # Больше изменений, чем порог слияния добавки с основой
+    for row in range(1, 1200):
+        index.remove(row)
+        index.add(row, {'title': f'Кино {row}', 'year': 2000, 'genre': 'Драма', 'description': ''})
+    assert index.search('кино 7')[0] == 7 and 1007 not in index.search('кино 7')
+    assert index.search('фильм 7') == []
+    assert index.search('фильм 1300') == [1300]
+    assert len(index.search('драма')) == 1500
+    found = index.search('кинл 5')  # Опечатка в слове из добавки индекса
+    assert found[0] == 5 and all(row < 1200 for row in found)
@@ -0,0 +1,52 @@
+import os
+import time
+
+import main as kinoman
+from synthetic_library import make_records
+
+
+def test_snapshot_follows_database_generation(make_manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(kinoman, 'SNAPSHOT_WRITE_DELAY', 0.05)
+    records = make_records(40, str(tmp_path / 'movies'), seed=7)
+    make_manager(movies=records)
+    manager = make_manager(snapshot=True)
+    assert not manager.loaded_from_snapshot
+    assert manager.save_snapshot() and not manager.save_snapshot()  # Без изменений базы не переписывается
+
+    # Изменение базы само ведет к новой записи снимка
+    changed = dict(records[0], title='Новое название')
+    manager._apply_changes(upserted=[changed])
+    deadline = time.time() + 5
+    while manager._snapshot_stamp != manager.storage.stamp() and time.time() < deadline:
+        time.sleep(0.01)
+    assert manager._snapshot_stamp == manager.storage.stamp()
+    manager.storage.close()
+
+    reopened = make_manager(snapshot=True)
+    assert reopened.loaded_from_snapshot
+    assert reopened.get_movie_details(changed['id'])['title'] == 'Новое название'
+    reopened.storage.close()
+
+    # База изменилась без снимка (другой номер изменения) - снимок не используется
+    storage = kinoman.open_movie_storage(str(tmp_path / 'movies_db.json'))
+    storage.commit(None, deleted_ids=[records[1]['id']])
+    storage.close()
+    stale = make_manager(snapshot=True)
+    assert not stale.loaded_from_snapshot
+    assert len(stale.movies) == len(records) - 1
+    assert os.path.exists(tmp_path / 'movies_db.snapshot')
+
+
+def test_failed_open_reaches_exposed_calls(monkeypatch):
+    def fail(db_file):
+        raise kinoman.sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(kinoman, 'MovieManager', fail)
+    monkeypatch.setattr(kinoman, 'movie_manager', None)
+    monkeypatch.setattr(kinoman, '_library_error', None)
+    monkeypatch.setattr(kinoman, '_library_loader', None)
+    kinoman.open_library()
+    assert kinoman.movie_manager is None and kinoman._library_error == 'database is locked'
+    # Вызов из интерфейса получает причину, а не AttributeError у None
+    assert kinoman.get_movies_page() == {'success': False,
+                                         'error': "Не удалось открыть библиотеку: database is locked"}
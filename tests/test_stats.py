@@ -0,0 +1,43 @@
+import main as kinoman
+from synthetic_library import make_records
+
+
+def recomputed(movies):
+    stats = kinoman.LibraryStats()
+    for movie in movies:
+        stats.add(movie)
+    return stats.to_dict()
+
+
+def test_totals_follow_changes(make_manager, tmp_path):
+    records = make_records(300, str(tmp_path / 'movies'), seed=15)
+    manager = make_manager(movies=records)
+    assert manager.get_movies_stats() == recomputed(records)
+    stats = manager.get_movies_stats()
+    assert stats['total_movies'] == 300 and stats['total_size'] == sum(movie['size'] for movie in records)
+
+    # Изменения по одной записи, в том числе смена группы (жанр, год) и значения без числа
+    changed = [dict(records[0], genre='Новый жанр', size=records[0]['size'] + 10**9, duration=7200),
+               dict(records[1], year='Неизвестен', rating='нет'),
+               dict(records[2], rating=10.0)]
+    manager._apply_changes(upserted=changed, deleted_ids=[records[3]['id'], records[4]['id']])
+    manager._apply_changes(deleted_ids=[movie['id'] for movie in records[5:40]])
+    manager._apply_changes(upserted=[dict(records[50], id='копия', path=records[50]['path'] + '.copy')])
+    stats = manager.get_movies_stats()
+    assert stats == recomputed(manager.movies)
+    assert stats['total_movies'] == 300 - 37 + 1
+    genres = {group['key']: group for group in stats['groups']['genre']}
+    assert genres['Новый жанр']['count'] == 1 and genres['Новый жанр']['duration'] == 7200
+
+
+def test_empty_groups_disappear(make_manager, tmp_path):
+    records = make_records(10, str(tmp_path / 'movies'), seed=15)
+    for movie in records:
+        movie['genre'] = 'Драма'
+    records[0]['genre'] = 'Редкий'
+    manager = make_manager(movies=records)
+    manager._apply_changes(upserted=[dict(records[0], genre='Драма')])
+    assert [group['key'] for group in manager.get_movies_stats()['groups']['genre']] == ['Драма']
+    manager._apply_changes(deleted_ids=[movie['id'] for movie in records])
+    assert manager.get_movies_stats() == recomputed([])
+    assert manager.get_movies_stats()['avg_rating'] == 0.0
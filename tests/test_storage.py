@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+
+import pytest
+
+import main as kinoman
+from synthetic_library import make_records
+
+
+@pytest.fixture
+def records(tmp_path):
+    records = make_records(50, str(tmp_path / 'movies'), seed=5)
+    records[0]['description'] = 'Строка с "кавычками"\\nи переводом строки'
+    records[1]['audio_tracks'] = []
+    return records
+
+
+def test_json_round_trip(tmp_path, records):
+    storage = kinoman.JsonMovieStorage(str(tmp_path / 'movies_db.json'))
+    storage.save_all(iter(records))
+    assert list(storage.load()) == records
+    # Тот же формат, что у json.dump(..., indent=4)
+    with open(storage.path, encoding='utf-8') as f:
+        assert f.read() == json.dumps(records, indent=4, ensure_ascii=False)
+
+
+def test_json_empty_and_corrupt(tmp_path, records, capsys):
+    storage = kinoman.JsonMovieStorage(str(tmp_path / 'movies_db.json'))
+    storage.save_all([])
+    assert list(storage.load()) == []
+    storage.save_all(records[:3])
+    with open(storage.path, 'r+', encoding='utf-8') as f:
+        text = f.read()
+        f.seek(0)
+        f.truncate()
+        f.write(text[:-10])
+    # Записи до места повреждения сохраняются, поврежденный файл откладывается
+    assert list(storage.load()) == records[:2]
+    assert not os.path.exists(storage.path)
+    assert any(name.startswith('movies_db.json.corrupt-') for name in os.listdir(tmp_path))
+
+
+def test_sqlite_round_trip(tmp_path, records):
+    storage = kinoman.SqliteMovieStorage(str(tmp_path / 'movies_db.sqlite3'))
+    storage.save_all(records)
+    assert list(storage.load(batch_size=7)) == records
+    stamp = storage.stamp()
+    changed = dict(records[3], title='Новое название')
+    storage.commit(None, upserted=[changed], deleted_ids=[records[4]['id']])
+    assert storage.stamp() != stamp
+    expected = [changed if movie is records[3] else movie for movie in records if movie is not records[4]]
+    assert list(storage.load()) == expected
+    storage.close()
+
+
+def test_migration_runs_in_background(make_manager, tmp_path, records):
+    kinoman.JsonMovieStorage(str(tmp_path / 'movies_db.json')).save_all(records)
+    manager = make_manager()
+    # Открытие не ждет переноса: записи читаются из JSON
+    assert manager.storage.pending_migration is not None
+    assert manager.movies == records
+
+    # Изменения во время переноса не теряются
+    changed = dict(records[0], title='Изменено до переноса')
+    manager._apply_changes(upserted=[changed], deleted_ids=[records[1]['id']])
+    expected = [changed] + records[2:]
+    assert list(kinoman.JsonMovieStorage(str(tmp_path / 'movies_db.json')).load()) == expected
+
+    assert manager.migrate_storage(batch_size=10) == len(expected)
+    assert manager.storage.pending_migration is None
+    assert os.path.exists(tmp_path / 'movies_db.json.migrated')
+    assert not os.path.exists(tmp_path / 'movies_db.json')
+    assert list(manager.storage.load()) == expected
+    assert manager.migrate_storage() == 0
+
+
+def test_interrupted_migration_restarts(make_manager, tmp_path, records):
+    kinoman.JsonMovieStorage(str(tmp_path / 'movies_db.json')).save_all(records)
+    manager = make_manager()
+    manager.storage.migrate_batch(records[:10])  # Прерванный перенос: в SQLite только часть записей
+    manager.storage.close()
+
+    manager = make_manager()
+    assert manager.storage.pending_migration is not None
+    assert manager.movies == records
+    manager.migrate_storage()
+    manager.storage.close()
+    assert make_manager().movies == records
+
+
+def test_indexes_are_built_on_first_use(make_manager, records):
+    make_manager(movies=records)
+    manager = make_manager()
+    assert manager._search_index is None and manager._sorted == {}
+    page = manager.get_movies_page(0, 5, 'title')
+    assert [movie['id'] for movie in page['movies']] == \
+        [movie['id'] for movie in sorted(records, key=lambda m: (m['title'].casefold(), m['id']))[:5]]
+    assert list(manager._sorted) == ['title']
+    assert manager.search_movies(records[7]['title'])[0]['id'] == records[7]['id']
+    # Большая пачка изменений сбрасывает индексы вместо обновления по одной записи
+    manager._apply_changes(upserted=[dict(movie, rating=1.0) for movie in records] * 21)
+    assert manager._search_index is None and manager._sorted == {}
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_storage_is_written_outside_the_manager_lock(make_manager, tmp_path, records, backend, monkeypatch):
+    manager = make_manager(backend=backend, movies=records[:20])
+    commit = manager.storage.commit
+    lock_was_free = []
+
+    def probe():
+        if manager._lock.acquire(blocking=False):
+            manager._lock.release()
+            lock_was_free.append(True)
+        else:
+            lock_was_free.append(False)
+
+    def checked_commit(movies, upserted=(), deleted_ids=()):
+        # Другой поток (например, интерфейс) может читать базу, пока идет запись
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        assert manager._pending_writes  # Изменение снимается с очереди только после записи
+        commit(movies, upserted=upserted, deleted_ids=deleted_ids)
+
+    monkeypatch.setattr(manager.storage, 'commit', checked_commit)
+    with manager._lock:  # Чтение и изменение одним блоком: запись - после выхода из внешнего блока
+        movie = manager.get_movie_details(records[0]['id'])
+        manager._apply_changes(upserted=[dict(movie, title='Новое')], deleted_ids=[records[1]['id']])
+        assert not lock_was_free
+    assert lock_was_free == [True] and not manager._pending_writes
+    loaded = {movie['id']: movie for movie in make_manager(backend=backend).movies}
+    assert loaded[records[0]['id']]['title'] == 'Новое' and records[1]['id'] not in loaded
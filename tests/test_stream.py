@@ -0,0 +1,86 @@
+import os
+
+import bottle
+import pytest
+
+import main as kinoman
+
+DATA = os.urandom(1000)
+
+
+@pytest.fixture
+def stream(make_manager, tmp_path, monkeypatch):
+    """Библиотека из одного файла и функция запроса к /stream/<id> с заголовками."""
+    movies_dir = tmp_path / 'movies'
+    movies_dir.mkdir()
+    (movies_dir / 'film.mp4').write_bytes(DATA)
+    (tmp_path / 'outside.mp4').write_bytes(DATA)
+    manager = make_manager()
+    manager._apply_changes(upserted=[
+        {'id': 'a', 'title': 'Фильм', 'path': str(movies_dir / 'film.mp4'), 'size': len(DATA)},
+        {'id': 'b', 'title': 'Вне библиотеки', 'path': str(tmp_path / 'outside.mp4'), 'size': len(DATA)},
+    ])
+    monkeypatch.setattr(kinoman, 'movie_manager', manager)
+    monkeypatch.setattr(kinoman, 'LIBRARY_ROOTS', [str(movies_dir)])
+    # Свои слоты раздачи: ответы, тело которых тест не читает, не занимают общие
+    monkeypatch.setattr(kinoman, '_stream_slots', kinoman.threading.BoundedSemaphore(kinoman.STREAM_MAX_CONCURRENT))
+
+    def request(movie_id='a', method='GET', **headers):
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': f'/stream/{movie_id}'}
+        environ.update((f"HTTP_{name.upper()}", value) for name, value in headers.items())
+        bottle.request.bind(environ)
+        return kinoman.stream_movie(movie_id)
+
+    return request
+
+
+def body_of(response):
+    body = response.body
+    try:
+        return b''.join(body)
+    finally:
+        body.close()  # Освобождает слот раздачи
+
+
+def test_full_and_range_responses(stream):
+    response = stream()
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == str(len(DATA)) and response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Type'] == 'video/mp4'
+    assert body_of(response) == DATA
+
+    for header, (start, end) in (('bytes=100-199', (100, 199)), ('bytes=900-', (900, 999)),
+                                 ('bytes=-50', (950, 999)), ('bytes=990-5000', (990, 999))):
+        response = stream(range=header)
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == f"bytes {start}-{end}/{len(DATA)}"
+        assert response.headers['Content-Length'] == str(end - start + 1)
+        assert body_of(response) == DATA[start:end + 1]
+
+    response = stream(range='bytes=1000-')
+    assert response.status_code == 416 and response.headers['Content-Range'] == f"bytes */{len(DATA)}"
+    assert stream(range='items=0-1').status_code == 200  # Непонятный заголовок - файл целиком
+    response = stream(method='HEAD', range='bytes=0-9')
+    assert response.status_code == 206 and not response.body
+
+
+def test_conditional_requests(stream):
+    etag = stream(method='HEAD').headers['ETag']
+    last_modified = stream(method='HEAD').headers['Last-Modified']
+    assert stream(if_none_match=etag).status_code == 304
+    assert stream(if_none_match='"другой"').status_code == 200
+    assert stream(if_modified_since=last_modified).status_code == 304
+    # If-Range: диапазон отдается, только если файл не изменился
+    assert stream(range='bytes=0-9', if_range=etag).status_code == 206
+    assert stream(range='bytes=0-9', if_range='"устаревший"').status_code == 200
+
+
+def test_only_library_files_are_served(stream, monkeypatch):
+    assert stream('b').status_code == 404
+    assert stream('нет такого').status_code == 404
+    # Все слоты раздачи заняты - 503, браузер повторит запрос
+    monkeypatch.setattr(kinoman, '_stream_slots', kinoman.threading.BoundedSemaphore(1))
+    first = stream()
+    assert stream().status_code == 503
+    body_of(first)
+    assert stream().status_code == 200
@@ -0,0 +1,143 @@
+import os
+import time
+
+import bottle
+import numpy as np
+import pytest
+from PIL import Image
+
+import main as kinoman
+
+BASE = {'id': 'a', 'title': 'Фильм', 'path': '/movies/a.mkv', 'size': 5}
+
+
+@pytest.fixture
+def thumbnails_dir(tmp_path, monkeypatch):
+    directory = tmp_path / 'thumbnails'
+    (directory / 'sprites').mkdir(parents=True)
+    monkeypatch.setattr(kinoman, 'THUMBNAILS_DIR', str(directory))
+    return directory
+
+
+def make_image(seed):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 255, (270, 480, 3), dtype=np.uint8))
+
+
+def get_thumbnail(size, name, accept=''):
+    bottle.request.bind({'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT': accept, 'PATH_INFO': '/'})
+    return kinoman.serve_thumbnail(size, name)
+
+
+def test_thumb_content_negotiation(thumbnails_dir):
+    key, files = kinoman.encode_thumbnail(make_image(1))
+    kinoman.store_thumbnail_files(files)
+    fmt = kinoman.thumbnail_format()
+
+    response = get_thumbnail('retina', key, f'image/{fmt},*/*')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith(f'image/{fmt}')
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert response.headers['Vary'] == 'Accept'
+    # Браузер без поддержки формата получает JPEG размера grid
+    response = get_thumbnail('retina', key, 'image/jpeg')
+    assert response.headers['Content-Type'].startswith('image/jpeg')
+    assert os.path.basename(response.body.name) == kinoman.thumbnail_file(key)
+
+    (thumbnails_dir / 'legacy.png').write_bytes(b'png')
+    assert get_thumbnail('detail', 'legacy.png', 'image/webp').headers['Content-Type'].startswith('image/png')
+    for size, name in (('huge', key), ('grid', '..'), ('grid', '.hidden'), ('grid', 'missing')):
+        assert get_thumbnail(size, name).status_code == 404
+
+
+def test_thumbnail_gc(make_manager, thumbnails_dir):
+    key, files = kinoman.encode_thumbnail(make_image(2))
+    orphan_key, orphan_files = kinoman.encode_thumbnail(make_image(3))
+    kinoman.store_thumbnail_files(files)
+    kinoman.store_thumbnail_files(orphan_files)
+    manager = make_manager()
+    manager._apply_changes(upserted=[dict(BASE, thumbnail=key), dict(BASE, id='b', path='/b', thumbnail='legacy.png')])
+    for name in ('legacy.png', 'orphan.jpg', 'unfinished.jpg.1234.tmp', 'young.jpg'):
+        (thumbnails_dir / name).write_bytes(b'12345')
+    old = time.time() - 10000
+    for name in os.listdir(thumbnails_dir):
+        if name not in ('young.jpg', 'sprites'):
+            os.utime(thumbnails_dir / name, (old, old))
+
+    result = manager.collect_thumbnail_garbage()
+    assert result['success'] and result['removed'] == len(orphan_files) + 2
+    assert sorted(os.listdir(thumbnails_dir)) == sorted(list(files) + ['legacy.png', 'sprites', 'young.jpg'])
+
+
+def test_released_thumbnail_is_removed(make_manager, thumbnails_dir):
+    key, files = kinoman.encode_thumbnail(make_image(4))
+    kinoman.store_thumbnail_files(files)
+    manager = make_manager()
+    manager._apply_changes(upserted=[dict(BASE, thumbnail=key), dict(BASE, id='b', path='/b', thumbnail=key)])
+    manager._apply_changes(deleted_ids=['a'])
+    assert all((thumbnails_dir / name).exists() for name in files)  # Превью еще у записи 'b'
+    manager._apply_changes(deleted_ids=['b'])
+    assert not any((thumbnails_dir / name).exists() for name in files)
+
+
+def test_update_thumbnail_recomputes_phash(make_manager, thumbnails_dir, tmp_path, monkeypatch):
+    import tkinter
+    from tkinter import filedialog
+
+    old_image, new_image = make_image(5), make_image(6)
+    key, files = kinoman.encode_thumbnail(old_image)
+    kinoman.store_thumbnail_files(files)
+    manager = make_manager()
+    manager._apply_changes(upserted=[dict(BASE, thumbnail=key, phash=kinoman.perceptual_hash(old_image))])
+
+    chosen = tmp_path / 'poster.png'
+    new_image.save(chosen)
+
+    class Root:  # Диалог выбора файла без окна
+        def withdraw(self):
+            pass
+
+        def attributes(self, *args):
+            pass
+
+        def destroy(self):
+            pass
+
+    monkeypatch.setattr(tkinter, 'Tk', Root)
+    monkeypatch.setattr(filedialog, 'askopenfilename', lambda **kwargs: str(chosen))
+    result = manager.update_movie_thumbnail('a')
+    assert result['success'] and result['thumbnail'] != key
+    movie = manager.get_movie_details('a')
+    assert movie['thumbnail'] == result['thumbnail']
+    assert movie['phash'] == kinoman.perceptual_hash(new_image)
+    assert not any((thumbnails_dir / name).exists() for name in files)
+
+
+def test_thumbnails_survive_format_change(make_manager, thumbnails_dir, monkeypatch):
+    monkeypatch.setattr(kinoman, 'THUMBNAIL_FORMAT', 'webp')
+    kinoman.thumbnail_format.cache_clear()
+    key, files = kinoman.encode_thumbnail(make_image(5))
+    kinoman.store_thumbnail_files(files)
+    assert kinoman.thumbnail_file(key, 'retina', 'webp') in files
+    # Формат сменился (или Pillow потерял поддержку WebP): старые ключи остаются в WebP
+    monkeypatch.setattr(kinoman, 'THUMBNAIL_FORMAT', 'jpeg')
+    kinoman.thumbnail_format.cache_clear()
+    try:
+        response = get_thumbnail('retina', key, 'image/webp,*/*')
+        assert os.path.basename(response.body.name) == kinoman.thumbnail_file(key, 'retina', 'webp')
+        response = get_thumbnail('retina', key, 'image/jpeg')
+        assert os.path.basename(response.body.name) == kinoman.thumbnail_file(key)
+
+        manager = make_manager()
+        manager._apply_changes(upserted=[dict(BASE, thumbnail=key)])
+        stale = thumbnails_dir / f"{key}-huge.webp"  # Размер, которого больше нет в THUMBNAIL_VARIANTS
+        stale.write_bytes(b'12345')
+        old = time.time() - 10000
+        for name in os.listdir(thumbnails_dir):
+            os.utime(thumbnails_dir / name, (old, old))
+        assert manager.collect_thumbnail_garbage()['removed'] == 1
+        assert sorted(os.listdir(thumbnails_dir)) == sorted(list(files) + ['sprites'])
+        manager._apply_changes(deleted_ids=[BASE['id']])
+        assert os.listdir(thumbnails_dir) == ['sprites']
+    finally:
+        kinoman.thumbnail_format.cache_clear()
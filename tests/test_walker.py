@@ -0,0 +1,67 @@
+import os
+
+import main as kinoman
+
+
+def make_tree(root):
+    for name in ('b.mp4', 'a.MKV', 'notes.txt', 'x/c.avi', 'x/y/d.mp4', 'z/e.webm'):
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'1')
+    os.symlink(root / 'x', root / 'link')  # По ссылкам на папки обход не ходит
+
+
+def names(files, root):
+    return [os.path.relpath(path, root) for path, _ in files]
+
+
+def test_walk_order_and_filtering(tmp_path):
+    root = tmp_path / 'movies'
+    make_tree(root)
+    files, unreadable = kinoman.LibraryWalker(settle=0).walk([str(root), str(tmp_path / 'нет')])
+    # Видео папки по имени, затем подпапки по имени - порядок не зависит от файловой системы
+    assert names(files, root) == ['a.MKV', 'b.mp4', 'x/c.avi', 'x/y/d.mp4', 'z/e.webm']
+    assert all(st is not None and st.st_size == 1 for _, st in files)
+    assert unreadable == [str(tmp_path / 'нет')]
+
+
+def test_unchanged_directories_are_not_reread(tmp_path, monkeypatch):
+    root = tmp_path / 'movies'
+    make_tree(root)
+    walker = kinoman.LibraryWalker(settle=0)
+    walker.walk([str(root)])
+    scanned = []
+    scan_directory = kinoman.LibraryWalker._scan_directory
+
+    def recording_scan(directory, files):
+        scanned.append(os.path.relpath(directory, root))
+        return scan_directory(directory, files)
+
+    monkeypatch.setattr(kinoman.LibraryWalker, '_scan_directory', staticmethod(recording_scan))
+    files, _ = walker.walk([str(root)])
+    assert scanned == [] and all(st is None for _, st in files)  # Из кэша, без stat файлов
+    assert names(files, root) == ['a.MKV', 'b.mp4', 'x/c.avi', 'x/y/d.mp4', 'z/e.webm']
+
+    # Новый файл меняет mtime только своей папки: перечитывается она одна
+    (root / 'x' / 'y' / 'new.mp4').write_bytes(b'22')
+    files, _ = walker.walk([str(root)])
+    assert scanned == ['x/y']
+    stats = dict(zip(names(files, root), (st for _, st in files)))
+    assert stats['x/y/new.mp4'].st_size == 2 and stats['x/y/d.mp4'] is not None and stats['x/c.avi'] is None
+
+    # Полный обход читает все папки; удаленная папка выпадает из кэша
+    del scanned[:]
+    (root / 'z' / 'e.webm').unlink()
+    (root / 'z').rmdir()
+    files, _ = walker.walk([str(root)], use_cache=False)
+    assert sorted(scanned) == ['.', 'x', 'x/y']
+    assert str(root / 'z') not in walker._dirs
+
+
+def test_recently_changed_directory_is_not_cached(tmp_path):
+    root = tmp_path / 'movies'
+    make_tree(root)
+    walker = kinoman.LibraryWalker(settle=3600)  # mtime в пределах settle: изменение могло быть в ту же секунду
+    walker.walk([str(root)])
+    files, _ = walker.walk([str(root)])
+    assert all(st is not None for _, st in files)